@@ -6,6 +6,10 @@ under GNU GPL v3, see LICENSE for details
 
 from sys import exit
 
+import metrics
+import transfer
+from boards import Board
+
 def cmdline(cfg, display, board, c):
     print(c.YELLOW, "sshchan-admin", c.BLACK)
     while True:
@@ -27,10 +31,33 @@ c.GREEN, "list|ls - ", c.BLACK, "lists boards\n",
 c.GREEN, "rename [name] [new description] - ", c.BLACK,
 "changes the description of board [name] to [new description]\n", 
 
+c.GREEN, "cache - ", c.BLACK, "shows cache hits and misses of this session\n",
+
+c.GREEN, "export [file] [name ...] - ", c.BLACK,
+"writes boards [name ...] (or all boards) to [file]\n",
+
+c.GREEN, "import [file] [name[:new name] ...] - ", c.BLACK,
+"adds boards from an export in [file],\n\
+renumbering posts that clash with existing ones\n",
+
+c.GREEN, "metrics - ", c.BLACK,
+"sums up the recorded metrics (see metrics in docs/config.md)\n",
+
+c.GREEN, "migrate - ", c.BLACK,
+"rewrites board files in the format set by index_format\n",
+
+c.GREEN, "prune [name] - ", c.BLACK,
+"moves old threads of board [name] (or all boards) to the archive\n",
+
+c.GREEN, "rerender [all] - ", c.BLACK,
+"renders posts stored with outdated markup again\n\
+(all posts if all is given)\n",
+
 c.GREEN, "exit - ", c.BLACK, "exits sshchan-admin")
 
         elif cmd_argv[0] in ("list", "ls"):
             display.printBoards()
+            display.flush()
 
         elif cmd_argv[0] == "add":
             if len(cmd_argv) > 2:
@@ -55,7 +82,10 @@ separated by whitespace.", c.BLACK)
                 answer = str(input("Are you sure you want to delete \
 board /" + board.name + "/? (y/n): "))
                 if answer == "y":
+                    name = board.name
                     if board.delBoard():
+                        # Only once the board is gone for sure.
+                        display.archive.deleteBoard(name)
                         print(c.GREEN, "Board deleted succesfully.", c.BLACK)
                     else:
                         print(c.RED, "Board deletion failed.", c.BLACK)
@@ -71,7 +101,9 @@ board /" + board.name + "/? (y/n): "))
                 newdesc = ''
                 for word in cmd_argv[2:]:
                     newdesc += word + ' ' 
+                oldname = board.name
                 if board.rename(newname, newdesc):
+                    display.archive.renameBoard(oldname, newname)
                     print(c.GREEN, "Board renamed successfully.", c.BLACK)
                 else:
                     print(c.RED, "Failed to rename board.", c.BLACK)
@@ -80,6 +112,106 @@ board /" + board.name + "/? (y/n): "))
                     c.RED, "Please specify the board and its new description.",
                     c.BLACK)
 
+        elif cmd_argv[0] == "cache":
+            stats = cfg.cacheStats()
+            if display.page_cache is not None:
+                stats["pages"] = display.page_cache.stats()
+            if not stats:
+                print("No caches in use.")
+            for name, values in stats.items():
+                print(c.GREEN, name + ":", c.BLACK, ", ".join(
+                    "{} {}".format(key, value)
+                    for key, value in values.items()))
+
+        elif cmd_argv[0] == "metrics":
+            try:
+                summary = metrics.summary(cfg.metrics_path)
+            except FileNotFoundError:
+                summary = {}
+                print("No metrics recorded.")
+            for name, (runs, median, p90, split, read, output,
+                       rejected) in sorted(
+                    summary.items(), key=lambda item: -item[1][0]):
+                print(c.GREEN, name + ":", c.BLACK, runs, "runs,",
+                      median, "ms median,", p90, "ms 90th percentile,",
+                      read, "bytes read,", output, "bytes sent")
+                print("   ", ", ".join(
+                    "{} {:.1f} ms".format(category, ms) for category, ms in
+                    sorted(split.items(), key=lambda item: -item[1])))
+                if rejected:
+                    print("    posts rejected:", ", ".join(
+                        "{} {}".format(reason, count)
+                        for reason, count in sorted(rejected.items())))
+
+        elif cmd_argv[0] == "export":
+            if len(cmd_argv) > 1:
+                boardlist = cfg.getBoardlist()
+                names = cmd_argv[2:] or list(boardlist)
+                unknown = [name for name in names if name not in boardlist]
+                if unknown:
+                    print(c.RED, "No such board:", " ".join(unknown), c.BLACK)
+                    continue
+                try:
+                    exported = transfer.export_boards(cfg, cmd_argv[1], names)
+                except OSError as e:
+                    print(c.RED, "Export failed:", e, c.BLACK)
+                    continue
+                for name, posts in exported:
+                    print(c.GREEN, "/" + name + "/:", c.BLACK, posts,
+                          "posts exported.")
+            else:
+                print(c.RED, "Please specify the file to export to.", c.BLACK)
+
+        elif cmd_argv[0] == "import":
+            if len(cmd_argv) > 1:
+                names = None
+                if len(cmd_argv) > 2:
+                    names = {}
+                    for arg in cmd_argv[2:]:
+                        name, _, new_name = arg.partition(":")
+                        names[name] = new_name or name
+                try:
+                    imported = transfer.import_boards(cfg, cmd_argv[1], names)
+                except (OSError, ValueError) as e:
+                    print(c.RED, "Import failed:", e, c.BLACK)
+                    continue
+                for name, posts, offset in imported:
+                    print(c.GREEN, "/" + name + "/:", c.BLACK, posts,
+                          "posts imported", end="")
+                    if offset:
+                        print(", numbers moved up by", offset, end="")
+                    print(".")
+            else:
+                print(c.RED, "Please specify the file to import.", c.BLACK)
+
+        elif cmd_argv[0] == "migrate":
+            migrated = cfg.storage.migrate()
+            for path, size, new_size in migrated:
+                print(c.GREEN, path + ":", c.BLACK, size, "->", new_size,
+                      "bytes")
+            print(len(migrated), "files migrated to", cfg.index_format,
+                  "format.")
+
+        elif cmd_argv[0] == "prune":
+            boardlist = cfg.getBoardlist()
+            names = cmd_argv[1:] or list(boardlist)
+            unknown = [name for name in names if name not in boardlist]
+            if unknown:
+                print(c.RED, "No such board:", " ".join(unknown), c.BLACK)
+                continue
+            for name in names:
+                count = display.archive.prune(Board(name, config=cfg))
+                print(c.GREEN, "/" + name + "/:", c.BLACK, count,
+                      "threads archived.")
+
+        elif cmd_argv[0] == "rerender":
+            everything = len(cmd_argv) > 1 and cmd_argv[1] == "all"
+            for name in cfg.getBoardlist():
+                count = Board(name, config=cfg,
+                              marker=display.marker).rerender(everything)
+                print(c.GREEN, "/" + name + "/:", c.BLACK, count,
+                      "posts rendered.")
+
         elif cmd_argv[0] == "exit":
             break
 
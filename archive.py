@@ -0,0 +1,213 @@
+"""
+Archive of threads pruned off the boards.
+
+Threads that fall beyond archive_pages pages of their board, or that
+nobody posted in for archive_days days, are moved out of the board into
+compressed, read-only archive segments, so the live board stays small.
+Archived threads can still be read with the archive command.
+
+Every board has a directory rootdir/archive/<name> holding its segments,
+each a compressed JSON list of threads in the board index format, and a
+manifest (see Manifest) listing the archived threads and where they are.
+
+Segments are gzip files, or zstd if archive_compression is "zstd" and
+the zstandard module is installed.
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import collections
+import gzip
+import json
+import logging
+import os
+import shutil
+import time
+
+import cache
+import storage
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def compress(data, method):
+    if method == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=9)
+
+
+def decompress(data, path):
+    if path.endswith(".zst"):
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+class Manifest(storage.LineFile):
+    """Archived threads of a board.
+
+    One JSON list per line, [thread_id, subject, number of replies,
+    timestamp of the last post, segment file name], appended after the
+    thread is taken off the board.
+    """
+
+    def reset(self):
+        self.threads = collections.OrderedDict()
+
+    def parse(self, line):
+        entry = json.loads(line)
+        self.threads[entry[0]] = entry
+
+
+class Archive():
+    """Archived threads of all boards."""
+
+    def __init__(self, config):
+        self.config = config
+        # (board name) -> Manifest.
+        self.manifests = {}
+        # Parsed segments.
+        self.segments = cache.FileCache(4)
+
+    def boardPath(self, name):
+        return os.path.join(self.config.root, "archive", name)
+
+    def manifest(self, name):
+        """Return the board's up to date Manifest."""
+        if name not in self.manifests:
+            self.manifests[name] = Manifest(
+                os.path.join(self.boardPath(name), "manifest"))
+        self.manifests[name].refresh()
+        return self.manifests[name]
+
+    def loadSegment(self, path):
+        with open(path, 'rb') as f:
+            threads = json.loads(decompress(f.read(), path))
+        return {thread[0]: thread for thread in threads}
+
+    def getThread(self, name, thread_id):
+        """Return an archived thread, or None."""
+        entry = self.manifest(name).threads.get(thread_id)
+        if entry is None:
+            return None
+        path = os.path.join(self.boardPath(name), entry[4])
+        return self.segments.get(path, self.loadSegment).get(thread_id)
+
+    def deleteBoard(self, name):
+        """Delete the board's archive."""
+        shutil.rmtree(self.boardPath(name), ignore_errors=True)
+        self.manifests.pop(name, None)
+        return True
+
+    def renameBoard(self, name, new_name):
+        """Move the board's archive along with a renamed board."""
+        if os.path.exists(self.boardPath(name)):
+            os.rename(self.boardPath(name), self.boardPath(new_name))
+        self.manifests.pop(name, None)
+        return True
+
+    def board(self, name):
+        """Return an ArchivedBoard for reading the board's archive."""
+        return ArchivedBoard(self, name)
+
+    def getThreads(self, name, start, count):
+        """Return count manifest entries, latest archived first."""
+        threads = self.manifest(name).threads
+        return [threads[thread_id] for thread_id in
+                list(reversed(threads))[start:start + count]]
+
+    def prunable(self, board):
+        """Return threads of board due for archiving."""
+        keep = self.config.archive_pages * self.config.max_threads
+        deadline = time.time() - self.config.archive_days * 24 * 60 * 60
+        previews = board.getPreviews(0, 1 << 62)
+        if self.config.archive_pages > 0:
+            old = set(preview[0] for preview in previews[keep:])
+        else:
+            old = set()
+        threads = []
+        for thread in board.getIndex():
+            if thread[0] in old or (self.config.archive_days > 0 and
+                                    thread[-1][0] < deadline):
+                threads.append(thread)
+        return threads
+
+    def prune(self, board):
+        """Archive the board's old threads, return how many there were."""
+        name = board.name
+        threads = self.prunable(board)
+        if not threads:
+            return 0
+
+        method = self.config.archive_compression
+        if method == "zstd" and zstandard is None:
+            logging.warning("Archive.prune: zstandard not installed, "
+                            "using gzip.")
+            method = "gzip"
+        filename = "{}-{}.json.{}".format(
+            int(time.time()), threads[0][0], "zst" if method == "zstd"
+            else "gz")
+        path = os.path.join(self.boardPath(name), filename)
+        os.makedirs(self.boardPath(name), exist_ok=True)
+        # The segment is written before anything leaves the board, so
+        # a crash can't lose a thread.
+        storage.atomic_write(
+            path, compress(json.dumps(threads).encode(), method))
+
+        removed = set(board.storage.removeThreads(
+            name, [[thread[0], thread[-1][1]] for thread in threads]))
+        if removed:
+            self.manifest(name).append("\n".join(
+                json.dumps([thread[0], thread[1], len(thread) - 3,
+                            thread[-1][0], filename])
+                for thread in threads if thread[0] in removed))
+        else:
+            # All of them got posts meanwhile.
+            os.remove(path)
+        logging.info("Archive.prune: archived %d threads of /%s/ in %s.",
+                     len(removed), name, filename)
+        return len(removed)
+
+
+class ArchivedBoard():
+    """Archived threads of a board, read like the board's live ones.
+
+    Has the Board methods Display.displayThread() uses.
+    """
+
+    def __init__(self, archive, name):
+        self.archive = archive
+        self.name = name
+
+    def getThread(self, thread_id):
+        return self.archive.getThread(self.name, thread_id)
+
+    def getThreadInfo(self, thread_id):
+        """Return [thread_id, subject, number of posts], or None."""
+        thread = self.getThread(thread_id)
+        if thread is None:
+            return None
+        return [thread[0], thread[1], len(thread) - 2]
+
+    def findPost(self, thread_id, post_no):
+        """Return the position of post_no in the thread, or None."""
+        thread = self.getThread(thread_id)
+        if thread is not None:
+            for position, post in enumerate(thread[2:]):
+                if post[1] == post_no:
+                    return position
+        return None
+
+    def iterPosts(self, thread_id, start=0, chunk=None):
+        """Yield posts of the thread, from the start-th one on.
+
+        Segments are read whole anyway, chunk is only there to match
+        Board.iterPosts().
+        """
+        thread = self.getThread(thread_id)
+        if thread is not None:
+            yield from thread[2 + start:]
@@ -0,0 +1,52 @@
+"""
+Shared helpers for the benchmark scripts in this directory.
+
+Benchmarks never touch a real chan: they build a throwaway rootdir with
+its own config file and run sshchan's classes against it.
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+# Make the sshchan modules importable when running bench/<script>.py.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from config import Config, start_logging
+
+
+def make_root(**settings):
+    """Create a temporary chan and return the path to its config file.
+
+    Keyword arguments override the generated config settings. The
+    working directory is changed to the new rootdir so sshchan's log
+    file ends up there too.
+    """
+    root = tempfile.mkdtemp(prefix="sshchan-bench-")
+    values = {"rootdir": root,
+              "boardlist_path": os.path.join(root, "boardlist"),
+              "postnums_path": os.path.join(root, "postnums"),
+              "motd_path": os.path.join(root, "motd"),
+              "version": "0.1",
+              "name": "bench",
+              "admin": "",
+              "salt": "",
+              "password": ""}
+    values.update(settings)
+    conf_path = os.path.join(root, "sshchan.conf")
+    with open(conf_path, 'w') as f:
+        json.dump(values, f, indent=4)
+    os.makedirs(os.path.join(root, "boards"))
+    os.chdir(root)
+    start_logging()
+
+    cfg = Config(conf_path)
+    cfg.setBoardlist({})
+    cfg.setPostnums({})
+    return conf_path
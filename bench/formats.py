@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Index format benchmark.
+
+Writes the same generated board index in every index_format available
+and times reading it back the way the JSON storage backend does.
+
+Usage: python3 bench/formats.py [-t THREADS] [-r REPLIES]
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import common
+import storage
+
+
+def make_index(threads, replies):
+    now = int(time.time())
+    index = []
+    post_no = 1
+    for thread_id in range(threads):
+        thread = [post_no, "subject of thread {}".format(thread_id)]
+        for _ in range(replies + 1):
+            text = "post number {} with some '''text''' in it".format(post_no)
+            thread.append([now, post_no, text, 1, "12:00:00 18 Oct 2015",
+                           "post number {} with some \033[0;1mtext\033[0m "
+                           "in it".format(post_no)])
+            post_no += 1
+        index.append(thread)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-t", type=int, default=20000, help="threads")
+    parser.add_argument("-r", type=int, default=5, help="replies per thread")
+    args = parser.parse_args()
+
+    index = make_index(args.t, args.r)
+    directory = tempfile.mkdtemp(prefix="sshchan-bench-")
+    print("{} threads, {} posts".format(args.t, args.t * (args.r + 1)))
+    print("{:10} {:>10} {:>12} {:>12}".format(
+        "format", "size (MB)", "write (ms)", "read (ms)"))
+    for data_format in storage.FORMATS:
+        if data_format == "msgpack" and storage.msgpack is None:
+            print("{:10} msgpack module not installed".format(data_format))
+            continue
+        path = os.path.join(directory, data_format)
+        start = time.perf_counter()
+        storage.dump_data(path, index, data_format)
+        write = time.perf_counter() - start
+        start = time.perf_counter()
+        assert storage.load_data(path) == index
+        read = time.perf_counter() - start
+        print("{:10} {:>10.2f} {:>12.0f} {:>12.0f}".format(
+            data_format, os.path.getsize(path) / 1000000, write * 1000,
+            read * 1000))
+
+
+if __name__ == "__main__":
+    main()
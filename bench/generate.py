@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Synthetic board generator.
+
+Builds a board with a given number of threads, replies spread over them
+following a distribution, and posts of a given mean length with some
+markup in them, written in one go with Board.setIndex(). Used by
+bench/suite.py, or on its own to fill a throwaway chan (or a real one
+with -c CONFIG) for trying things out by hand.
+
+Reply distributions, all with the mean given with -r:
+ fixed       - every thread has exactly that many replies
+ uniform     - anything from none to twice the mean
+ exponential - most threads have few replies, some many
+ pareto      - a handful of huge threads and a long tail of dead ones,
+               like a real board
+
+Usage: python3 bench/generate.py [-t THREADS] [-r REPLIES] [-d DISTRIBUTION]
+                                 [-w WORDS] [-s STORAGE] [-R]
+                                 [-c CONFIG] [-b BOARD]
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import argparse
+import random
+import time
+
+import common
+from boards import Board
+from chan_mark import Marker
+from config import Config
+
+WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "sshchan", "thread",
+         "board", "post", "reply", "anon", "terminal", "consectetur",
+         "adipiscing", "elit", "sed", "do", "eiusmod", "tempor", "日本語")
+MARKUP = ("~~struck~~", "'''bold'''", "==reversed==",
+          "'''bold ~~and struck~~'''")
+DISTRIBUTIONS = ("fixed", "uniform", "exponential", "pareto")
+
+
+def make_text(words, markup=0.03, quotes=0.1):
+    """Return a post of about words words over a few lines."""
+    count = max(1, int(random.expovariate(1 / words)))
+    text = []
+    for n in range(count):
+        if random.random() < markup:
+            text.append(random.choice(MARKUP))
+        else:
+            text.append(random.choice(WORDS))
+        if random.random() < 0.08 or n == count - 1:
+            if random.random() < quotes:
+                text[-1] += "\n>"
+            else:
+                text[-1] += "\n"
+        else:
+            text[-1] += " "
+    return "".join(text).strip("\n>")
+
+
+def reply_counts(threads, mean, distribution="pareto"):
+    """Return the number of replies of each of threads threads."""
+    if distribution == "fixed":
+        return [mean] * threads
+    if distribution == "uniform":
+        return [random.randint(0, 2 * mean) for _ in range(threads)]
+    if distribution == "exponential":
+        return [int(random.expovariate(1 / mean)) if mean > 0 else 0
+                for _ in range(threads)]
+    if distribution == "pareto":
+        # paretovariate(alpha) - 1 has a mean of 1 / (alpha - 1).
+        alpha = 1.5
+        return [int(mean * (alpha - 1) * (random.paretovariate(alpha) - 1))
+                for _ in range(threads)]
+    raise ValueError("unknown distribution " + distribution)
+
+
+def make_index(threads, replies, distribution="pareto", words=30,
+               render=None):
+    """Return a board index and the number of its last post.
+
+    render, if given, is Board.renderPost() for storing posts rendered.
+    """
+    counts = reply_counts(threads, replies, distribution)
+    now = int(time.time()) - sum(counts) - threads
+    index = []
+    post_no = 0
+    for thread_no, count in enumerate(counts):
+        thread = [post_no + 1, "thread number {}".format(thread_no)]
+        for _ in range(count + 1):
+            post_no += 1
+            text = make_text(words)
+            post = [now + post_no, post_no, text]
+            if render is not None:
+                post.extend(render(now + post_no, text))
+            thread.append(post)
+        index.append(thread)
+    return index, post_no
+
+
+def generate(board, threads, replies, distribution="pareto", words=30,
+             prerender=False):
+    """Replace the board's contents with a generated index.
+
+    Returns the index.
+    """
+    render = board.renderPost if prerender else None
+    index, last = make_index(threads, replies, distribution, words, render)
+    board.setIndex(index)
+    board.config.setPostnums({board.name: last})
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-t", type=int, default=1000, help="threads")
+    parser.add_argument(
+        "-r", type=int, default=20, help="mean replies per thread")
+    parser.add_argument("-d", default="pareto", choices=DISTRIBUTIONS,
+                        help="distribution of replies over threads")
+    parser.add_argument("-w", type=int, default=30, help="mean words per post")
+    parser.add_argument(
+        "-s", default="json", help="storage backend (json or sqlite)")
+    parser.add_argument(
+        "-R", action="store_true", help="store posts rendered")
+    parser.add_argument("-c", help="config file of a chan to fill")
+    parser.add_argument("-b", default="gen", help="board to fill")
+    args = parser.parse_args()
+
+    conf_path = args.c or common.make_root(storage=args.s)
+    cfg = Config(conf_path)
+    board = Board(args.b, "Generated board", cfg, marker=Marker())
+    start = time.perf_counter()
+    index = generate(board, args.t, args.r, args.d, args.w, args.R)
+    posts = sum(len(thread) - 2 for thread in index)
+    print("/{}/: {} threads, {} posts, biggest thread {} posts, "
+          "generated in {:.1f} s".format(
+              board.name, len(index), posts,
+              max(len(thread) - 2 for thread in index),
+              time.perf_counter() - start))
+    print("config: {}".format(conf_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Display.laprint() throughput benchmark.
+
+Renders one big thread whole (displayThread() showing all its posts
+with last) and compares it to the same thread rendered with the old
+character-at-a-time laprint() (kept below for reference). Output goes
+to a throwaway buffer.
+
+Usage: python3 bench/laprint.py [-r REPLIES] [-n REPEAT]
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import argparse
+import contextlib
+import io
+import string
+import time
+
+import common
+from boards import Board
+from chan_mark import Marker
+from config import Config
+from display import Display
+
+
+def old_laprint(self, *args, endc='\n', markup=False):
+    """laprint() as it used to be, one print() per character."""
+    chars = 0
+    lines = 0
+    msg = ""
+
+    for arg in args:
+        msg += str(arg)
+
+    if markup == True and self.marker is not None:
+        msg = self.marker.demarkify(msg)
+
+    for c in msg:
+        if c in string.printable:
+            chars += 1
+        if c == "\n":
+            lines += 1
+            chars = 0
+        if chars > self.config.tty_cols:
+            lines += 1
+            chars = 0
+        print(c, end='')
+
+    if endc == "\n":
+        lines += 1
+
+    print(endc, end="")
+    self.config.lines_printed += lines
+
+
+def render(display, thread_id, posts, repeat):
+    """Return seconds per displayThread() of all posts and bytes rendered."""
+    out = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(out):
+        for _ in range(repeat):
+            display.displayThread(thread_id, last=posts)
+    return (time.perf_counter() - start) / repeat, len(out.getvalue()) // repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-r", type=int, default=2000, help="replies")
+    parser.add_argument("-n", type=int, default=3, help="renders to time")
+    args = parser.parse_args()
+
+    cfg = Config(common.make_root(page_cache=False))
+    board = Board("laprint", "laprint benchmark", cfg)
+    now = int(time.time())
+    text = ("Some '''bold''' text and a ==reversed== word, "
+            "then a long line to wrap: " + "lorem ipsum " * 20 + "\n"
+            "and a second line with wide characters: 日本語テキスト")
+    board.setIndex([[1, "big thread", [now, 1, text]] +
+                    [[now, n, text] for n in range(2, args.r + 2)]])
+    with contextlib.redirect_stdout(io.StringIO()):
+        display = Display(cfg, board, Marker())
+    # Both get the posts from the marker's cache.
+    render(display, 1, args.r + 1, 1)
+
+    new, size = render(display, 1, args.r + 1, args.n)
+    Display.laprint, saved = old_laprint, Display.laprint
+    try:
+        old, _ = render(display, 1, args.r + 1, args.n)
+    finally:
+        Display.laprint = saved
+
+    print("thread of {} replies, {} KiB rendered".format(args.r, size // 1024))
+    print("old laprint: {:8.1f} ms ({:.1f} MiB/s)".format(
+        old * 1000, size / old / 2 ** 20))
+    print("new laprint: {:8.1f} ms ({:.1f} MiB/s)".format(
+        new * 1000, size / new / 2 ** 20))
+    print("speedup: {:.1f}x".format(old / new))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Thread lookup benchmark.
+
+Builds boards with a growing number of threads and times replying to a
+thread and finding a thread through the thread map, next to the old
+linear search over the index for comparison. With the thread map both
+should stay flat as the board grows.
+
+Usage: python3 bench/lookup.py [-t THREADS [THREADS ...]] [-r REPLIES]
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import argparse
+import random
+import time
+
+import common
+from boards import Board
+from config import Config
+
+
+def make_index(threads):
+    now = int(time.time())
+    return [[n, "subject", [now, n, "post text"]] for n in range(1, threads + 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "-t", type=int, nargs="+", default=[1000, 10000, 100000],
+        help="board sizes (threads)")
+    parser.add_argument("-r", type=int, default=200, help="replies to time")
+    args = parser.parse_args()
+
+    print("{:>8} {:>12} {:>12} {:>12}".format(
+        "threads", "reply (ms)", "map (us)", "scan (us)"))
+    for threads in args.t:
+        cfg = Config(common.make_root(log_compact=1024 * 1024 * 1024))
+        board = Board("lookup", "Lookup benchmark", cfg)
+        index = make_index(threads)
+        board.setIndex(index)
+        cfg.setPostnums({"lookup": threads})
+        targets = [random.randint(1, threads) for _ in range(args.r)]
+
+        start = time.perf_counter()
+        for thread_id in targets:
+            board.addPost("reply", thread_id=thread_id)
+        reply = (time.perf_counter() - start) / args.r * 1000
+
+        thread_map = cfg.storage.threadMap("lookup")
+        start = time.perf_counter()
+        for thread_id in targets:
+            index[thread_map.get(thread_id)]
+        lookup = (time.perf_counter() - start) / args.r * 1000000
+
+        start = time.perf_counter()
+        for thread_id in targets:
+            for thread in index:
+                if thread[0] == thread_id:
+                    break
+        scan = (time.perf_counter() - start) / args.r * 1000000
+
+        print("{:>8} {:>12.3f} {:>12.3f} {:>12.1f}".format(
+            threads, reply, lookup, scan))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Markup rendering benchmark.
+
+Renders a corpus of posts with the old chain of regular expressions
+(kept below for reference) and with Marker.demarkify(), with and
+without its per-post cache. The corpus is generated, or taken from a
+real chan's board with -c CONFIG -b BOARD.
+
+Usage: python3 bench/markup.py [-p POSTS] [-c CONFIG -b BOARD]
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import argparse
+import random
+import re
+import time
+
+import common
+from boards import Board
+from chan_mark import Marker
+from config import Config
+
+WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "sshchan", "thread",
+         "board", "post", "reply", "anon", "terminal")
+MARKUP = ("~~struck~~", "'''bold'''", "==reversed==", ">>1234",
+          "'''bold ~~and struck~~'''")
+
+
+def old_demarkify(input_text):
+    """Marker.demarkify() as it used to be, one re.sub() per tag."""
+    output_text = input_text.replace('\033', '\\033')
+    output_text = re.sub(
+        '~~(?P<substring>.*?)~~', '\033[0;9m\\g<substring>\033[0m',
+        output_text)
+    output_text = re.sub(
+        '\'\'\'(?P<substring>.*?)\'\'\'', '\033[0;1m\\g<substring>\033[0m',
+        output_text)
+    output_text = re.sub(
+        '==(?P<substring>.*?)==', '\033[0;7m\\g<substring>\033[0m',
+        output_text)
+    return output_text
+
+
+def generate(posts):
+    corpus = []
+    for n in range(posts):
+        lines = []
+        for _ in range(random.randint(1, 6)):
+            line = " ".join(
+                random.choice(MARKUP if random.random() < 0.03 else WORDS)
+                for _ in range(random.randint(3, 25)))
+            if random.random() < 0.1:
+                line = ">" + line
+            lines.append(line)
+        corpus.append((n, "\n".join(lines)))
+    return corpus
+
+
+def timed(render, corpus):
+    start = time.perf_counter()
+    for post_id, text in corpus:
+        render(text, post_id)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-p", type=int, default=20000, help="posts")
+    parser.add_argument("-c", help="config file of a chan to take posts from")
+    parser.add_argument("-b", help="board to take posts from")
+    args = parser.parse_args()
+
+    if args.c and args.b:
+        board = Board(args.b, config=Config(args.c))
+        corpus = [(post[1], post[2]) for thread in board.getIndex()
+                  for post in thread[2:]]
+    else:
+        corpus = generate(args.p)
+    size = sum(len(text) for post_id, text in corpus)
+
+    marker = Marker(cache_size=len(corpus))
+    old = timed(lambda text, post_id: old_demarkify(text), corpus)
+    new = timed(lambda text, post_id: marker.demarkify(text), corpus)
+    timed(marker.demarkify, corpus)  # Fill the cache.
+    cached = timed(marker.demarkify, corpus)
+
+    print("{} posts, {} KiB".format(len(corpus), size // 1024))
+    for name, elapsed in (("regex chain", old), ("single pass", new),
+                          ("cached", cached)):
+        print("{:12} {:8.1f} ms {:10.0f} posts/s".format(
+            name, elapsed * 1000, len(corpus) / elapsed))
+
+
+if __name__ == "__main__":
+    main()
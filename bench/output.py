@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Output benchmark: bytes sent to the user per command.
+
+Runs the same scripted session (browsing a generated board while other
+users post on it) through sshchan's commands with the output going to a
+fake terminal that counts bytes, once per output mode:
+
+ raw    - every screen written out whole, color codes as rendered
+ full   - every screen written out whole, color codes coalesced
+ diff   - screens already on the terminal sent as the lines that changed
+ delta  - diff, and refresh only sends the posts made since (the
+          delta_refresh setting)
+
+The "metrics" setting records the same figure (output) for every
+command users run on a real chan.
+
+Usage: python3 bench/output.py [-t THREADS] [-r REPLIES] [-g COLSxLINES]
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import argparse
+import os
+import random
+import sys
+
+import common
+import display
+import generate
+import sshchan
+from boards import Board
+from chan_mark import Marker
+from config import Colors, Config
+
+MODES = ("raw", "full", "diff", "delta")
+
+
+class Terminal():
+    """Fake terminal counting the bytes written to it."""
+
+    def __init__(self):
+        self.sent = 0
+        self.typed = []
+
+    def write(self, text):
+        self.sent += len(text.encode())
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return True
+
+    def readline(self, size=-1):
+        return self.typed.pop(0)
+
+
+def script(board, thread_id):
+    """Return the session: [(command, what other users do before it)]."""
+    def reply():
+        board.addPost(generate.make_text(20), thread_id=thread_id)
+
+    def thread():
+        board.addPost(generate.make_text(20), "new thread")
+
+    return [("b {}".format(board.name), None), ("r", None),
+            ("r", reply), ("r", thread), ("r", None),
+            ("v {}".format(thread_id), None), ("v {}".format(thread_id), None),
+            ("v {} last 5".format(thread_id), reply),
+            ("v {} last 5".format(thread_id), reply),
+            ("b {}".format(board.name), None), ("motd", None)]
+
+
+def session(mode, conf_path, seed):
+    """Run the session in mode, return [(command, bytes sent)]."""
+    random.seed(seed)
+    cfg = Config(conf_path)
+    cfg.delta_refresh = mode == "delta"
+    marker = Marker()
+    board = Board("output", config=cfg, marker=marker)
+    thread_id = random.choice(board.getIndex())[0]
+
+    terminal = Terminal()
+    saved = sys.stdout, sys.stdin, display.coalesce
+    sys.stdout = sys.stdin = terminal
+    if mode == "raw":
+        display.coalesce = lambda text: text
+    screen = display.Screen(cfg)
+    if mode in ("diff", "delta"):
+        screen.install()
+    results = []
+    try:
+        view = display.Display(cfg, board, marker, screen)
+        for command, others in script(board, thread_id):
+            if others is not None:
+                others()
+            terminal.sent = 0
+            terminal.typed.append(command + "\n")
+            argv = input(Colors.BLUE + "sshchan/> " + Colors.BLACK).split()
+            sshchan.run_command(cfg, view, board, marker, Colors(), argv)
+            results.append((command, terminal.sent))
+    finally:
+        sys.stdout, sys.stdin, display.coalesce = saved
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-t", type=int, default=200, help="threads")
+    parser.add_argument(
+        "-r", type=int, default=10, help="mean replies per thread")
+    parser.add_argument("-g", default="80x24", help="terminal size")
+    args = parser.parse_args()
+
+    # Picked up by shutil.get_terminal_size() in Config.
+    os.environ["COLUMNS"], os.environ["LINES"] = args.g.split("x")
+    seed = random.randrange(1 << 30)
+    results = {}
+    for mode in MODES:
+        # A board of its own for every mode, generated the same way.
+        random.seed(seed)
+        conf_path = common.make_root(page_cache=False)
+        board = Board("output", "Output benchmark", Config(conf_path),
+                      marker=Marker())
+        generate.generate(board, args.t, args.r)
+        results[mode] = session(mode, conf_path, seed)
+
+    print("{:24}".format("command") + "".join(
+        "{:>9}".format(mode) for mode in MODES))
+    for n, (command, _) in enumerate(results[MODES[0]]):
+        print("{:24}".format(command) + "".join(
+            "{:>9}".format(results[mode][n][1]) for mode in MODES))
+    print("{:24}".format("total") + "".join(
+        "{:>9}".format(sum(sent for _, sent in results[mode]))
+        for mode in MODES))
+
+
+if __name__ == "__main__":
+    main()
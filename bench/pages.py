@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Board page benchmark.
+
+Fills a board with threads, bumps some of them and times fetching the
+previews for the first, a middle and the last page, which is what
+Display.displayBoard() does for every page shown.
+
+Usage: python3 bench/pages.py [-t THREADS] [-s STORAGE] [-n REPEAT]
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import argparse
+import random
+import time
+
+import common
+from boards import Board
+from config import Config
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-t", type=int, default=20000, help="threads")
+    parser.add_argument(
+        "-s", default="json", help="storage backend (json or sqlite)")
+    parser.add_argument("-n", type=int, default=20, help="fetches per page")
+    args = parser.parse_args()
+
+    cfg = Config(common.make_root(
+        storage=args.s, log_compact=1024 * 1024 * 1024))
+    board = Board("pages", "Page benchmark", cfg)
+    now = int(time.time())
+    board.setIndex(
+        [[n, "subject", [now, n, "post text"]] for n in range(1, args.t + 1)])
+    cfg.setPostnums({"pages": args.t})
+    for thread_id in random.sample(range(1, args.t + 1), 100):
+        board.addPost("bump", thread_id=thread_id)
+
+    per_page = cfg.max_threads
+    last = (args.t + per_page - 1) // per_page
+    print("{} threads, {} storage".format(args.t, args.s))
+    for page in (1, last // 2, last):
+        start = time.perf_counter()
+        for _ in range(args.n):
+            previews = board.getPreviews((page - 1) * per_page, per_page)
+        elapsed = (time.perf_counter() - start) / args.n * 1000
+        print("page {:>6}: {:>8.2f} ms ({} threads)".format(
+            page, elapsed, len(previews)))
+
+
+if __name__ == "__main__":
+    main()
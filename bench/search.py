@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Search benchmark.
+
+Fills a board with generated posts and times building the search index,
+searching it for rare, common and several words, and posting with the
+index maintained on every post.
+
+Usage: python3 bench/search.py [-p POSTS] [-s STORAGE] [-q QUERIES]
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import argparse
+import itertools
+import random
+import time
+
+import common
+from boards import Board
+from config import Config
+
+# Word frequencies roughly follow Zipf's law, like real text.
+VOCABULARY = ["word{}".format(n) for n in range(20000)]
+WEIGHTS = list(itertools.accumulate(
+    1 / (n + 1) for n in range(len(VOCABULARY))))
+
+
+def make_index(posts, per_thread=50):
+    now = int(time.time())
+    index = []
+    for post_no in range(1, posts + 1):
+        text = " ".join(random.choices(
+            VOCABULARY, cum_weights=WEIGHTS, k=random.randint(5, 40)))
+        if post_no % per_thread == 1:
+            index.append([post_no, "thread " + str(post_no),
+                          [now, post_no, text]])
+        else:
+            index[-1].append([now, post_no, text])
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-p", type=int, default=200000, help="posts")
+    parser.add_argument(
+        "-s", default="json", help="storage backend (json or sqlite)")
+    parser.add_argument("-q", type=int, default=100, help="queries to time")
+    args = parser.parse_args()
+
+    cfg = Config(common.make_root(
+        storage=args.s, log_compact=1024 * 1024 * 1024))
+    board = Board("search", "Search benchmark", cfg)
+    start = time.perf_counter()
+    board.setIndex(make_index(args.p))
+    cfg.setPostnums({"search": args.p})
+    print("{} posts, {} storage, indexed in {:.1f} s".format(
+        args.p, args.s, time.perf_counter() - start))
+
+    # First search of a session loads the index.
+    start = time.perf_counter()
+    cfg.storage.search("search", "word1", 10)
+    print("{:24} {:10.1f} ms".format(
+        "first search", (time.perf_counter() - start) * 1000))
+
+    queries = {
+        "rare word": lambda: random.choice(VOCABULARY[10000:]),
+        "common word": lambda: random.choice(VOCABULARY[:10]),
+        "three words": lambda: " ".join(random.sample(VOCABULARY[:2000], 3)),
+    }
+    for name, query in queries.items():
+        start = time.perf_counter()
+        for _ in range(args.q):
+            cfg.storage.search("search", query(), 10)
+        print("{:24} {:10.2f} ms".format(
+            name, (time.perf_counter() - start) / args.q * 1000))
+
+    start = time.perf_counter()
+    for _ in range(args.q):
+        text = " ".join(random.choices(VOCABULARY, cum_weights=WEIGHTS, k=20))
+        board.addPost(text, thread_id=1)
+    print("{:24} {:10.2f} ms".format(
+        "post", (time.perf_counter() - start) / args.q * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Session startup benchmark.
+
+Starts sshchan.py the way an SSH login does, N times over, and times
+how long it takes until the first prompt shows up. -i also lists the
+modules that take longest to import (python3 -X importtime).
+
+Usage: python3 bench/startup.py [-n COUNT] [-b BOARDS] [-s STORAGE] [-i]
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import common
+from boards import Board
+from config import Config
+
+SSHCHAN = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sshchan.py")
+PROMPT = b"sshchan/> "
+
+
+def first_prompt(conf_path, env, args=()):
+    """Start a session, return seconds until its first prompt."""
+    start = time.perf_counter()
+    session = subprocess.Popen(
+        [sys.executable] + list(args) + [SSHCHAN, conf_path],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE, env=env)
+    output = b""
+    while PROMPT not in output:
+        data = os.read(session.stdout.fileno(), 65536)
+        if not data:
+            raise RuntimeError("sshchan.py exited before its prompt")
+        output += data
+    elapsed = time.perf_counter() - start
+    _, errors = session.communicate(b"exit\n")
+    return elapsed, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", type=int, default=20, help="sessions to time")
+    parser.add_argument("-b", type=int, default=10, help="boards")
+    parser.add_argument(
+        "-s", default="json", help="storage backend (json or sqlite)")
+    parser.add_argument(
+        "-i", action="store_true", help="list the slowest imports")
+    args = parser.parse_args()
+
+    conf_path = common.make_root(storage=args.s)
+    cfg = Config(conf_path)
+    for n in range(args.b):
+        Board("board{}".format(n), "Board number {}".format(n), cfg)
+    with open(cfg.motd, 'w') as f:
+        f.write("Welcome to the '''benchmark''' chan.\n")
+    env = dict(os.environ, COLUMNS="80", LINES="24")
+
+    first, _ = first_prompt(conf_path, env)
+    times = sorted(first_prompt(conf_path, env)[0] for _ in range(args.n))
+    start = time.perf_counter()
+    for _ in range(args.n):
+        subprocess.run([sys.executable, "-c", "pass"])
+    bare = (time.perf_counter() - start) / args.n
+    print("{} boards, {} storage".format(args.b, args.s))
+    print("first session:       {:6.1f} ms".format(first * 1000))
+    print("median:              {:6.1f} ms".format(times[len(times) // 2] * 1000))
+    print("90th percentile:     {:6.1f} ms".format(
+        times[len(times) * 9 // 10] * 1000))
+    print("python doing nothing:{:6.1f} ms".format(bare * 1000))
+
+    if args.i:
+        _, errors = first_prompt(conf_path, env, ["-X", "importtime"])
+        imports = []
+        for line in errors.decode().splitlines():
+            if line.startswith("import time:") and "|" in line:
+                fields = line[len("import time:"):].split("|")
+                if fields[0].strip().isdigit():
+                    imports.append((int(fields[1]), fields[2].rstrip()))
+        print("slowest imports (cumulative us):")
+        for usec, name in sorted(imports, reverse=True)[:15]:
+            print("{:>8} {}".format(usec, name))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Concurrent posting stress test.
+
+Spawns N processes that all post at once (like N users in separate SSH
+sessions), spread over B boards, and then checks that no post was lost
+and that every board numbered its posts without gaps or duplicates.
+
+Usage: python3 bench/stress.py [-n PROCESSES] [-p POSTS] [-c LOG_COMPACT]
+                               [-s STORAGE] [-b BOARDS]
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import argparse
+import multiprocessing
+import sys
+import time
+
+import common
+from boards import Board
+from config import Config
+
+
+def poster(conf_path, name, worker, posts):
+    """Post alternating new threads and replies to thread 1."""
+    cfg = Config(conf_path)
+    board = Board(name, config=cfg)
+    for n in range(posts):
+        text = "worker {} post {}".format(worker, n)
+        if n % 10 == 0:
+            ok = board.addPost(text, "thread from worker " + str(worker))
+        else:
+            ok = board.addPost(text, thread_id=1)
+        if not ok:
+            sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", type=int, default=8, help="posting processes")
+    parser.add_argument("-p", type=int, default=200, help="posts per process")
+    parser.add_argument(
+        "-c", type=int, default=16 * 1024, help="log_compact setting (bytes)")
+    parser.add_argument(
+        "-s", default="json", help="storage backend (json or sqlite)")
+    parser.add_argument("-b", type=int, default=1, help="boards")
+    args = parser.parse_args()
+
+    conf_path = common.make_root(log_compact=args.c, storage=args.s)
+    cfg = Config(conf_path)
+    names = ["stress{}".format(n) for n in range(args.b)]
+    for name in names:
+        Board(name, "Stress test", cfg).addPost("OP", "first thread")
+
+    start = time.perf_counter()
+    workers = [multiprocessing.Process(
+        target=poster, args=(conf_path, names[w % args.b], w, args.p))
+        for w in range(args.n)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+
+    expected = args.n * args.p + args.b
+    stored = lost = duplicates = gaps = 0
+    for n, name in enumerate(names):
+        index = Board(name, config=cfg).getIndex()
+        numbers = [post[1] for thread in index for post in thread[2:]]
+        workers_here = len(range(n, args.n, args.b))
+        stored += len(numbers)
+        lost += workers_here * args.p + 1 - len(numbers)
+        duplicates += len(numbers) - len(set(numbers))
+        # Numbers run from 1 to the board's postnum.
+        postnum = cfg.getPostnums()[name]
+        gaps += postnum - len(set(numbers))
+    failed = [w for w in workers if w.exitcode != 0]
+
+    print("{} processes x {} posts on {} boards in {:.2f}s "
+          "({:.0f} posts/s)".format(args.n, args.p, args.b, elapsed,
+                                    (expected - args.b) / elapsed))
+    print("posts stored: {}, expected: {}".format(stored, expected))
+    print("lost posts: {}, duplicate numbers: {}, gaps: {}".format(
+        lost, duplicates, gaps))
+
+    if failed or lost or duplicates or gaps:
+        print("FAIL")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
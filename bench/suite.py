@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for sshchan's hot paths.
+
+Generates a board (see bench/generate.py) in a throwaway chan and runs
+what sessions do most, headless, with the terminal size set by -g:
+
+ post        - Board.addPost() replying to a random thread
+ thread      - Board.addPost() starting a thread
+ index       - Board.getIndex() in a new session (nothing cached)
+ index-warm  - Board.getIndex() again in the same session
+ board       - Display.displayBoard() of a random page
+ view        - Display.displayThread() of a random thread
+ laprint     - Display.laprint() of a random post, markup rendered
+ demarkify   - Marker.demarkify() of a random post, uncached
+
+Every case reports operations per second, latency percentiles and the
+peak memory allocated by a single operation (measured separately with
+tracemalloc, which slows things down). With -o FILE the results are
+also appended to FILE as a JSON line, to track them over time.
+
+Usage: python3 bench/suite.py [-t THREADS] [-r REPLIES] [-d DISTRIBUTION]
+                              [-w WORDS] [-s STORAGE] [-n COUNT]
+                              [-g COLSxLINES] [-k CASE [CASE ...]]
+                              [-o FILE]
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import common
+import generate
+from boards import Board
+from chan_mark import Marker
+from config import Config
+from display import Display
+
+CASES = ("post", "thread", "index", "index-warm", "board", "view",
+         "laprint", "demarkify")
+
+
+@contextlib.contextmanager
+def headless():
+    """Send all output, even that of child processes, nowhere.
+
+    Yields a buffer with what Python code printed.
+    """
+    sys.stdout.flush()
+    saved = os.dup(1)
+    with open(os.devnull, 'w') as devnull:
+        os.dup2(devnull.fileno(), 1)
+    buf = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(buf):
+            yield buf
+    finally:
+        os.dup2(saved, 1)
+        os.close(saved)
+
+
+def percentile(values, p):
+    """Return the p-th percentile of sorted values."""
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run(operation, count):
+    """Time count calls of operation, return stats of the case."""
+    times = []
+    with headless():
+        operation()  # Warm up.
+        for _ in range(count):
+            start = time.perf_counter()
+            operation()
+            times.append(time.perf_counter() - start)
+        tracemalloc.start()
+        for _ in range(min(count, 5)):
+            operation()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    times.sort()
+    return {"ops": len(times) / sum(times),
+            "p50": percentile(times, 50) * 1000,
+            "p90": percentile(times, 90) * 1000,
+            "p99": percentile(times, 99) * 1000,
+            "max": times[-1] * 1000,
+            "peak": peak / 1024}
+
+
+def cases(conf_path, board, display, index):
+    """Return {case name: operation} of all the cases."""
+    marker = display.marker
+    thread_ids = [thread[0] for thread in index]
+    texts = [post[2] for thread in index for post in thread[2:]]
+    pages = (len(index) - 1) // board.config.max_threads + 1
+
+    def laprint():
+        display.laprint(random.choice(texts), markup=True)
+        display.pending = []
+        display.config.lines_printed = 0
+
+    return {
+        "post": lambda: board.addPost(
+            random.choice(texts), thread_id=random.choice(thread_ids)),
+        "thread": lambda: board.addPost(random.choice(texts), "subject"),
+        "index": lambda: Board(board.name, config=Config(conf_path))
+        .getIndex(),
+        "index-warm": board.getIndex,
+        "board": lambda: display.displayBoard(random.randint(1, pages)),
+        "view": lambda: display.displayThread(random.choice(thread_ids)),
+        "laprint": laprint,
+        "demarkify": lambda: marker.demarkify(random.choice(texts)),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-t", type=int, default=2000, help="threads")
+    parser.add_argument(
+        "-r", type=int, default=20, help="mean replies per thread")
+    parser.add_argument("-d", default="pareto", choices=generate.DISTRIBUTIONS,
+                        help="distribution of replies over threads")
+    parser.add_argument("-w", type=int, default=30, help="mean words per post")
+    parser.add_argument(
+        "-s", default="json", help="storage backend (json or sqlite)")
+    parser.add_argument(
+        "-n", type=int, default=200, help="operations timed per case")
+    parser.add_argument("-g", default="80x24", help="terminal size")
+    parser.add_argument("-k", nargs="+", choices=CASES, default=CASES,
+                        help="cases to run")
+    parser.add_argument("-o", help="file to append the results to")
+    args = parser.parse_args()
+
+    if args.o:
+        # make_root() changes the working directory.
+        args.o = os.path.abspath(args.o)
+    # Picked up by shutil.get_terminal_size() in Config.
+    os.environ["COLUMNS"], os.environ["LINES"] = args.g.split("x")
+    conf_path = common.make_root(storage=args.s, page_cache=False)
+    cfg = Config(conf_path)
+    marker = Marker()
+    board = Board("suite", "Benchmark suite", cfg, marker=marker)
+    start = time.perf_counter()
+    index = generate.generate(board, args.t, args.r, args.d, args.w)
+    print("{} threads, {} posts, {} storage, {} terminal, "
+          "generated in {:.1f} s".format(
+              len(index), sum(len(thread) - 2 for thread in index), args.s,
+              args.g, time.perf_counter() - start))
+    with headless():
+        display = Display(cfg, board, marker)
+
+    print("{:12} {:>10} {:>9} {:>9} {:>9} {:>9} {:>10}".format(
+        "case", "ops/s", "p50 ms", "p90 ms", "p99 ms", "max ms", "peak KiB"))
+    operations = cases(conf_path, board, display, index)
+    results = {}
+    for name in args.k:
+        results[name] = stats = run(operations[name], args.n)
+        print("{:12} {:>10.0f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} "
+              "{:>10.0f}".format(name, stats["ops"], stats["p50"],
+                                 stats["p90"], stats["p99"], stats["max"],
+                                 stats["peak"]))
+    # ru_maxrss is in KiB on Linux.
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print("max RSS: {:.1f} MiB".format(max_rss / 1024))
+
+    if args.o:
+        with open(args.o, 'a') as f:
+            f.write(json.dumps({
+                "time": int(time.time()), "revision": git_revision(),
+                "settings": {key: value for key, value in vars(args).items()
+                             if key not in ("k", "o")},
+                "results": results, "max_rss": max_rss}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Export and import benchmark.
+
+Generates a board, exports it (admin "export" command), imports the
+export into an empty chan and then into the same chan again, where
+every post has to be renumbered (admin "import" command), timing each
+step. Checks that the imported board has the exported posts.
+
+Usage: python3 bench/transfer.py [-t THREADS] [-r REPLIES] [-s STORAGE] [-z]
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import argparse
+import os
+import time
+
+import common
+import generate
+import transfer
+from boards import Board
+from config import Config
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-t", type=int, default=50000, help="threads")
+    parser.add_argument(
+        "-r", type=int, default=19, help="mean replies per thread")
+    parser.add_argument(
+        "-s", default="json", help="storage backend (json or sqlite)")
+    parser.add_argument(
+        "-z", action="store_true", help="gzip compress the export")
+    args = parser.parse_args()
+
+    cfg = Config(common.make_root(storage=args.s))
+    index = generate.generate(Board("gen", "Generated board", cfg),
+                              args.t, args.r, "fixed")
+    posts = sum(len(thread) - 2 for thread in index)
+    path = os.path.abspath("export" + (".gz" if args.z else ""))
+
+    start = time.perf_counter()
+    transfer.export_boards(cfg, path, ["gen"])
+    exported = time.perf_counter() - start
+    print("{} posts, {} storage, export {:.1f} MB".format(
+        posts, args.s, os.path.getsize(path) / 1e6))
+    print("export:             {:6.2f} s".format(exported))
+
+    cfg = Config(common.make_root(storage=args.s))
+    for step in ("import:", "import renumbered:"):
+        start = time.perf_counter()
+        [[_, imported, offset]] = transfer.import_boards(cfg, path)
+        print("{:20}{:6.2f} s".format(step, time.perf_counter() - start))
+        assert imported == posts and offset == (step != "import:") * posts
+
+    board = Board("gen", config=cfg)
+    assert board.getIndex()[:len(index)] == [
+        thread[:2] + [post[:3] for post in thread[2:]] for thread in index]
+    assert board.getPostnum() == 2 * posts
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Thread view benchmark.
+
+Builds boards with a growing number of threads and times what a freshly
+connected session pays to show one thread: reading it on its own (from
+the memory mapped index with the compact format) against loading the
+whole board index, as every other format has to. The first should stay
+flat as the board grows.
+
+Usage: python3 bench/views.py [-t THREADS [THREADS ...]] [-r REPLIES]
+                              [-v VIEWS]
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import argparse
+import random
+import time
+
+import common
+from boards import Board
+from config import Config
+from formats import make_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "-t", type=int, nargs="+", default=[1000, 10000, 50000],
+        help="board sizes (threads)")
+    parser.add_argument("-r", type=int, default=5, help="replies per thread")
+    parser.add_argument("-v", type=int, default=20, help="views to time")
+    args = parser.parse_args()
+
+    print("{:>8} {:>14} {:>14}".format(
+        "threads", "thread (ms)", "index (ms)"))
+    for threads in args.t:
+        path = common.make_root(log_compact=1024 * 1024 * 1024)
+        cfg = Config(path)
+        board = Board("views", "View benchmark", cfg)
+        index = make_index(threads, args.r)
+        board.setIndex(index)
+        cfg.setPostnums({"views": threads * (args.r + 1)})
+        # A reply in the log, to be picked up along with the thread.
+        board.addPost("reply", thread_id=index[0][0])
+        targets = [random.choice(index)[0] for _ in range(args.v)]
+
+        # Every view by a new session, so nothing is cached in memory.
+        start = time.perf_counter()
+        for thread_id in targets:
+            Config(path).storage.getThread("views", thread_id)
+        thread = (time.perf_counter() - start) / args.v * 1000
+
+        start = time.perf_counter()
+        for thread_id in targets:
+            Config(path).storage.getIndex("views")
+        whole = (time.perf_counter() - start) / args.v * 1000
+
+        print("{:>8} {:>14.2f} {:>14.2f}".format(threads, thread, whole))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,32 +9,28 @@ makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
 under GNU GPL v3, see LICENSE for details
 """
 
-import json
-import os
 import logging
-import shutil
 import time
 
-logging.basicConfig(
-        filename="log",
-        format="[%(lineno)d]%(asctime)s:%(levelname)s:%(message)s",
-        level=logging.DEBUG)
+# How post dates are shown.
+DATE_FORMAT = '%H:%M:%S %d %b %Y'
 
 
 class Board():
     """Class holding data of the currently selected board."""
 
-    def __init__(self, name='', desc='', config=None):
+    def __init__(self, name='', desc='', config=None, marker=None):
         assert config is not None, logging.critical(
             "Board.__init__: config is None")
         # Configuration object used to read / write config values.
         self.config = config            
+        # Marker rendering posts before they're stored, see addPost().
+        self.marker = marker
 
         self._name = name.lower()
         self._desc = desc
-        self.path = os.path.join(self.config.root, "boards", self._name)
-        self.index_path = os.path.join(self.path, "index")
-        self.boardlist_path = self.config.boardlist_path
+        # Storage backend holding the board's posts.
+        self.storage = self.config.storage
 
         if self.addBoard():
             logging.info(
@@ -56,54 +52,96 @@ class Board():
         created.
         """
 
-        if self._name in self.config.getBoardlist().keys() \
-                or self._name == '':
+        if self._name == '':
             return False
-        # Add the board to boardlist.
-        buf = self.config.getBoardlist()
-        buf[self._name] = self._desc
-        self.config.setBoardlist(buf)
-        # Create the board directory.
-        try:
-            os.makedirs(self.path)
-        except OSError as e:
-            logging.error("Board.addBoard(): %s", e)
-        # Create the index file.
-        self.setIndex([])
-        # Edit postnums.
-        postn = self.config.getPostnums()
-        postn[self._name] = 0
-        self.config.setPostnums(postn)
-
-        return True
+        return self.storage.createBoard(self._name, self._desc)
 
     def delBoard(self):
         if self._name != "":
-            os.remove(self.index_path)
-            os.rmdir(self.path)
-            boardlist = self.config.getBoardlist()
-            del boardlist[self._name]
-            self.config.setBoardlist(boardlist)
+            self.storage.deleteBoard(self._name)
             logging.info("Board %s deleted succesfully.", self._name)
             self._name = ""
             self.desc = ""
-            self.path = ""
-            self.index_path = ""
             return True
         else:
             return False
 
     def getIndex(self):
         """Returns a list containing the board's index."""
-        with open(self.index_path, 'r') as i:
-            buf = json.load(i)
-        return buf
+        return self.storage.getIndex(self._name)
+
+    def iterThreads(self):
+        """Yield the board's threads one at a time, in thread ID order."""
+        return self.storage.iterThreads(self._name)
 
     def setIndex(self, values):
         """Update the board's index with new values."""
-        with open(self.index_path, 'w') as i:
-            json.dump(values, i, indent=4)
-        return True
+        return self.storage.setIndex(self._name, values)
+
+    def appendThreads(self, threads, postnum):
+        """Add threads numbered after the board's last post in one go.
+
+        threads can be any iterable, e.g. a generator. Returns False if
+        a post made meanwhile took one of their numbers, see transfer.py.
+        """
+        return self.storage.appendThreads(self._name, threads, postnum)
+
+    def compact(self):
+        """Let the storage backend tidy up the board's files."""
+        return self.storage.compact(self._name)
+
+    def getThread(self, thread_id):
+        """Return the thread with thread_id, or None if there's none."""
+        return self.storage.getThread(self._name, thread_id)
+
+    def getThreadInfo(self, thread_id):
+        """Return [thread_id, subject, number of posts], or None."""
+        return self.storage.getThreadInfo(self._name, thread_id)
+
+    def getPosts(self, thread_id, start, count):
+        """Return count posts of a thread from the start-th (OP is 0)."""
+        return self.storage.getPosts(self._name, thread_id, start, count)
+
+    def findPost(self, thread_id, post_no):
+        """Return the position of post_no in a thread, or None."""
+        return self.storage.findPost(self._name, thread_id, post_no)
+
+    def iterPosts(self, thread_id, start=0, chunk=64):
+        """Yield posts of a thread from the start-th one on.
+
+        Posts are fetched chunk at a time as they're consumed, so
+        only what the caller actually uses is read.
+        """
+        while True:
+            posts = self.getPosts(thread_id, start, chunk)
+            yield from posts
+            if len(posts) < chunk:
+                return
+            start += chunk
+
+    def getPostnum(self):
+        """Return the number of the last post made on the board."""
+        return self.storage.getPostnum(self._name)
+
+    def getGeneration(self):
+        """Return a string that changes every time the board changes."""
+        return self.storage.getGeneration(self._name)
+
+    def getPostsSince(self, after):
+        """Return [thread_id, subject, post] of posts newer than after."""
+        return self.storage.getPostsSince(self._name, after)
+
+    def waitForPosts(self, after, timeout):
+        """Like getPostsSince(), but wait up to timeout seconds for them."""
+        return self.storage.waitForPosts(self._name, after, timeout)
+
+    def getPreviews(self, start, count):
+        """Return count thread previews starting with the start-th one.
+
+        Threads are in bump order, a preview is
+        [thread_id, subject, OP post, number of replies].
+        """
+        return self.storage.getPreviews(self._name, start, count)
 
     @property
     def name(self):
@@ -120,9 +158,6 @@ class Board():
         use the rename() method. If you want to create a board,
         use the addBoard() method."""
         self._name = value
-        self.path = os.path.join(self.config.root, "boards", self._name)
-        self.index_path = os.path.join(self.path, "index")
-        self.boardlist_path = self.config.boardlist_path
 
     @property
     def desc(self):
@@ -138,39 +173,48 @@ class Board():
         """Rename the board, and change boardlist and index directory."""
         if desc == "":
             desc = self._desc
-        if self._name in self.config.getBoardlist().keys():
-            # Change boardlist.
-            buf = self.config.getBoardlist()
-            buf[name] = desc
-            del buf[self._name]
-            self.config.setBoardlist(buf)
-            # Change directories.
-            try:
-                new_path = os.path.join(self.config.root, '/boards/' + name)
-                os.makedirs(new_path)
-                # Copy index file.
-                shutil.copy(self.index_path, new_path)
-                os.remove(self.index_path)
-                os.removedirs(self.path)
-            except OSError as e:
-                logging.error("Board.addBoard: %s", e)
-                return False
+        if self.storage.renameBoard(self._name, name, desc):
             # Re-point the class fields to new values.
             self._name = name
             self._desc = desc
-            self.path = new_path
-            self.index_path = os.path.join(new_path, '/index')
-
             return True
+        return False
 
-    def addPost(self, post_text, subject="", thread_id=-1):
+    def renderPost(self, timestamp, post_text):
+        """Return [version, date, styled text] of a post."""
+        return [self.marker.VERSION,
+                time.strftime(DATE_FORMAT, time.localtime(timestamp)),
+                self.marker.demarkify(post_text)]
+
+    def rerender(self, everything=False):
+        """Store posts rendered by an older Marker.VERSION rendered again.
+
+        With everything=True all posts are rendered again, e.g. after
+        the server's time zone changed. Returns the number of posts.
+        """
+        posts = []
+        for thread in self.getIndex():
+            for post in thread[2:]:
+                if (everything or len(post) < 6 or
+                        post[3] != self.marker.VERSION):
+                    posts.append(
+                        [post[1]] + self.renderPost(post[0], post[2]))
+        if posts:
+            self.storage.setRendered(self._name, posts)
+        return len(posts)
+
+    def addPost(self, post_text, subject="", thread_id=-1, sage=False):
         """Posts a thread or a reply to a thread.
         
         If thread_id is not specified (i.e. = -1), a new thread
-        is created. Posting depends on the file (rootdir)/postnums
-        which has the following JSON structure:
-        [{'a': max_post_no}, {'b': max_post_no}, ...]
-        where max_post_no is the current highest post number.
+        is created. Replies bump the thread to the top of the board,
+        unless sage is True. How the post is stored depends on the storage
+        backend (see storage.py). With the default JSON backend,
+        the post is only appended to the board's log, the index file
+        is rewritten when the log grows past the log_compact setting.
+
+        Every board numbers its posts on its own, counting up from the
+        number of the last post made on it (see getPostnum()).
         
         Thread / post format is as follows:
         index page is a standard Python list, where
@@ -182,35 +226,22 @@ class Board():
             index[n][2][0] is the Unix timestamp
             index[n][2][1] is the ID (post number)
             index[n][2][2] is the text (body)
+            index[n][2][3] is the Marker.VERSION it was rendered with
+            index[n][2][4] is the date
+            index[n][2][5] is the text with markup rendered
         index[n][k], where k > 1, is the k-th reply to n-th thread
+
+        The last three are only there if the prerender setting is on
+        and the board has a marker, otherwise posts are rendered every
+        time they're shown.
         """
-        index_page = self.getIndex()
-     
-        postnums = self.config.getPostnums()
-        max_post_no = postnums[self._name]
+        if thread_id != -1:
+            thread_id = abs(thread_id)
         timestamp = int(time.time())
-
-        if thread_id == -1:
-            # Add a new thread.
-            index_page.append(
-                [max_post_no + 1, subject,
-                [timestamp, max_post_no + 1, post_text]])
-            self.setIndex(index_page)
-            postnums[self._name] += 1
-            self.config.setPostnums(postnums)
+        rendered = None
+        if self.config.prerender and self.marker is not None:
+            rendered = self.renderPost(timestamp, post_text)
+        if self.storage.addPost(self._name, post_text, subject, thread_id,
+                                sage, timestamp, rendered):
             return True
-        else:
-            # Add reply to an existing thread.
-            thread_id = abs(thread_id)
-            # Maybe get a better search algorithm?
-            for x in range(0, len(index_page)):
-                thread = index_page[x]
-                cur_thread_id = thread[0]
-
-                if cur_thread_id == thread_id:
-                    thread.append([timestamp, max_post_no + 1, post_text])
-                    self.setIndex(index_page)
-                    postnums[self._name] += 1
-                    self.config.setPostnums(postnums)
-                    return True
-        return False  # If posting fails.
\ No newline at end of file
+        return False  # If posting fails.
@@ -0,0 +1,168 @@
+"""
+Caches used to avoid re-reading and re-parsing unchanged files.
+
+A single session reads the same boardlist, postnums and board indexes
+over and over, so parsed files are kept in memory and reused for as
+long as the file on disk stays the same (same inode, size and mtime).
+
+Rendered board pages are cached on disk instead, so all sessions
+looking at the same page share a single rendering of it.
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import collections
+import logging
+import os
+
+import storage
+
+# Characters quote() leaves alone.
+SAFE = frozenset(
+    b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_.-~")
+
+
+def quote(text):
+    """Percent-encode text for a file name, like urllib.parse.quote().
+
+    Importing urllib.parse would slow down every session's startup.
+    """
+    return "".join(chr(byte) if byte in SAFE else "%{:02X}".format(byte)
+                   for byte in text.encode())
+
+
+def file_key(path):
+    """Return what identifies the current version of the file at path."""
+    st = os.stat(path)
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class FileCache():
+    """Least recently used cache of parsed files.
+
+    Values are whatever the load function returns and are shared
+    between callers, so they must be treated as read-only.
+    """
+
+    def __init__(self, size):
+        # Most entries kept at once, the least recently used go first.
+        self.size = size
+        # Path -> (file key, value).
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, load):
+        """Return load(path), reusing the last result if path is unchanged.
+
+        The file is stat()ed before loading it, so if it changes while
+        being loaded the stored key is outdated and the next get()
+        simply loads it again.
+        """
+        key = file_key(path)
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            self.entries.move_to_end(path)
+            return entry[1]
+
+        self.misses += 1
+        value = load(path)
+        self.entries[path] = (key, value)
+        self.entries.move_to_end(path)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return value
+
+    def has(self, path):
+        """Return whether load(path) of the file as it is now is cached."""
+        entry = self.entries.get(path)
+        try:
+            return entry is not None and entry[0] == file_key(path)
+        except FileNotFoundError:
+            return False
+
+    def forget(self, path):
+        """Drop path from the cache."""
+        self.entries.pop(path, None)
+
+    def stats(self):
+        """Return hit/miss counters for tuning the cache size."""
+        return {"hits": self.hits, "misses": self.misses,
+                "entries": len(self.entries), "size": self.size}
+
+
+class PageCache():
+    """Rendered board pages shared by all sshchan processes.
+
+    Every page is a file in the cache directory named after the board,
+    page number and terminal size it was rendered for. Its first line
+    is the board generation (see Board.getGeneration()) it was rendered
+    from, once a post lands on the board the generation changes and
+    the page is rendered again by the next viewer.
+
+    The directory holds up to size pages, the ones written longest ago
+    are removed to make room (see prune()).
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+
+    def pagePath(self, key):
+        return os.path.join(self.path, "-".join(
+            quote(str(part)) for part in key))
+
+    def get(self, key, generation):
+        """Return the page rendered for key and generation, or None."""
+        try:
+            with open(self.pagePath(key), 'r') as f:
+                cached = f.readline()[:-1]
+                if cached == generation:
+                    self.hits += 1
+                    return f.read()
+        except OSError:
+            pass
+        self.misses += 1
+        return None
+
+    def set(self, key, generation, text):
+        """Store a rendered page.
+
+        Returns False if it can't be written, e.g. the disk is full,
+        the page is then simply rendered again next time.
+        """
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            storage.atomic_write(
+                self.pagePath(key), generation + "\n" + text)
+            self.prune()
+        except OSError as e:
+            logging.error("PageCache.set: %s", e)
+            return False
+        return True
+
+    def prune(self):
+        """Remove the oldest pages if there are more than size.
+
+        A tenth more than needed go, so that not every page written
+        has to sort the directory.
+        """
+        with os.scandir(self.path) as entries:
+            pages = [entry for entry in entries
+                     if not entry.name.startswith(".")]
+        if len(pages) <= self.size:
+            return
+        pages.sort(key=lambda entry: entry.stat().st_mtime_ns)
+        for entry in pages[:len(pages) - self.size * 9 // 10]:
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                pass  # Removed by another session.
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
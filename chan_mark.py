@@ -5,36 +5,112 @@ instead of using escape codes.
 ==text== --> reverse video
 '''text''' --> bold
 ~~text~~ --> strikethrough
+>text (at the start of a line) --> quote, in green
+>>123 --> reference to post No.123, in blue
+
+All tags are compiled into a single regular expression, so a post is
+rendered in one pass however many tags there are.
 
 Copyright (c) 2015
 makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
 under GNU GPL v3, see LICENSE for details
 """
 
+import collections
 import re
 
+# Characters with a meaning of their own in regular expressions.
+SPECIAL = frozenset("\\.^$*+?{}[]()|")
 
 
 class Marker():
 
+    # (name, pattern, output) of every tag, in order of precedence.
+    # The pattern must have a group called like the tag, holding the
+    # text that goes in place of {} in output. Output must start with
+    # the escape code switching the style on and end with RESET.
+    # Patterns are matched in multiline mode, so ^ and $ match at the
+    # start and end of every line. New tags can be added with addTag().
+    RESET = '\033[0m'
+    TAGS = [
+        ("strike", "~~(?P<strike>.*?)~~", '\033[0;9m{}' + RESET),
+        ("bold", "'''(?P<bold>.*?)'''", '\033[0;1m{}' + RESET),
+        ("rv", "==(?P<rv>.*?)==", '\033[0;7m{}' + RESET),
+        ("link", ">>(?P<link>[0-9]+)", '\033[0;34m>>{}' + RESET),
+        ("quote", "^>(?P<quote>.*)$", '\033[0;32m>{}' + RESET),
+    ]
+    # Posts are stored rendered (see Board.addPost()), bump this whenever
+    # the rendering changes so stored posts get rendered again.
+    VERSION = 1
+
+    def __init__(self, cache_size=4096):
+        self.tags = list(Marker.TAGS)
+        self.compile()
+        # Rendered posts by post ID, see demarkify().
+        self.cache = collections.OrderedDict()
+        self.cache_size = cache_size
+
+    def compile(self):
+        """Build the regular expression matching any of the tags."""
+        # Escape codes typed into posts are neutralised in the same pass.
+        patterns = ["\033(?P<esc>)"]
+        for name, pattern, output in self.tags:
+            # When every alternative starts with a plain character, re
+            # jumps straight to the next place one of them is instead of
+            # trying them all at every position. Tags at the start of a
+            # line check for it after their first character for that.
+            if (pattern.startswith('^') and len(pattern) > 1
+                    and pattern[1] not in SPECIAL):
+                pattern = "{0}(?<=^{0}){1}".format(pattern[1], pattern[2:])
+            patterns.append(pattern)
+        self.pattern = re.compile("|".join(patterns), re.M)
+        # Text going before and after the tag's group in the output.
+        self.outputs = {name: tuple(output.split('{}'))
+                        for name, pattern, output in self.tags}
+        # Escape code each output starts with, e.g. '\033[0;9m'.
+        self.starts = {name: output[:output.index('m') + 1]
+                       for name, pattern, output in self.tags}
+
+    def addTag(self, name, pattern, output):
+        """Add a tag, see TAGS for the meaning of the arguments."""
+        self.tags.append((name, pattern, output))
+        self.compile()
+        self.cache.clear()
+
     def esc(self, input_text):
         input_text = input_text.replace('\033', '\\033')
         return input_text
 
-    def demarkify(self, input_text):
-        """Prints out a marked-up piece of text."""
-        output_text = self.esc(input_text)
-        # strikethrough
-        output_text = re.sub(
-            '~~(?P<substring>.*?)~~', '\033[0;9m\g<substring>\033[0m',
-            output_text)
-        # bold
-        output_text = re.sub(
-            '\'\'\'(?P<substring>.*?)\'\'\'', '\033[0;1m\g<substring>\033[0m',
-            output_text)
-        # rv
-        output_text = re.sub(
-            '==(?P<substring>.*?)==', '\033[0;7m\g<substring>\033[0m',
-            output_text)
-
-        return output_text
\ No newline at end of file
+    def render(self, match):
+        tag = match.lastgroup
+        if tag == "esc":
+            return '\\033'
+        before, after = self.outputs[tag]
+        inner = match.group(tag)
+        if self.pattern.search(inner) is None:
+            return before + inner + after
+        # Tags inside the tag are rendered too, and since they end with
+        # a reset, the outer style is switched back on after them.
+        inner = self.pattern.sub(self.render, inner)
+        return before + inner.replace(
+            Marker.RESET, Marker.RESET + self.starts[tag]) + after
+
+    def demarkify(self, input_text, post_id=None):
+        """Prints out a marked-up piece of text.
+
+        If post_id (anything hashable identifying the post, e.g. board
+        name and post number) is given, the rendered text is cached.
+        """
+        if post_id is not None:
+            cached = self.cache.get(post_id)
+            if cached is not None and cached[0] == input_text:
+                self.cache.move_to_end(post_id)
+                return cached[1]
+
+        output_text = self.pattern.sub(self.render, input_text)
+
+        if post_id is not None:
+            self.cache[post_id] = (input_text, output_text)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return output_text
@@ -11,11 +11,21 @@ under GNU GPL v3, see LICENSE for details
 import os
 import json
 import logging
+import shutil
 
-logging.basicConfig(
-        filename="log",
-        format="[%(lineno)d]%(asctime)s:%(levelname)s:%(message)s",
-        level=logging.DEBUG)
+import storage
+
+
+def start_logging():
+    """Send log messages to the file "log" in the working directory.
+
+    Only entry points (sshchan.py, sshchand.py, setup.py) call this, once
+    at start, modules just log.
+    """
+    logging.basicConfig(
+            filename="log",
+            format="[%(lineno)d]%(asctime)s:%(levelname)s:%(message)s",
+            level=logging.DEBUG)
 
 
 class Colors():
@@ -58,15 +68,76 @@ class Config():
         self.admin = settings["admin"]
         self.salt = settings["salt"]
         self.passwd = settings["password"]
+        # Lock file serializing writes from all sshchan processes.
+        self.lock_path = os.path.join(self.root, "lock")
+        # Storage backend for boards, see storage.py.
+        self.storage_type = settings.get("storage", "json")
+        self.database_path = settings.get(
+            "database_path", os.path.join(self.root, "sshchan.db"))
+        # Unix socket of the sshchan daemon, if one is used.
+        self.daemon_socket = settings.get("daemon_socket", "")
+        # Seconds between checks for new posts when following a board.
+        self.poll_interval = settings.get("poll_interval", 1.0)
+        # How many parsed board indexes to keep in memory.
+        self.cache_boards = settings.get("cache_boards", 8)
+        # Rendered board pages shared between sessions.
+        self.page_cache = settings.get("page_cache", True)
+        self.cache_dir = settings.get(
+            "cache_dir", os.path.join(self.root, "cache"))
+        # Most pages kept in cache_dir.
+        self.page_cache_size = settings.get("page_cache_size", 1000)
+        # Store posts rendered (markup and date) along with their text.
+        self.prerender = settings.get("prerender", True)
+        # refresh prints the posts made since the board was shown, rather
+        # than showing it again.
+        self.delta_refresh = settings.get("delta_refresh", False)
+
+        # Threads beyond this many pages, or not posted in for this many
+        # days, are moved to the archive. 0 turns either off.
+        self.archive_pages = settings.get("archive_pages", 0)
+        self.archive_days = settings.get("archive_days", 0)
+        self.archive_compression = settings.get(
+            "archive_compression", "gzip")
+
+        # Record timing and I/O of every command, see metrics.py.
+        self.metrics = settings.get("metrics", False)
+        self.metrics_path = settings.get(
+            "metrics_path", os.path.join(self.root, "metrics"))
+        # Directory for a cProfile dump of every session, "" for none.
+        self.profile_dir = settings.get("profile_dir", "")
+
+        # Flood control, see flood.py: [posts, seconds] a user and a
+        # board may take, and for how many seconds the same post can't
+        # be made twice on a board. 0 turns either off.
+        self.user_post_limit = settings.get("user_post_limit", [5, 60])
+        self.board_post_limit = settings.get("board_post_limit", [60, 60])
+        self.duplicate_window = settings.get("duplicate_window", 300)
+        self.flood_path = settings.get(
+            "flood_path", os.path.join(self.root, "flood"))
+
+        # Format of the files of the JSON storage backend.
+        self.index_format = settings.get("index_format", "compact")
+
+        # Size of a board's log (in bytes) after which it is compacted
+        # into the index file. 0 compacts on every post.
+        self.log_compact = settings.get("log_compact", 1024 * 1024)
 
         # Max threads on page.
         self.max_threads = 15 - 1
-        # Terminal size.
-        self.tty_cols = os.get_terminal_size()[0]
-        self.tty_lines = os.get_terminal_size()[1] 
+        # Terminal size, kept up to date by display.Screen.
+        self.setTerminalSize(*shutil.get_terminal_size())
         # Used for laprint() from Display.
         self.lines_printed = 0
 
+        # Opened last, backends may use any of the settings above.
+        self.storage = storage.open_storage(self)
+
+    def setTerminalSize(self, cols, lines):
+        """Set the terminal size, and what depends on it."""
+        self.tty_cols, self.tty_lines = cols, lines
+        # Posts on a page of a thread, about as many as fit the screen.
+        self.max_posts = max(1, (self.tty_lines - 3) // 3)
+
     def load(self):
         """Load a JSON configuration file, or return default values."""
         try:
@@ -88,9 +159,7 @@ class Config():
 
     def getBoardlist(self):
         """Return the boardlist as a Python dictionary."""
-        with open(self.boardlist_path, 'r') as b:
-            buf = json.load(b)
-        return buf
+        return self.storage.getBoardlist()
 
     def setBoardlist(self, values):
         """Update/create the boardlist with values.
@@ -100,20 +169,20 @@ class Config():
         where boardname should be just the name without any slashes
         (but they are not forbidden).
         """
-        with open(self.boardlist_path, 'w') as b:
-            json.dump(values, b, indent=4)
+        self.storage.setBoardlist(values)
         logging.info("Updated boardlist file.")
         return True
 
     def getPostnums(self):
         """Return the postnums file as a Python dictionary."""
-        with open(self.postnums_path, 'r') as p:
-            buf = json.load(p)
-        return buf
+        return self.storage.getPostnums()
 
     def setPostnums(self, values):
         """Update/create the postnums for board name with value."""
-        with open(self.postnums_path, 'w') as p:
-            json.dump(values, p, indent=4)
+        self.storage.setPostnums(values)
         logging.info("Updated postnums file.")
-        return True
\ No newline at end of file
+        return True
+
+    def cacheStats(self):
+        """Return hit/miss counters of the storage backend's caches."""
+        return self.storage.cacheStats()
@@ -3,7 +3,8 @@ Display class handles all the printing, of threads, boards, menus etc.
 
 It uses a special version of print called laprint which stands for
 line-aware print. It counts the lines printed to then appropriately
-fill the rest of screen with newlines.
+fill the rest of screen with newlines. Whole screens go to the terminal
+through Screen, which sends only what changed when a view is shown again.
 
 Copyright (c) 2015
 makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
@@ -11,87 +12,472 @@ under GNU GPL v3, see LICENSE for details
 """
 
 import time
-import string
 import logging
-import os
-
+import io
+import itertools
+import re
+import shutil
+import signal
+import sys
+import unicodedata
+import zlib
+
+import metrics
+import search
+from archive import Archive
+from boards import DATE_FORMAT
+from cache import PageCache, file_key
 from config import Colors
-
-logging.basicConfig(
-        filename="log",
-        format="[%(lineno)d]%(asctime)s:%(levelname)s:%(message)s",
-        level=logging.DEBUG)
+from flood import FloodControl, Refused
 
 # Instance of Colors class for colored output, e.g. c.RED.
 c = Colors()
 
+# Moves the cursor home and clears the screen, what clear(1) prints.
+CLEAR_SCREEN = "\033[H\033[2J"
+# Terminal escape sequences, they take no space on screen.
+ANSI_ESCAPE = re.compile('\033\\[[0-9;]*[A-Za-z]')
+ANSI_SPLIT = re.compile('(\033\\[[0-9;]*[A-Za-z])')
+# Color (SGR) codes, one after another.
+COLOR_RUN = re.compile('(?:\033\\[[0-9;]*m)+')
+COLOR_PARAMS = re.compile('\033\\[([0-9;]*)m')
+
+
+def text_width(text):
+    """Return how many terminal columns text takes up."""
+    if text.isascii():
+        return len(text)
+    width = 0
+    for ch in text:
+        if unicodedata.combining(ch):
+            continue
+        # Wide and fullwidth (e.g. CJK) characters take two columns.
+        width += 2 if unicodedata.east_asian_width(ch) in "WF" else 1
+    return width
+
+
+def count_lines(msg, cols):
+    """Return how many line breaks msg causes on a cols wide terminal.
+
+    Every newline counts, and so does every time a line wraps.
+    """
+    segments = ANSI_ESCAPE.sub('', msg).split("\n")
+    lines = len(segments) - 1
+    for segment in segments:
+        width = text_width(segment)
+        if width > cols:
+            if segment.isascii():
+                lines += (width - 1) // cols
+            else:
+                # Wide characters don't get split between rows.
+                lines += len(split_rows(segment, cols)) - 1
+    return lines
+
+
+def coalesce(text):
+    """Return text with its color codes sent in as few bytes as possible.
+
+    Codes one after another become one, codes leaving the colors as they
+    are go, and so do resets when the colors are reset already.
+    """
+    if "\033" not in text:
+        return text
+    parts = []
+    position = 0
+    # Parameters set since the last reset, None until one is seen.
+    state = None
+    for match in COLOR_RUN.finditer(text):
+        parts.append(text[position:match.start()])
+        position = match.end()
+        params = []
+        reset = False
+        for code in COLOR_PARAMS.findall(match.group()):
+            code = code.split(";")
+            if code[0] in ("", "0"):
+                reset = True
+                params = code[1:]
+            else:
+                params.extend(code)
+        if not reset:
+            parts.append("\033[" + ";".join(params) + "m")
+            if state is not None:
+                state = state + params
+        elif params != state:
+            if state == []:
+                parts.append("\033[" + ";".join(params) + "m")
+            else:
+                parts.append("\033[" + ";".join(["0"] + params) + "m")
+            state = params
+    parts.append(text[position:])
+    return "".join(parts)
+
+
+def split_rows(line, cols):
+    """Split a line into the rows it takes up on a cols wide terminal."""
+    rows = [[]]
+    width = 0
+    for n, part in enumerate(ANSI_SPLIT.split(line)):
+        if n % 2 == 1:
+            # Escape sequence.
+            rows[-1].append(part)
+            continue
+        for ch in part:
+            ch_width = text_width(ch)
+            if width + ch_width > cols:
+                rows.append([])
+                width = 0
+            rows[-1].append(ch)
+            width += ch_width
+    return ["".join(row) for row in rows]
+
+
+def screen_lines(text, cols):
+    """Split a screen of text into its lines.
+
+    Returns [row, style, line] of every line: the row it starts on, the
+    escape codes (colors) in effect at its start and the line itself.
+    """
+    result = []
+    row = 0
+    style = []
+    for line in text.split("\n"):
+        result.append([row, "".join(style), line])
+        row += 1 + count_lines(line, cols)
+        for code in ANSI_ESCAPE.findall(line):
+            if not code.endswith("m"):
+                continue
+            # All of Colors start by resetting what came before.
+            if code.startswith("\033[0"):
+                style = []
+            if code != c.BLACK:
+                style.append(code)
+    return result
+
+
+class Screen():
+    """The terminal of a session and what's on it.
+
+    Display writes screens (pages laid out to fill the terminal) with
+    show(). Once install()ed the Screen is also sys.stdout, and sees what
+    the user types through sys.stdin, so it knows where the last screen
+    went as the terminal scrolled. Showing the same view again then only
+    sends the lines that changed. The terminal size in Config is updated
+    when the terminal is resized (SIGWINCH).
+    """
+
+    def __init__(self, config):
+        self.config = config
+        # The real sys.stdout, once installed.
+        self.out = None
+        self.resized = False
+        # screen_lines() of the screen on the terminal and its view, the
+        # lines being None if it isn't known what's there.
+        self.shown = None
+        self.view = None
+        # Where the cursor is, and how many rows the terminal scrolled
+        # since the screen was shown.
+        self.row = 0
+        self.column = 0
+        self.scrolled = 0
+
+    def install(self):
+        """Make the session's terminal input and output go through here."""
+        self.out = sys.stdout
+        sys.stdout = self
+        sys.stdin = Keyboard(self, sys.stdin)
+        if hasattr(signal, "SIGWINCH"):
+            signal.signal(signal.SIGWINCH, self.resize)
+
+    def resize(self, signum=None, frame=None):
+        """SIGWINCH handler, update() picks the new size up."""
+        self.resized = True
+
+    def update(self):
+        """Pick up the new terminal size if the terminal was resized."""
+        if self.resized:
+            self.resized = False
+            self.config.setTerminalSize(*shutil.get_terminal_size())
+            self.shown = None
+
+    def forget(self):
+        """Forget what's on the terminal, after something else wrote to it."""
+        self.shown = None
+
+    def write(self, text):
+        self.out.write(text)
+        self.track(text)
+        return len(text)
+
+    def flush(self):
+        self.out.flush()
+
+    def fileno(self):
+        # Makes input() write its prompt through write().
+        raise io.UnsupportedOperation("fileno")
+
+    def __getattr__(self, name):
+        return getattr(self.out, name)
+
+    def track(self, text):
+        """Follow the cursor through text going to the terminal."""
+        if self.shown is None:
+            return
+        cols, lines = self.config.tty_cols, self.config.tty_lines
+        segments = ANSI_ESCAPE.sub('', text).split("\n")
+        for n, segment in enumerate(segments):
+            self.column += text_width(segment)
+            if n < len(segments) - 1:
+                rows = 1 + max(0, self.column - 1) // cols
+                self.column = 0
+            else:
+                # Lines wrap when the next character comes.
+                rows = max(0, self.column - 1) // cols
+                self.column -= rows * cols
+            down = min(rows, lines - 1 - self.row)
+            self.row += down
+            self.scrolled += rows - down
+
+    def show(self, text, view=None):
+        """Replace what's on the terminal with a screen of text.
+
+        If the terminal shows view already (view being anything telling
+        screens apart, None for none) only what changed is sent. Returns
+        what was written.
+        """
+        if self.out is None:
+            text = CLEAR_SCREEN + text
+            sys.stdout.write(text)
+            sys.stdout.flush()
+            return text
+
+        cols, lines = self.config.tty_cols, self.config.tty_lines
+        new = screen_lines(text, cols)
+        end = new[-1][0] + count_lines(new[-1][2], cols)
+        # Rows are counted from the top of the terminal, the top of a
+        # screen taller than it having scrolled out of sight.
+        top = max(0, end - (lines - 1))
+        for line in new:
+            line[0] -= top
+
+        output = CLEAR_SCREEN + text
+        if (view is not None and view == self.view
+                and self.shown is not None and self.scrolled < lines - 1):
+            diff = coalesce(self.diff(self.shown, new))
+            if len(diff) < len(output):
+                output = diff
+        self.out.write(output)
+        self.out.flush()
+
+        self.row = end - top
+        self.column = text_width(ANSI_ESCAPE.sub('', new[-1][2])) % cols
+        self.shown = new
+        self.view = view
+        self.scrolled = 0
+        return output
+
+    def diff(self, old, new):
+        """Return what turns the screen old on the terminal into new."""
+        parts = []
+        if self.scrolled > 0:
+            # Scroll the old screen back down where it was.
+            parts.append("\033[H" + "\033M" * self.scrolled)
+        for n, (row, style, line) in enumerate(new):
+            if (n + 1 >= len(new) or n + 1 >= len(old)
+                    or old[n + 1][0] != new[n + 1][0]):
+                # Lines from here on moved, write them all out.
+                while n + 1 < len(new) and new[n + 1][0] <= 0:
+                    n += 1
+                row, style, line = new[n]
+                parts.append("\033[{};1H\033[J".format(max(0, row) + 1))
+                parts.append(self.redraw(row, style, line))
+                parts.extend("\n" + line for _, _, line in new[n + 1:])
+                break
+            if row < self.scrolled or old[n][1:] != [style, line]:
+                parts.append(self.redraw(row, style, line))
+        return "".join(parts)
+
+    def redraw(self, row, style, line):
+        """Return what writes line over the rows from row on.
+
+        Rows above the top of the terminal are left out.
+        """
+        rows = split_rows(style + line, self.config.tty_cols)
+        parts = []
+        for n in range(max(0, -row), len(rows)):
+            # Colors of the rows before still apply.
+            codes = "".join(ANSI_ESCAPE.findall("".join(rows[:n])))
+            parts.append("\033[{};1H\033[K".format(row + n + 1))
+            parts.append(c.BLACK + codes + rows[n])
+        return "".join(parts)
+
+
+class Keyboard():
+    """sys.stdin of an installed Screen.
+
+    The terminal echoes what the user types, so the screen has to know.
+    """
+
+    def __init__(self, screen, stream):
+        self.screen = screen
+        self.stream = stream
+        self.echo = stream.isatty()
+
+    def readline(self, size=-1):
+        line = self.stream.readline(size)
+        if self.echo:
+            self.screen.track(line)
+        return line
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
 
 class Display():
 
-    def __init__(self, config=None, board=None, marker=None):
+    def __init__(self, config=None, board=None, marker=None, screen=None):
         assert config is not None, logging.critical(
             "Display.__init__: config is None.")
         self.config = config
         self.board = board
         self.marker = marker
+        # Output collected by laprint() waiting for flush().
+        self.pending = []
+        # The terminal, see Screen.
+        if screen is None:
+            screen = Screen(self.config)
+        self.screen = screen
+        # Set by clear() until the screen it started is written out.
+        self.framing = False
+        self.view = None
+        # Screens rendered for the page cache, kept here by flush().
+        self.capture = None
+        # Last post number when the board's first page was shown, for
+        # refresh() with delta_refresh.
+        self.since = None
+        # Threads pruned off the boards.
+        self.archive = Archive(self.config)
+        # How fast users may post, see flood.py.
+        self.flood = FloodControl(self.config)
+        # Rendered board pages shared with other sessions.
+        if self.config.page_cache:
+            self.page_cache = PageCache(
+                self.config.cache_dir, self.config.page_cache_size)
+        else:
+            self.page_cache = None
         
         if self.board is None or self.board.name == "":
             self.displayMOTD()
         else:
             self.displayBoard()
 
-    def laprint(self, *args, endc='\n', markup=False):
-        """Line-aware print keeps track of number of lines printed."""
-        chars = 0
-        lines = 0
-        msg = ""
+    @metrics.timed("render")
+    def laprint(self, *args, endc='\n', markup=False, post_id=None):
+        """Line-aware print keeps track of number of lines printed.
 
-        for arg in args:
-            msg += str(arg)
+        Output isn't written right away but collected until flush()
+        (called by layout()), so a whole screen goes out in one write.
+        With markup=True, post_id lets the marker cache the rendering.
+        """
+        msg = "".join(str(arg) for arg in args)
 
         if markup == True and self.marker is not None:
-            msg = self.marker.demarkify(msg)
-
-        for c in msg:
-            # Stops non-printing characters (such as ANSI codes)
-            # from counting towards the chars value.
-            if c in string.printable:
-                chars += 1
-            if c == "\n":
-                lines += 1
-                chars = 0
-            if chars > self.config.tty_cols:
-                lines += 1
-                chars = 0
-            print(c, end='')
+            msg = self.marker.demarkify(msg, post_id)
 
+        lines = count_lines(msg, self.config.tty_cols)
         if endc == "\n":
             lines += 1
 
-        print(endc, end="")
+        self.pending.append(msg)
+        self.pending.append(endc)
         self.config.lines_printed += lines
 
+    @metrics.timed("output")
+    def flush(self):
+        """Write out everything laprint() collected so far.
+
+        A screen started with clear() replaces what's on the terminal.
+        """
+        text = coalesce("".join(self.pending))
+        self.pending = []
+        if self.capture is not None:
+            self.capture.append(text)
+            return
+        if self.framing:
+            self.framing = False
+            text = self.screen.show(text, self.view)
+        else:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        metrics.count(output=len(text))
+
+    @metrics.timed("clear")
+    def clear(self, view=None):
+        """Start a new screen, shown in place of the old one by layout().
+
+        view tells what the screen shows (e.g. a board page), if the
+        terminal shows the same view already only the difference is sent.
+        """
+        self.screen.update()
+        self.framing = True
+        self.view = view
+
     def printBoards(self):
         """Print board names and descriptions from boardlist file."""
         for board, desc in self.config.getBoardlist().items():
             self.laprint("/", board, "/\t-\t", desc)
 
     def layout(self):
-        """Fill the rest of screen with newlines."""
+        """Fill the rest of screen with newlines and write it out."""
         lines_so_far = self.config.lines_printed
-        for x in range(lines_so_far, self.config.tty_lines - 1):
-            print()
+        self.pending.append(
+            "\n" * max(0, self.config.tty_lines - 1 - lines_so_far))
         self.config.lines_printed = 0
+        self.flush()
 
     def convert_time(self, stamp):
         """Convert UNIX timestamp to human readable date in local time."""
-        return time.strftime('%H:%M:%S %d %b %Y', time.localtime(stamp))
+        return time.strftime(DATE_FORMAT, time.localtime(stamp))
+
+    @metrics.timed("render")
+    def renderPost(self, post):
+        """Return the date and the text with markup rendered of a post.
+
+        Posts stored rendered by the current Marker.VERSION (see
+        Board.addPost()) are used as they are.
+        """
+        if self.marker is None:
+            return self.convert_time(int(post[0])), post[2]
+        if len(post) > 5 and post[3] == self.marker.VERSION:
+            return post[4], post[5]
+        return (self.convert_time(int(post[0])),
+                self.marker.demarkify(post[2], (self.board.name, post[1])))
 
     def displayMOTD(self):
-        """Message of the day screen display function."""
-        global c  # colors object
-        os.system("clear")  # Clear screen.
+        """Message of the day screen display function.
 
+        It's the first thing every session shows and the same for
+        everybody with the same terminal size, so it's kept in the page
+        cache until the config, the MOTD or the boardlist change.
+        """
+        self.clear(("motd",))
+        if self.page_cache is None:
+            return self.renderMOTD()
+        key = ("motd", self.config.tty_cols, self.config.tty_lines)
+        return self.showCached(key, self.motdGeneration(), self.renderMOTD)
+
+    def motdGeneration(self):
+        """Return a string that changes whenever the MOTD screen does."""
+        inputs = []
+        for path in (self.config.path, self.config.motd):
+            try:
+                inputs.append(file_key(path))
+            except FileNotFoundError:
+                inputs.append(None)
+        inputs.append(list(self.config.getBoardlist().items()))
+        return "{:08x}".format(zlib.crc32(repr(inputs).encode()))
+
+    def renderMOTD(self):
+        global c  # colors object
         self.laprint(
             c.RED, "Welcome to" , c.YELLOW, " sshchan!\n===========",
             c.RED, "========", c.BLACK)
@@ -110,9 +496,50 @@ class Display():
         self.laprint("This server has the following boards:")
         self.printBoards()
         self.layout()
+        return True
 
     def displayBoard(self, page=1):
+        """Show a board page, from the page cache if possible."""
+        assert self.board is not None, logging.critical(
+            "Display.displayBoard(): board is None.")
+        page = max(page, 1)
+        self.clear(("board", self.board.name, page))
+        if self.config.delta_refresh and page == 1:
+            self.since = self.board.getPostnum()
+
+        if self.page_cache is None:
+            return self.renderBoard(page)
+
+        key = (self.board.name, page,
+               self.config.tty_cols, self.config.tty_lines)
+        # Taken before rendering: if a post lands meanwhile, the page is
+        # stored under the old generation and rendered again next time.
+        return self.showCached(key, self.board.getGeneration(),
+                               self.renderBoard, page)
+
+    def showCached(self, key, generation, render, *args):
+        """Show the screen render(*args) lays out, cached in the page cache.
+
+        Only screens render() returns True for are stored, e.g. not
+        pages past the end of a board.
+        """
+        text = self.page_cache.get(key, generation)
+        if text is None:
+            self.capture = []
+            try:
+                keep = render(*args)
+                text = "".join(self.capture)
+            finally:
+                self.capture = None
+            if keep:
+                self.page_cache.set(key, generation, text)
+        self.pending.append(text)
+        self.flush()
+        return True
+
+    def renderBoard(self, page=1):
         """Parses and prints threads in the board index.
+        Threads are shown in bump order, see Board.getPreviews().
         Board index JSON layout:
         [
          ['thread id', 'subject', 
@@ -124,25 +551,20 @@ class Display():
         ]
         """
         global c
-        assert self.board is not None, logging.critical(
-            "Display.displayBoard(): board is None.")
-        os.system("clear")  # Clear screen.
-        lines_printed = 0
-        index = self.board.getIndex()
+
+        # Only previews of threads shown on the requested page are
+        # fetched, most recently bumped first.
+        start = self.config.max_threads * (page - 1)
+        threads = self.board.getPreviews(start, self.config.max_threads)
 
         # First check if we even have a valid index.
-        if type(index) != list or len(index) == 0:
+        if page == 1 and len(threads) == 0:
             self.laprint(c.bBLACK, "Board is empty.", c.BLACK)
             self.layout()
             return False
 
-        # Those two lines compute what threads to show on specified page.
-        max_on_page = self.config.max_threads * page
-        i = self.config.max_threads * (page - 1)
-
-        for thread in index[i:]:
-            if i < max_on_page:
-                date = self.convert_time(int(thread[2][0]))
+        for thread in threads:
+            date, text = self.renderPost(thread[2])
 
         # NOTE:
         # Board display functions should use laprint() instead of print()
@@ -151,53 +573,215 @@ class Display():
         # There are two differences between laprint() and print():
         # the ending character is called 'endc' in laprint
         # e.g. laprint('hello', endc='').
+            self.laprint(
+                c.GREEN, date, c.BLACK, ' No.',
+                str(thread[0]), endc = ' ')
+            self.laprint(c.bRED, thread[1], c.BLACK)
+            self.laprint(text)
+            if thread[3] > 0:
                 self.laprint(
-                    c.GREEN, date, c.BLACK, ' No.',
-                    str(thread[0]), endc = ' ')
-                self.laprint(c.bRED, thread[1], c.BLACK)
-                self.laprint(thread[2][2], markup=True)
-                if len(thread) > 3:
-                    self.laprint(
-                        c.GREEN, str(len(thread) - 3),
-                        " posts hidden. Type v ", str(thread[0]),
-                        " to view.", c.BLACK)
-                self.laprint('--------')
-
-                i += 1
+                    c.GREEN, str(thread[3]),
+                    " posts hidden. Type v ", str(thread[0]),
+                    " to view.", c.BLACK)
+            self.laprint('--------')
         self.laprint(c.BLUE, 'Page ', str(page), c.BLACK)
 
         # Fill the rest of the page with newlines.
         self.layout()
+        # Pages past the last one aren't worth keeping.
+        return len(threads) > 0
         
-    def displayThread(self, thread_id):
-        """Print out thread contents (replies) in detail."""
+    def displayThread(self, thread_id, page=1, last=0, post_no=None,
+                      archived=False):
+        """Print out a page of a thread's posts in detail.
+
+        A page holds as many posts as fit the screen (max_posts in
+        Config), the OP being the first post of page 1. With last > 0
+        the last posts are shown instead, with post_no the page holding
+        that post. Posts are read from storage as they're printed, so
+        huge threads show up as fast as small ones. archived=True shows
+        a thread from the board's archive.
+        """
         global c
         assert self.board is not None, logging.critical(
-            "Display.displayBoard(): board is None.")
-        os.system("clear")  # Clear screen.
-        index = self.board.getIndex()
+            "Display.displayThread(): board is None.")
+        thread_id = int(thread_id)
+        self.clear(("thread", self.board.name, thread_id, page, last, post_no,
+                    archived))
+        if archived:
+            board = self.archive.board(self.board.name)
+        else:
+            board = self.board
+        info = board.getThreadInfo(thread_id)
+
+        if info is None:
+            self.laprint(
+                c.RED, "Thread No.", str(thread_id), " does not exist.",
+                c.BLACK)
+            self.layout()
+            return False
 
-        for thread in index:
-            if thread[0] == int(thread_id):
-                date = self.convert_time(int(thread[2][0]))
-                # Print OP first.
+        per_page = self.config.max_posts
+        pages = (info[2] - 1) // per_page + 1
+        if post_no is not None:
+            position = board.findPost(thread_id, post_no)
+            if position is None:
+                self.laprint(
+                    c.RED, "Post No.", str(post_no), " is not in thread No.",
+                    str(thread_id), ".", c.BLACK)
+                self.layout()
+                return False
+            page = position // per_page + 1
+        if last > 0:
+            start, count = max(0, info[2] - last), last
+        else:
+            page = min(max(page, 1), pages)
+            start, count = (page - 1) * per_page, per_page
+
+        if start > 0:
+            self.laprint(
+                c.bRED, info[1], c.BLACK, ' (thread No.', str(thread_id), ')')
+            self.laprint()
+        posts = board.iterPosts(thread_id, start, min(count, 64))
+        for post in itertools.islice(posts, count):
+            date, text = self.renderPost(post)
+            if post[1] == thread_id:
+                # OP goes with the subject.
                 self.laprint(
-                    c.GREEN, date, c.BLACK, ' No.',
-                    str(thread[0]), endc=' ')
-                self.laprint(c.bRED, thread[1], c.BLACK)
-                self.laprint(thread[2][2], '\n', markup=True)
-
-                # Then replies, if there are any.
-                if len(thread) > 3:
-                    for reply in thread[3:]:
-                        date = self.convert_time(int(reply[0]))
-                        self.laprint(
-                            c.GREEN, date, c.BLACK, ' No.', str(reply[1]))
-                        self.laprint(reply[2], '\n', markup=True)
+                    c.GREEN, date, c.BLACK, ' No.', str(post[1]), endc=' ')
+                self.laprint(c.bRED, info[1], c.BLACK)
+            else:
+                self.laprint(c.GREEN, date, c.BLACK, ' No.', str(post[1]))
+            self.laprint(text)
+            self.laprint()
+
+        if last > 0:
+            self.laprint(
+                c.BLUE, 'Last ', str(min(last, info[2])), ' of ',
+                str(info[2]), ' posts', c.BLACK)
+        else:
+            self.laprint(
+                c.BLUE, 'Page ', str(page), ' of ', str(pages),
+                ' (archived)' if archived else '', c.BLACK)
+        self.layout()
+        return True
+
+    def displayArchive(self, page=1):
+        """List the board's archived threads, latest archived first."""
+        global c
+        assert self.board is not None, logging.critical(
+            "Display.displayArchive(): board is None.")
+        page = max(page, 1)
+        self.clear(("archive", self.board.name, page))
+        per_page = self.config.tty_lines - 3
+        threads = self.archive.getThreads(
+            self.board.name, per_page * (page - 1), per_page)
+        if page == 1 and len(threads) == 0:
+            self.laprint(c.bBLACK, "Archive is empty.", c.BLACK)
+
+        for thread_id, subject, replies, last, segment in threads:
+            self.laprint(
+                c.GREEN, self.convert_time(last), c.BLACK, ' No.',
+                str(thread_id), ' ', c.bRED, subject, c.BLACK, ' (',
+                str(replies), ' replies)')
+        self.laprint(
+            c.BLUE, 'Archive page ', str(page), c.BLACK,
+            ' - type archive view [number] to read a thread')
         self.layout()
 
-    def postMenu(self, thread_id=-1):
-        """Posting prompt for new thread / reply."""
+    def follow(self, thread_id=None):
+        """Print new posts on the board (or one thread) as they arrive.
+
+        Nothing is re-read or re-rendered apart from the new posts.
+        Runs until the user presses Ctrl-C.
+        """
+        global c
+        after = self.board.getPostnum()
+        if thread_id is None:
+            print(c.GREEN, "Following /" + self.board.name + "/,",
+                  "press Ctrl-C to stop.", c.BLACK)
+        else:
+            print(c.GREEN, "Following thread No." + str(thread_id) + ",",
+                  "press Ctrl-C to stop.", c.BLACK)
+
+        try:
+            while True:
+                for post_thread, subject, post in self.board.waitForPosts(
+                        after, 60):
+                    after = max(after, post[1])
+                    if thread_id is not None and post_thread != thread_id:
+                        continue
+                    self.printNewPost(post_thread, subject, post)
+                    self.flush()
+        except KeyboardInterrupt:
+            print()
+        self.config.lines_printed = 0
+
+    def printNewPost(self, thread_id, subject, post):
+        """laprint() a post as it's shown by follow() and refresh()."""
+        global c
+        date, text = self.renderPost(post)
+        if post[1] == thread_id:
+            # New thread.
+            self.laprint(
+                c.GREEN, date, c.BLACK, ' No.', str(post[1]), endc=' ')
+            self.laprint(c.bRED, subject, c.BLACK)
+        else:
+            self.laprint(
+                c.GREEN, date, c.BLACK, ' No.', str(post[1]),
+                ' in thread No.', str(thread_id))
+        self.laprint(text)
+        self.laprint()
+
+    def refresh(self):
+        """Show the board's first page again.
+
+        With delta_refresh, if that's what was shown last, only the posts
+        made since are printed below it instead.
+        """
+        global c
+        if (self.since is None or not self.config.delta_refresh
+                or self.view != ("board", self.board.name, 1)):
+            return self.displayBoard()
+        posts = self.board.getPostsSince(self.since)
+        for thread_id, subject, post in posts:
+            self.since = max(self.since, post[1])
+            self.printNewPost(thread_id, subject, post)
+        if len(posts) == 0:
+            self.laprint(c.GREEN, "No new posts.", c.BLACK)
+        self.flush()
+        self.config.lines_printed = 0
+        return True
+
+    def displaySearch(self, query, everywhere=False):
+        """Print the posts best matching query, on this board or all."""
+        global c
+        if everywhere:
+            names = list(self.config.getBoardlist())
+        else:
+            names = [self.board.name]
+        self.clear(("search", tuple(names), query))
+        results = search.search_boards(
+            self.config.storage, names, query, self.config.max_posts)
+
+        for score, name, thread_id, subject, post in results:
+            date, text = self.renderPost(post)
+            self.laprint(
+                c.GREEN, date, c.BLACK, ' /', name, '/ No.', str(post[1]),
+                ' in thread No.', str(thread_id), ' ', c.bRED, subject,
+                c.BLACK)
+            self.laprint(text)
+            self.laprint()
+        if len(results) == 0:
+            self.laprint(c.RED, "No posts found.", c.BLACK)
+        self.layout()
+        return len(results) > 0
+
+    def postMenu(self, thread_id=-1, sage=False):
+        """Posting prompt for new thread / reply.
+
+        sage=True posts the reply without bumping the thread.
+        """
         buf = ""
         print("Post text: (make an empty line to stop editing)")
 
@@ -212,18 +796,55 @@ class Display():
             subject = input("Thread subject: ")
             opt = input("Do you want to post that? y/n ")
             if opt == 'y':
-                if self.board.addPost(buf, subject):
-                    print(c.GREEN, "Post succesful!", c.BLACK)
-                else:
-                    print(c.RED, "Posting failed!", c.BLACK)
+                return self.post(subject + "\n" + buf, buf, subject)
             else:
                 print("Post scrapped.")
         else:
             opt = input("Do you want to post that? y/n ")
             if opt == 'y':
-                if self.board.addPost(buf, thread_id=thread_id):
-                    print(c.GREEN, "Post succesful!", c.BLACK)
-                else:
-                    print(c.RED, "Posting failed!", c.BLACK)
+                return self.post(buf, buf, thread_id=thread_id, sage=sage)
             else:
                 print("Post scrapped.")
+
+    def post(self, checked, *args, **kwargs):
+        """Post with Board.addPost(*args, **kwargs) if flood control lets it.
+
+        checked is the text flood control looks at. What mayPost() took
+        is given back unless the post was made, whatever went wrong.
+        """
+        if not self.mayPost(checked):
+            return False
+        posted = False
+        try:
+            posted = self.board.addPost(*args, **kwargs)
+        except Refused as e:
+            return self.refuse(*e.args)
+        finally:
+            if not posted:
+                self.flood.undo(self.board.name, checked)
+        if posted:
+            print(c.GREEN, "Post succesful!", c.BLACK)
+        else:
+            print(c.RED, "Posting failed!", c.BLACK)
+        return posted
+
+    def mayPost(self, text):
+        """Check a post with flood control, say why if it can't be made."""
+        refused = self.flood.check(self.board.name, text)
+        if refused is None:
+            return True
+        return self.refuse(*refused)
+
+    def refuse(self, reason, wait):
+        """Say why flood control refused a post, return False."""
+        metrics.reject(reason)
+        if reason == "duplicate":
+            print(c.RED, "The same was posted on /" + self.board.name +
+                  "/ a moment ago, post something else.", c.BLACK)
+        elif reason == "board":
+            print(c.RED, "/" + self.board.name + "/ is getting too many "
+                  "posts, try again in", wait, "seconds.", c.BLACK)
+        else:
+            print(c.RED, "You are posting too fast, try again in", wait,
+                  "seconds.", c.BLACK)
+        return False
@@ -0,0 +1,186 @@
+"""
+Flood control: how fast users may post, and no posting the same twice.
+
+Every user (the address they connect from over SSH, their Unix user
+otherwise) and every board has a token bucket: it holds up to count
+tokens and gains count of them every seconds seconds, as set by
+user_post_limit and board_post_limit. A post takes one token from both
+buckets and is refused if either is empty. A post with the same text
+(ignoring case and whitespace) as another one made on the board in the
+last duplicate_window seconds is refused as well.
+
+Buckets and hashes of recent posts are kept in flood_path, a JSON
+object read and written under a lock by every session:
+
+    {"users": {user: [tokens, time]}, "boards": {name: [tokens, time]},
+     "posts": {hash: time}}
+
+Full buckets and old hashes are dropped, so it stays small. A post that
+passed but then couldn't be stored gives its tokens and hash back.
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import time
+
+import metrics
+
+
+def user():
+    """Return who is posting, as told by sshd or the system."""
+    client = os.environ.get("SSH_CLIENT", "").split()
+    if client:
+        return client[0]
+    return "uid {}".format(os.getuid())
+
+
+def post_hash(name, text):
+    """Return the hash telling posts with the same text on a board apart."""
+    text = " ".join(text.lower().split())
+    return hashlib.sha1((name + "\n" + text).encode()).hexdigest()[:20]
+
+
+def refill(bucket, limit, now):
+    """Return the tokens in bucket [tokens, time] as of now."""
+    count, seconds = limit
+    return min(count, bucket[0] + (now - bucket[1]) * count / seconds)
+
+
+class Refused(Exception):
+    """A post refused by the daemon's flood control, args are what
+    FloodControl.check() returned."""
+
+
+class FloodControl():
+    """Checks posts against the limits set in config."""
+
+    def __init__(self, config):
+        self.config = config
+
+    def enabled(self):
+        """Whether posts are checked here.
+
+        Sessions using the daemon leave it to the daemon, see sshchand.py.
+        """
+        if getattr(self.config.storage, "remote", False):
+            return False
+        return bool(self.config.user_post_limit or
+                    self.config.board_post_limit or
+                    self.config.duplicate_window)
+
+    def check(self, name, text, who=None):
+        """Check a post about to be made on board name.
+
+        Returns None if it may be made, and takes its tokens. Otherwise
+        returns [reason, seconds to wait], reason being "user", "board"
+        or "duplicate".
+        """
+        if not self.enabled():
+            return None
+        if who is None:
+            who = user()
+        refused = self.update(
+            lambda state, now: self.apply(state, name, text, who, now))
+        if refused is not None:
+            logging.info("FloodControl.check: post by %s on /%s/ refused "
+                         "(%s).", who, name, refused[0])
+        return refused
+
+    def undo(self, name, text, who=None):
+        """Give back what check() took for a post that wasn't made.
+
+        E.g. the thread it replied to is gone, the same post may then be
+        tried again right away.
+        """
+        if not self.enabled():
+            return
+        if who is None:
+            who = user()
+        self.update(
+            lambda state, now: self.giveBack(state, name, text, who, now))
+
+    def update(self, change):
+        """Run change(state, now) on the state in flood_path, locked.
+
+        Returns what change returns, or None if the file can't be used.
+        """
+        try:
+            with open(self.config.flood_path, 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.seek(0)
+                try:
+                    state = json.loads(f.read() or "{}")
+                except ValueError:
+                    logging.error("FloodControl.update: %s is damaged, "
+                                  "starting over.", self.config.flood_path)
+                    state = {}
+                result = change(state, time.time())
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+        except OSError as e:
+            # Better to let posts through than to stop everybody.
+            logging.error("FloodControl.update: %s", e)
+            return None
+        return result
+
+    def apply(self, state, name, text, who, now):
+        """check() on state, which is updated in place."""
+        users = state.setdefault("users", {})
+        boards = state.setdefault("boards", {})
+        posts = state.setdefault("posts", {})
+        limits = [(users, who, self.config.user_post_limit, "user"),
+                  (boards, name, self.config.board_post_limit, "board")]
+
+        # Forget what's too old to matter.
+        for buckets, _, limit, _ in limits:
+            for key, bucket in list(buckets.items()):
+                if not limit or refill(bucket, limit, now) >= limit[0]:
+                    del buckets[key]
+        window = self.config.duplicate_window
+        for key, posted in list(posts.items()):
+            if now - posted >= window:
+                del posts[key]
+
+        key = post_hash(name, text)
+        if key in posts:
+            return ["duplicate", int(window - (now - posts[key])) + 1]
+        for buckets, bucket_key, limit, reason in limits:
+            if not limit:
+                continue
+            tokens = refill(buckets.get(bucket_key, [limit[0], now]),
+                            limit, now)
+            if tokens < 1:
+                return [reason,
+                        int((1 - tokens) * limit[1] / limit[0]) + 1]
+        for buckets, bucket_key, limit, _ in limits:
+            if limit:
+                buckets[bucket_key] = [refill(
+                    buckets.get(bucket_key, [limit[0], now]), limit, now)
+                    - 1, now]
+        if window:
+            posts[key] = now
+        return None
+
+    def giveBack(self, state, name, text, who, now):
+        """undo() on state, which is updated in place."""
+        state.setdefault("posts", {}).pop(post_hash(name, text), None)
+        for buckets, key, limit in [
+                (state.setdefault("users", {}), who,
+                 self.config.user_post_limit),
+                (state.setdefault("boards", {}), name,
+                 self.config.board_post_limit)]:
+            if not limit or key not in buckets:
+                continue
+            tokens = refill(buckets[key], limit, now) + 1
+            if tokens >= limit[0]:
+                del buckets[key]
+            else:
+                buckets[key] = [tokens, now]
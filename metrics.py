@@ -0,0 +1,220 @@
+"""
+Per-command timing and I/O metrics, and session profiles.
+
+With the "metrics" setting on, every command a user runs is recorded as
+one JSON line appended to metrics_path:
+
+    {"time": ..., "session": ..., "command": "b", "ms": 12.5,
+     "split": {"parse": 8.1, "render": 2.0, ...},
+     "read": bytes, "written": bytes, "output": bytes}
+
+plus "rejected": reason for posts refused by flood control (see flood.py).
+
+split is the command's time spent in each of these, without the time of
+those nested in it:
+ storage - calls to the storage backend (queries, locks, the daemon)
+ parse   - reading and parsing files
+ write   - writing files
+ render  - rendering posts and laying out screens
+ clear   - clearing the screen
+ output  - writing to the terminal
+ other   - everything else
+read and written count bytes of files, output bytes sent to the user.
+Only the command's name is recorded, never what the user typed after it.
+
+With profile_dir set, every session is also run under cProfile and its
+profile is dumped to profile_dir/<session>.prof when it ends.
+
+Everything here does nothing while metrics are off (see start()).
+summary() (admin "metrics" command) sums up a metrics file.
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import atexit
+import collections
+import contextlib
+import functools
+import json
+import logging
+import os
+import time
+
+# Metrics of this session, None while metrics are off.
+current = None
+# What timing() and command() return while metrics are off.
+_off = contextlib.nullcontext()
+
+
+class Metrics():
+    """Metrics of the command being run in this session."""
+
+    def __init__(self, path):
+        self.path = path
+        self.session = "{}-{}".format(int(time.time()), os.getpid())
+        self.reset()
+
+    def reset(self):
+        # Category -> seconds.
+        self.times = collections.defaultdict(float)
+        # [category, time it was entered or last resumed].
+        self.stack = []
+        self.read = 0
+        self.written = 0
+        self.output = 0
+        self.rejected = None
+
+    @contextlib.contextmanager
+    def timing(self, category):
+        """Count a with block's time to category.
+
+        Time of the category it's nested in is paused meanwhile.
+        """
+        now = time.perf_counter()
+        if self.stack:
+            self.times[self.stack[-1][0]] += now - self.stack[-1][1]
+        self.stack.append([category, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self.times[category] += now - self.stack.pop()[1]
+            if self.stack:
+                self.stack[-1][1] = now
+
+    @contextlib.contextmanager
+    def command(self, name):
+        """Record a command run in a with block."""
+        self.reset()
+        start = time.perf_counter()
+        try:
+            with self.timing("other"):
+                yield
+        finally:
+            record = {
+                "time": int(time.time()), "session": self.session,
+                "command": name,
+                "ms": round((time.perf_counter() - start) * 1000, 3),
+                "split": {category: round(seconds * 1000, 3)
+                          for category, seconds in self.times.items()},
+                "read": self.read, "written": self.written,
+                "output": self.output}
+            if self.rejected is not None:
+                record["rejected"] = self.rejected
+            try:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(record) + "\n")
+            except OSError as e:
+                logging.error("Metrics.command: %s", e)
+
+
+class Timed():
+    """Storage backend wrapper timing every call as "storage"."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        value = getattr(self.backend, name)
+        if not callable(value):
+            return value
+
+        @functools.wraps(value)
+        def call(*args, **kwargs):
+            with timing("storage"):
+                return value(*args, **kwargs)
+        return call
+
+
+def start(config):
+    """Turn metrics (and profiling) on for this session, if configured."""
+    global current
+    if config.metrics:
+        current = Metrics(config.metrics_path)
+        config.storage = Timed(config.storage)
+    if config.profile_dir:
+        import cProfile
+        profiler = cProfile.Profile()
+        os.makedirs(config.profile_dir, exist_ok=True)
+        path = os.path.join(config.profile_dir, "{}-{}.prof".format(
+            int(time.time()), os.getpid()))
+        atexit.register(lambda: profiler.dump_stats(path))
+        profiler.enable()
+
+
+def timing(category):
+    """Count a with block's time to category, see Metrics.timing()."""
+    if current is None:
+        return _off
+    return current.timing(category)
+
+
+def timed(category):
+    """Decorator counting a function's time to category."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if current is None:
+                return function(*args, **kwargs)
+            with current.timing(category):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def command(name):
+    """Record a command run in a with block, see Metrics.command()."""
+    if current is None:
+        return _off
+    return current.command(name)
+
+
+def count(read=0, written=0, output=0):
+    """Add bytes read and written to the current command."""
+    if current is not None:
+        current.read += read
+        current.written += written
+        current.output += output
+
+
+def reject(reason):
+    """Record that the current command's post was refused, and why."""
+    if current is not None:
+        current.rejected = reason
+
+
+def summary(path):
+    """Sum up a metrics file.
+
+    Returns {command: [runs, median ms, 90th percentile ms,
+    {category: mean ms}, mean bytes read, mean bytes output,
+    {reason: posts rejected}]}.
+    """
+    records = collections.defaultdict(list)
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record["command"]].append(record)
+
+    result = {}
+    for name, runs in records.items():
+        times = sorted(record["ms"] for record in runs)
+        split = collections.defaultdict(float)
+        rejected = collections.Counter()
+        for record in runs:
+            for category, ms in record["split"].items():
+                split[category] += ms / len(runs)
+            if "rejected" in record:
+                rejected[record["rejected"]] += 1
+        result[name] = [
+            len(runs), times[len(times) // 2],
+            times[min(len(times) - 1, len(times) * 9 // 10)], dict(split),
+            sum(record["read"] for record in runs) // len(runs),
+            sum(record["output"] for record in runs) // len(runs),
+            dict(rejected)]
+    return result
@@ -0,0 +1,93 @@
+"""
+Full-text search over board posts.
+
+Every board keeps an inverted index, word -> numbers of the posts
+containing it, maintained by the storage backend as posts are made
+(see SearchIndex in storage.py for JSON, the words table for SQLite).
+This module holds what both backends share: splitting text into words
+and ranking posts matching a query.
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import collections
+import heapq
+import math
+import re
+
+WORD = re.compile(r"\w+")
+# Queries with more words than this are ranked post by post, see rank().
+MAX_WORDS = 6
+
+
+def words(text):
+    """Return the distinct words of text, lowercased, in order."""
+    return list(dict.fromkeys(
+        word for word in WORD.findall(text.lower()) if len(word) > 1))
+
+
+def rank(postings, total, limit):
+    """Return [score, post_no] of the limit best matching posts.
+
+    postings maps every query word to the numbers of the posts having
+    it, total is the number of posts on the board. A post scores the
+    inverse document frequency of every query word it has, so posts
+    with all the words come first and rare words weigh more than common
+    ones. Ties go to the newest post.
+    """
+    matches = [(math.log(1 + total / len(posts)), set(posts))
+               for posts in postings.values() if len(posts) > 0]
+    if len(matches) > MAX_WORDS:
+        return rank_posts(matches, limit)
+
+    # Posts having exactly the same words score the same, so instead of
+    # scoring post by post, every combination of the words is scored
+    # and posts are taken from the best combinations with set
+    # operations until there's enough of them.
+    scores = collections.defaultdict(list)
+    for mask in range(1, 1 << len(matches)):
+        score = sum(idf for n, (idf, posts) in enumerate(matches)
+                    if mask & (1 << n))
+        scores[round(score, 9)].append(mask)
+
+    results = []
+    for score in sorted(scores, reverse=True):
+        found = set()
+        for mask in scores[score]:
+            having = [posts for n, (idf, posts) in enumerate(matches)
+                      if mask & (1 << n)]
+            lacking = [posts for n, (idf, posts) in enumerate(matches)
+                       if not mask & (1 << n)]
+            found |= set.intersection(*having).difference(*lacking)
+        results.extend([score, post_no] for post_no in
+                       heapq.nlargest(limit - len(results), found))
+        if len(results) >= limit:
+            break
+    return results
+
+
+def rank_posts(matches, limit):
+    """rank() scoring post by post, for queries with many words."""
+    scores = collections.defaultdict(float)
+    for idf, posts in matches:
+        for post_no in posts:
+            scores[post_no] += idf
+    best = heapq.nlargest(limit, scores.items(),
+                          key=lambda item: (item[1], item[0]))
+    return [[score, post_no] for post_no, score in best]
+
+
+def search_boards(storage, names, query, limit):
+    """Search several boards at once.
+
+    Returns [score, board name, thread_id, subject, post] of the limit
+    best matches over all the boards, best first.
+    """
+    results = []
+    for name in names:
+        results.extend([result[0], name] + result[1:]
+                       for result in storage.search(name, query, limit))
+    results.sort(key=lambda result: (result[0], result[4][0]), reverse=True)
+    return results[:limit]
@@ -12,9 +12,11 @@ import os
 import getpass
 import hashlib
 
-from config import Config
+from config import Config, start_logging
 from boards import Board
 
+start_logging()
+
 root = input("Specify the root directory (e.g. /home/user/sshchan) ")
 boardlist = input(
     "Specify boardlist file path (or leave blank to use default) ")
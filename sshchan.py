@@ -10,17 +10,21 @@ makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
 under GNU GPL v3, see LICENSE for details
 """
 
-import logging
 import sys
 import os
 import hashlib
 import getpass
 # sshchan imports
-import admin
 import config
+import metrics
 from boards import Board
 from chan_mark import Marker
-from display import Display
+from display import Display, Screen
+
+# Names of the commands cmdline() knows, for metrics.
+COMMANDS = ("board", "b", "exit", "help", "h", "list", "ls", "page", "p",
+            "reply", "re", "view", "v", "archive", "ar", "refresh", "r",
+            "follow", "f", "search", "s", "searchall", "sa", "motd", "admin")
 
 
 def authenticate(display, config, password):
@@ -54,24 +58,60 @@ optionally specify a page\n",
 c.GREEN, "page | p [integer]", c.BLACK, " - when in board view, use this to \
 browse pages\n", 
 
-c.GREEN, "reply | re [integer]", c.BLACK, " - reply to a thread specified by \
-integer ID\n\tor make a new thread on specified board \
-(not needed if in board view)\n", 
+c.GREEN, "reply | re [integer] [sage]", c.BLACK, " - reply to a thread \
+specified by integer ID\n\tor make a new thread on specified board \
+(not needed if in board view)\n\tadd sage to reply without bumping \
+the thread\n", 
 
 c.GREEN, "view | v [integer]", c.BLACK, " - show replies to a thread specified\
- by integer ID\n", 
+ by integer ID\n\tadd page [integer] to browse pages, last [integer] to show\
+ the last\n\treplies or post [integer] to jump to a post\n", 
+
+c.GREEN, "refresh | r", c.BLACK, " - refresh current board view (only new \
+posts on\n\tservers with delta refresh)\n", 
+
+c.GREEN, "follow | f [integer]", c.BLACK, " - show new posts on the board \
+(or in thread\n\tspecified by integer ID) as they arrive, Ctrl-C stops\n", 
+
+c.GREEN, "archive | ar [page]", c.BLACK, " - list threads archived from the \
+current board\n", 
 
-c.GREEN, "refresh | r", c.BLACK, " - refresh current board view\n", 
+c.GREEN, "archive | ar view [integer]", c.BLACK, " - show an archived thread, \
+takes the same\n\toptions as view\n", 
+
+c.GREEN, "search | s [words]", c.BLACK, " - find posts with these words on the \
+current board\n", 
+
+c.GREEN, "searchall | sa [words]", c.BLACK, " - find posts on all boards\n", 
 
 c.GREEN, "motd", c.BLACK, " - show MOTD", 
 
 c.YELLOW, "\n\nMarkup help\n", c.BLACK,
 "Wrap your text in following characters to style the post:\n",
 "==reverse video==\t", marker.demarkify("==reverse video==\n"),
-"'''bold text'''\t\t", marker.demarkify("'''bold text'''\n"))
+"'''bold text'''\t\t", marker.demarkify("'''bold text'''\n"),
+"~~strikethrough~~\t", marker.demarkify("~~strikethrough~~\n"),
+">quote\t\t\t", marker.demarkify(">quote\n"),
+">>123 (post No.123)\t", marker.demarkify(">>123\n"))
     display.layout()
 
 
+def view_thread(display, args, archived=False):
+    """Show a thread, args being "ID [page|last|post N]"."""
+    if len(args) == 0 or not args[0].isdigit():
+        return
+    if len(args) > 2 and args[2].isdigit():
+        number = int(args[2])
+        if args[1] == "page":
+            display.displayThread(args[0], page=number, archived=archived)
+        elif args[1] == "last":
+            display.displayThread(args[0], last=number, archived=archived)
+        elif args[1] == "post":
+            display.displayThread(args[0], post_no=number, archived=archived)
+    else:
+        display.displayThread(args[0], archived=archived)
+
+
 def cmdline(cfg, display, board, marker, c):
     """Receives and interprets user commands."""
     if board.name == '':
@@ -85,14 +125,22 @@ def cmdline(cfg, display, board, marker, c):
         print_help()
         return False
 
+    # Whatever else the user typed stays out of the metrics.
+    name = cmd_argv[0] if cmd_argv[0] in COMMANDS else "unknown"
+    with metrics.command(name):
+        return run_command(cfg, display, board, marker, c, cmd_argv)
+
+
+def run_command(cfg, display, board, marker, c, cmd_argv):
+    """Runs a single command split into words, see cmdline()."""
     if cmd_argv[0] in ("board", "b"):
         if len(cmd_argv) > 1:
             if cmd_argv[1] in cfg.getBoardlist().keys():
                 board.name = cmd_argv[1]
                 print("board.name:", board.name)
                 
-                if len(cmd_argv) > 2:
-                    display.displayBoard(int(cmd_argv[2]))
+                if len(cmd_argv) > 2 and cmd_argv[2].isdigit():
+                    display.displayBoard(max(int(cmd_argv[2]), 1))
                 else:
                     display.displayBoard()
             else:
@@ -118,32 +166,59 @@ def cmdline(cfg, display, board, marker, c):
     # Following allows to browse board pages just by typing a number.
     elif cmd_argv[0] in ("page", "p"):
         if board.name != '' and len(cmd_argv) > 1:
-            if cmd_argv[1].isalnum():
-                display.displayBoard(int(cmd_argv[1]))
+            if cmd_argv[1].isdigit():
+                display.displayBoard(max(int(cmd_argv[1]), 1))
 
     elif cmd_argv[0] in ("reply", "re"):
         if board.name != '':
             if len(cmd_argv) > 1:
                 # If thread ID was specified.
-                display.postMenu(int(cmd_argv[1]))
+                sage = len(cmd_argv) > 2 and cmd_argv[2] == "sage"
+                display.postMenu(int(cmd_argv[1]), sage)
             else:
                 # Post new thread.
                 display.postMenu()
 
     elif cmd_argv[0] in ("view", "v"):
-        if board.name != '' and len(cmd_argv) > 1:
-            if cmd_argv[1].isdigit():
-                display.displayThread(cmd_argv[1])
+        if board.name != '':
+            view_thread(display, cmd_argv[1:])
+
+    elif cmd_argv[0] in ("archive", "ar"):
+        if board.name != '':
+            if len(cmd_argv) > 1 and cmd_argv[1] == "view":
+                view_thread(display, cmd_argv[2:], archived=True)
+            elif len(cmd_argv) > 1 and cmd_argv[1].isdigit():
+                display.displayArchive(max(int(cmd_argv[1]), 1))
+            else:
+                display.displayArchive()
 
     elif cmd_argv[0] in ("refresh", "r"):
         if board.name != '':
-            display.displayBoard()
+            display.refresh()
+
+    elif cmd_argv[0] in ("follow", "f"):
+        if board.name != '':
+            if len(cmd_argv) > 1 and cmd_argv[1].isdigit():
+                display.follow(int(cmd_argv[1]))
+            else:
+                display.follow()
+
+    elif cmd_argv[0] in ("search", "s"):
+        if board.name != '' and len(cmd_argv) > 1:
+            display.displaySearch(" ".join(cmd_argv[1:]))
+
+    elif cmd_argv[0] in ("searchall", "sa"):
+        if len(cmd_argv) > 1:
+            display.displaySearch(" ".join(cmd_argv[1:]), everywhere=True)
 
     elif cmd_argv[0] == "motd":
         display.displayMOTD()
 
     elif cmd_argv[0] == "admin":
+        import admin
         passwd = getpass.getpass("Password: ")
+        # getpass() talks to the terminal directly.
+        display.screen.forget()
         if authenticate(display, cfg, passwd):
             admin.cmdline(cfg, display, board, c)
 
@@ -154,6 +229,7 @@ def cmdline(cfg, display, board, marker, c):
 
 
 if __name__ == "__main__":
+    config.start_logging()
     if len(sys.argv) > 1:
         if os.path.exists(sys.argv[1]):
             cfg = config.Config(sys.argv[1])
@@ -162,16 +238,16 @@ if __name__ == "__main__":
             sys.exit(1)
     else:
         cfg = config.Config()
-    marker = Marker()
-    board = Board(config=cfg)
-    display = Display(config=cfg, board=board, marker=marker)
+    metrics.start(cfg)
+    with metrics.command("start"):
+        marker = Marker()
+        board = Board(config=cfg, marker=marker)
+        screen = Screen(cfg)
+        screen.install()
+        display = Display(
+            config=cfg, board=board, marker=marker, screen=screen)
     # terminal colors object
     c = config.Colors()
 
-    logging.basicConfig(
-        filename="log",
-        format="[%(lineno)d]%(asctime)s:%(levelname)s:%(message)s",
-        level=logging.DEBUG)
-    
     while True:
         cmdline(cfg, display, board, marker, c)
\ No newline at end of file
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+sshchan daemon, serves board storage to sshchan sessions over a Unix socket.
+
+Without the daemon, every SSH login starts a fresh sshchan.py that has
+to read all the board files it needs on its own. With it running and
+daemon_socket set in the config, sessions send their storage calls to
+this single process instead, which keeps all boards in memory (see
+RemoteStorage in storage.py for the protocol).
+
+Usage: python3 sshchand.py [/path/to/sshchan.conf]
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import pwd
+import socket
+import struct
+import sys
+import time
+
+import config
+import storage
+from boards import Board
+from chan_mark import Marker
+from flood import FloodControl, Refused
+
+# Public calls that don't take a board name as their first argument.
+BOARDLESS = ("getBoardlist", "getPostnums", "cacheStats")
+
+
+class Daemon():
+    """Runs storage calls from many sessions on one storage backend."""
+
+    def __init__(self, cfg):
+        self.config = cfg
+        # Always the local backend, never ourselves.
+        if isinstance(cfg.storage, storage.RemoteStorage):
+            cfg.storage.sock.close()
+        self.storage = storage.BACKENDS[cfg.storage_type](cfg)
+        cfg.storage = self.storage
+        # Storage backends aren't thread safe, all calls run one at a
+        # time on this thread while the event loop keeps serving.
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        try:
+            self.admin_uid = pwd.getpwnam(cfg.admin).pw_uid
+        except KeyError:
+            self.admin_uid = os.getuid()
+        # Board name -> asyncio.Condition notified on every post.
+        self.new_posts = {}
+        # Posts are checked and rendered here, sessions can't be trusted
+        # to do it.
+        self.flood = FloodControl(cfg)
+        self.board = Board(config=cfg, marker=Marker())
+
+    def preload(self):
+        """Read every board into memory ahead of the first session."""
+        boardlist = self.storage.getBoardlist()
+        if isinstance(self.storage, storage.JsonStorage):
+            self.storage.index_cache.size = \
+                len(boardlist) + self.config.cache_boards
+        for name in boardlist:
+            self.storage.getIndex(name)
+        logging.info("sshchand: loaded %d boards.", len(boardlist))
+
+    def peerCreds(self, writer):
+        """Return (pid, uid, gid) of the process on the other end."""
+        sock = writer.get_extra_info("socket")
+        creds = sock.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        return struct.unpack("3i", creds)
+
+    def peerUser(self, pid):
+        """Return who is posting from session pid, for flood control.
+
+        That's the address the session's SSH client connects from, if
+        the daemon may read the session's environment (it runs as the
+        same user or root), the session itself otherwise.
+        """
+        try:
+            with open("/proc/{}/environ".format(pid), 'rb') as f:
+                environ = dict(variable.partition(b"=")[::2]
+                               for variable in f.read().split(b"\0"))
+        except OSError:
+            environ = {}
+        client = environ.get(b"SSH_CLIENT", b"").split()
+        if client:
+            return client[0].decode()
+        return "session {}".format(pid)
+
+    def execute(self, function, *args):
+        """Run function on the storage thread."""
+        return asyncio.get_running_loop().run_in_executor(
+            self.executor, function, *args)
+
+    def run(self, method, *args):
+        """Run a storage call on the storage thread."""
+        return self.execute(getattr(self.storage, method), *args)
+
+    async def checkBoard(self, name):
+        """Raise ValueError unless name is one of the chan's boards.
+
+        Names come from sessions, a made-up one must not create files
+        (or worse, files outside rootdir) by being posted to.
+        """
+        if not isinstance(name, str) or "/" in name or ".." in name or \
+                name not in await self.run("getBoardlist"):
+            raise ValueError("no such board: {!r}".format(name))
+
+    async def addPost(self, who, name, post_text, subject="", thread_id=-1,
+                      sage=False, *ignored):
+        """Post and wake up sessions following the board.
+
+        Flood control is checked here, and the post's time and rendering
+        are the daemon's own, whatever the session sent along.
+        """
+        checked = subject + "\n" + post_text if thread_id == -1 \
+            else post_text
+        refused = await self.execute(
+            self.flood.check, name, checked, who)
+        if refused is not None:
+            raise Refused(*refused)
+        timestamp = int(time.time())
+        rendered = None
+        if self.config.prerender:
+            rendered = self.board.renderPost(timestamp, post_text)
+        post_no = await self.run("addPost", name, post_text, subject,
+                                 thread_id, sage, timestamp, rendered)
+        if not post_no:
+            await self.execute(self.flood.undo, name, checked, who)
+        if post_no and name in self.new_posts:
+            async with self.new_posts[name]:
+                self.new_posts[name].notify_all()
+        return post_no
+
+    async def waitForPosts(self, name, after, timeout):
+        """Wait for posts newer than after without tying up a thread.
+
+        Posts made through the daemon wake waiters up right away, the
+        board is still checked every poll_interval seconds in case
+        someone posted without going through the daemon. Like
+        storage.poll_posts(), posts are only looked up once the board's
+        generation changes.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        condition = self.new_posts.setdefault(name, asyncio.Condition())
+        generation = None
+        while True:
+            posts = []
+            current = await self.run("getGeneration", name)
+            if current != generation:
+                generation = current
+                posts = await self.run("getPostsSince", name, after)
+            remaining = deadline - loop.time()
+            if posts or remaining <= 0:
+                return posts
+            async with condition:
+                try:
+                    await asyncio.wait_for(condition.wait(), min(
+                        remaining, self.config.poll_interval))
+                except asyncio.TimeoutError:
+                    pass
+
+    async def handle(self, reader, writer):
+        """Serve one session until it disconnects."""
+        pid, uid, _ = self.peerCreds(writer)
+        who = self.peerUser(pid)
+        allowed = storage.RemoteStorage.PUBLIC
+        if uid in (self.admin_uid, os.getuid()):
+            allowed += storage.RemoteStorage.ADMIN
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+                method = request["method"]
+                if method not in allowed:
+                    raise PermissionError(method + " not allowed")
+                args = request["args"]
+                if (method in storage.RemoteStorage.PUBLIC and
+                        method not in BOARDLESS):
+                    await self.checkBoard(args[0] if args else None)
+                if method == "addPost":
+                    call = self.addPost(who, *args)
+                elif method == "waitForPosts":
+                    call = self.waitForPosts(*args)
+                else:
+                    call = self.run(method, *args)
+                reply = {"result": await call}
+            except Refused as e:
+                reply = {"error": repr(e), "refused": list(e.args)}
+            except Exception as e:
+                logging.error("sshchand: %s failed: %r", line, e)
+                reply = {"error": repr(e)}
+            try:
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+            except ConnectionError:
+                break  # Session gave up waiting and went away.
+        writer.close()
+
+    async def serve(self):
+        path = self.config.daemon_socket
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(self.handle, path)
+        # Sessions run as the anonymous SSH user, let them connect.
+        os.chmod(path, 0o666)
+        logging.info("sshchand: listening on %s", path)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    config.start_logging()
+    if len(sys.argv) > 1:
+        cfg = config.Config(sys.argv[1])
+    else:
+        cfg = config.Config()
+    if not cfg.daemon_socket:
+        print("Set daemon_socket in the config file first.")
+        sys.exit(1)
+
+    daemon = Daemon(cfg)
+    daemon.preload()
+    try:
+        asyncio.run(daemon.serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,2042 @@
+"""
+Storage backends used by Board, Config and Display to read and write the
+boardlist, post numbers and board contents.
+
+Two backends are available, selected with the "storage" config option:
+ json   - the original layout, files under rootdir (default), written
+          in the format set by the "index_format" option
+          (see dump_data())
+ sqlite - a single SQLite database in WAL mode
+
+Every SSH session runs its own sshchan process, so the JSON backend
+serializes writes with an exclusive lock on a lock file in rootdir, and
+whole-file writes are done by writing a temporary file and renaming it
+over the original, so that readers never see a half-written file.
+
+Both backends hand threads around in the board index format described
+in Board.addPost().
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import array
+import collections
+import contextlib
+import fcntl
+import itertools
+import json
+import logging
+import mmap
+import os
+import shutil
+import socket
+import tempfile
+import time
+
+import cache
+import flood
+import metrics
+import search
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Values of the "index_format" config option, see dump_data().
+FORMATS = ("pretty", "compact", "msgpack")
+# Version of the header of compact and msgpack files.
+DATA_VERSION = 1
+# Version of board offsets tables and the number of fields of their
+# rows, see dump_index().
+OFFSETS_VERSION = 2
+THREAD_FIELDS = 6
+# Posts added at once when threads are added in bulk, see appendThreads().
+APPEND_BATCH = 10000
+# Minified JSON as the compact format has it, json.dumps() would make a
+# new encoder for every call.
+COMPACT = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+
+# Locks held by this process: path -> [file object, depth].
+# flock() locks belong to an open file, so nested lock() calls on the
+# same path must reuse it instead of opening the file again.
+_held = {}
+
+
+@contextlib.contextmanager
+def lock(path, shared=False):
+    """Hold a lock on path for the duration of a with block.
+
+    Exclusive by default, shared=True allows many readers at once.
+    Nested calls in the same process only count depth, a lock first
+    taken as shared must not be upgraded by an inner exclusive call.
+    """
+    if path in _held:
+        _held[path][1] += 1
+        try:
+            yield
+        finally:
+            _held[path][1] -= 1
+        return
+
+    f = open(path, 'a')
+    try:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        _held[path] = [f, 1]
+        try:
+            yield
+        finally:
+            del _held[path]
+            fcntl.flock(f, fcntl.LOCK_UN)
+    finally:
+        f.close()
+
+
+@contextlib.contextmanager
+def atomic_file(path, mode='wb'):
+    """Write a file in a with block, then put it at path crash-safely.
+
+    For files written a piece at a time, path is left as it was if the
+    block raises.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+@metrics.timed("write")
+def atomic_write(path, data):
+    """Replace the file at path with data (str or bytes) crash-safely."""
+    with atomic_file(path, 'wb' if isinstance(data, bytes) else 'w') as f:
+        f.write(data)
+    metrics.count(written=len(data))
+    return True
+
+
+def dump_data(path, values, data_format):
+    """Atomically write values to path in one of FORMATS.
+
+    pretty is plain indented JSON, as older versions wrote it. The other
+    formats start with a "sshchan-data <version> <format>" header line,
+    followed by minified JSON for compact or by msgpack. Compact lists
+    have every item on a line of its own, so that a single item (e.g.
+    a thread of a board index) can be read without parsing the rest,
+    see dump_index().
+    """
+    if data_format == "pretty":
+        return atomic_write(path, json.dumps(values, indent=4))
+    if data_format == "msgpack" and msgpack is None:
+        logging.warning("dump_data: msgpack not installed, using compact.")
+        data_format = "compact"
+    header = "sshchan-data {} {}\n".format(
+        DATA_VERSION, data_format).encode()
+    if data_format == "msgpack":
+        body = msgpack.packb(values)
+    elif isinstance(values, list):
+        body = "[\n{}\n]".format(",\n".join(
+            json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+            for value in values)).encode()
+    else:
+        body = json.dumps(values, separators=(',', ':'),
+                          ensure_ascii=False).encode()
+    return atomic_write(path, header + body)
+
+
+def thread_line(thread):
+    """Return a thread as a compact list has it on its line, as bytes.
+
+    Also returns where each of the thread's posts starts in the line.
+    """
+    head = COMPACT.encode(thread[:2]).encode()
+    parts = [head[:-1]]
+    starts = []
+    position = len(head)
+    for post in thread[2:]:
+        part = COMPACT.encode(post).encode()
+        starts.append(position)
+        parts.append(part)
+        position += len(part) + 1
+    return b",".join(parts) + b"]", starts
+
+
+def dump_index(path, index, data_format):
+    """Write a board index like dump_data(), return its offsets table.
+
+    The table tells where every thread and post of a compact index
+    file is, so a thread, or a few of its posts, can be read without
+    parsing anything else (see ThreadView). It's an array of 64 bit
+    integers: a header row, a row per thread sorted by thread ID, and
+    a pair per post, the posts of a thread following each other.
+
+        [-1, OFFSETS_VERSION, number of threads, 0, 0, 0]
+        [thread_id, offset, length, first post, posts, last post number]
+        ...
+        [offset, post number]
+        ...
+
+    Offsets are those in the index file, "first post" is the number of
+    pairs before the thread's own. Other formats have no table, None is
+    returned for them.
+    """
+    if data_format == "msgpack" and msgpack is None:
+        logging.warning("dump_index: msgpack not installed, using compact.")
+        data_format = "compact"
+    if data_format != "compact":
+        dump_data(path, index, data_format)
+        return None
+    header = "sshchan-data {} compact\n[\n".format(DATA_VERSION).encode()
+    lines = []
+    rows = []
+    posts = array.array('q')
+    offset = len(header)
+    for thread in index:
+        line, starts = thread_line(thread)
+        rows.append((thread[0], offset, len(line), len(posts) // 2,
+                     len(starts), thread[-1][1]))
+        for start, post in zip(starts, thread[2:]):
+            posts.extend((offset + start, post[1]))
+        lines.append(line)
+        offset += len(line) + 2
+    atomic_write(path, header + b",\n".join(lines) + b"\n]")
+    table = array.array('q', (-1, OFFSETS_VERSION, len(rows), 0, 0, 0))
+    for row in sorted(rows):
+        table.extend(row)
+    table.extend(posts)
+    return table
+
+
+def dump_offsets(path, table):
+    """Write an offsets table made by dump_index(), None leaves it empty."""
+    return atomic_write(path, b"" if table is None else table.tobytes())
+
+
+def batches(threads, size):
+    """Split an iterable of threads into lists of about size posts."""
+    batch = []
+    posts = 0
+    for thread in threads:
+        batch.append(thread)
+        posts += len(thread) - 2
+        if posts >= size:
+            yield batch
+            batch = []
+            posts = 0
+    if batch:
+        yield batch
+
+
+def find_thread(table, thread_id):
+    """Return the row of thread_id in an offsets table, or None.
+
+    table is the file as a memoryview of 64 bit integers, the thread is
+    found by binary search without reading the rest.
+    """
+    low, high = 1, table[2] + 1
+    while low < high:
+        middle = (low + high) // 2
+        if table[middle * THREAD_FIELDS] < thread_id:
+            low = middle + 1
+        else:
+            high = middle
+    if low <= table[2] and table[low * THREAD_FIELDS] == thread_id:
+        return table[low * THREAD_FIELDS:(low + 1) * THREAD_FIELDS].tolist()
+    return None
+
+
+@metrics.timed("parse")
+def load_data(path):
+    """Read a file written by dump_data(), in any of the formats."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    metrics.count(read=len(data))
+    if not data.startswith(b"sshchan-data "):
+        return json.loads(data)
+    header, _, body = data.partition(b"\n")
+    version, data_format = header.decode().split()[1:]
+    assert int(version) <= DATA_VERSION, logging.critical(
+        "load_data: %s is from a newer sshchan (version %s).", path, version)
+    if data_format == "msgpack":
+        return msgpack.unpackb(body)
+    return json.loads(body)
+
+
+def data_format(path):
+    """Return the format of a file written by dump_data()."""
+    with open(path, 'rb') as f:
+        header = f.readline()
+    if not header.startswith(b"sshchan-data "):
+        return "pretty"
+    return header.decode().split()[2]
+
+
+@metrics.timed("write")
+def append_line(path, line):
+    """Append a single line to path and make sure it hits the disk."""
+    with open(path, 'a') as f:
+        f.write(line + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    metrics.count(written=len(line) + 1)
+    return True
+
+
+def poll_posts(backend, name, after, timeout):
+    """Wait until posts newer than after show up on a board.
+
+    Used by the local backends: the board's generation is checked every
+    poll_interval seconds, which only costs a stat() or a tiny query,
+    and the posts are only looked up once it changes. Returns the new
+    posts (see getPostsSince()) or [] after timeout seconds.
+    """
+    deadline = time.time() + timeout
+    generation = None
+    while True:
+        current = backend.getGeneration(name)
+        if current != generation:
+            generation = current
+            posts = backend.getPostsSince(name, after)
+            if posts:
+                return posts
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return []
+        time.sleep(min(backend.config.poll_interval, remaining))
+
+
+class LineFile():
+    """Append-only file of one record per line, mirrored in memory.
+
+    Other processes only ever append to the file (or atomically replace
+    it), so refresh() just reads the lines added since the last look
+    instead of parsing the whole file again. Subclasses implement
+    reset() and parse(line).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Inode of the file and how far into it we have read.
+        self.ino = None
+        self.offset = 0
+        self.reset()
+
+    def reset(self):
+        """Forget everything read so far."""
+        pass
+
+    def parse(self, line):
+        """Apply a single line (without the newline)."""
+        pass
+
+    def refresh(self):
+        """Catch up with lines appended by other processes.
+
+        Returns False if the file doesn't exist (yet).
+        """
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return False
+        with f:
+            st = os.fstat(f.fileno())
+            if st.st_ino != self.ino or st.st_size < self.offset:
+                # Replaced by rewrite() or truncated, start over.
+                self.reset()
+                self.ino = st.st_ino
+                self.offset = 0
+            # Offsets are in bytes, so the file is read as such.
+            f.seek(self.offset)
+            start = self.offset
+            with metrics.timing("parse"):
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # Torn write, the rest is ignored.
+                    self.parse(line[:-1].decode())
+                    self.offset += len(line)
+            metrics.count(read=self.offset - start)
+        return True
+
+    def append(self, line):
+        append_line(self.path, line)
+        return self.refresh()
+
+    def rewrite(self, lines):
+        """Atomically replace the whole file."""
+        atomic_write(self.path, "".join(line + "\n" for line in lines))
+        return self.refresh()
+
+
+class ThreadMap(LineFile):
+    """Persistent thread ID -> index position lookup table of a board.
+
+    The file holds one "thread_id position" line per thread and is only
+    appended to when a thread is created. It's rewritten as a whole
+    only when the board's index is.
+    """
+
+    def reset(self):
+        self.positions = {}
+
+    def parse(self, line):
+        thread_id, position = line.split()
+        self.positions[int(thread_id)] = int(position)
+
+    def get(self, thread_id):
+        """Return the index position of thread_id or None."""
+        return self.positions.get(thread_id)
+
+    def add(self, thread_id):
+        """Record a new thread at the end of the index."""
+        position = len(self.positions)
+        self.append("{} {}".format(thread_id, position))
+        return position
+
+    def extend(self, thread_ids):
+        """Record new threads at the end of the index, see add()."""
+        position = len(self.positions)
+        lines = ["{} {}".format(thread_id, position + n)
+                 for n, thread_id in enumerate(thread_ids)]
+        if lines:
+            self.append("\n".join(lines))
+        return position
+
+    def rebuild(self, index):
+        """Rewrite the whole table from a board index."""
+        return self.rewrite(
+            "{} {}".format(thread[0], position)
+            for position, thread in enumerate(index))
+
+
+class BumpOrder(LineFile):
+    """Order in which a board's threads were last bumped.
+
+    Every new thread and every reply that isn't saged appends the
+    thread's ID to the file, the latest line for a thread wins. Kept in
+    memory as an OrderedDict, so a bump is O(1) and the threads of a
+    page can be read off its end without sorting anything.
+    """
+
+    def reset(self):
+        self.order = collections.OrderedDict()
+
+    def parse(self, line):
+        thread_id = int(line)
+        self.order[thread_id] = None
+        self.order.move_to_end(thread_id)
+
+    def bump(self, thread_id):
+        return self.append(str(thread_id))
+
+    def bumpAll(self, thread_ids):
+        """Bump many threads at once, the last one ends up on top."""
+        lines = [str(thread_id) for thread_id in thread_ids]
+        if lines:
+            self.append("\n".join(lines))
+        return True
+
+    def page(self, start, count):
+        """Return IDs of count threads, most recently bumped first."""
+        return list(itertools.islice(
+            reversed(self.order), start, start + count))
+
+    def rebuild(self, index):
+        """Rewrite the file with one line per thread of index.
+
+        Threads keep their current order, threads we don't know about
+        are ordered by their newest post.
+        """
+        thread_ids = set(thread[0] for thread in index)
+        known = [thread_id for thread_id in self.order
+                 if thread_id in thread_ids]
+        new = sorted((thread for thread in index
+                      if thread[0] not in self.order),
+                     key=lambda thread: thread[-1][1])
+        return self.rewrite(
+            [str(thread_id) for thread_id in known] +
+            [str(thread[0]) for thread in new])
+
+
+class SearchIndex(LineFile):
+    """Inverted index of a board's posts, see search.py.
+
+    The file holds one "post_no thread_id word word ..." line per post,
+    the OP's words include the thread's subject. It is appended to with
+    every post and rewritten as a whole when the board's index is. It's
+    only parsed when the board is searched.
+    """
+
+    def reset(self):
+        # Word -> numbers of posts having it.
+        self.postings = {}
+        # Post number -> thread ID.
+        self.threads = {}
+
+    def parse(self, line):
+        fields = line.split(" ")
+        post_no = int(fields[0])
+        self.threads[post_no] = int(fields[1])
+        for word in fields[2:]:
+            posts = self.postings.get(word)
+            if posts is None:
+                posts = self.postings[word] = array.array('q')
+            posts.append(post_no)
+
+    def line(self, post_no, thread_id, text):
+        return " ".join([str(post_no), str(thread_id)] + search.words(text))
+
+    def add(self, post_no, thread_id, text):
+        """Record a new post."""
+        if not os.path.exists(self.path):
+            return False  # Built from the whole board on first search.
+        line = self.line(post_no, thread_id, text)
+        if self.ino is None:
+            # Not parsed by this process, no need to do it now.
+            return append_line(self.path, line)
+        return self.append(line)
+
+    def lines(self, index):
+        """Return the lines of the posts of a board index."""
+        return [self.line(post[1], thread[0],
+                          thread[1] + "\n" + post[2] if post[1] == thread[0]
+                          else post[2])
+                for thread in index for post in thread[2:]]
+
+    def extend(self, index):
+        """Record the posts of threads added to the board, see add()."""
+        if not os.path.exists(self.path):
+            return False  # Built from the whole board on first search.
+        lines = self.lines(index)
+        if not lines:
+            return True
+        append_line(self.path, "\n".join(lines))
+        # Parsed again on the next search, if there's one.
+        self.ino = None
+        self.reset()
+        return True
+
+    def rebuild(self, index):
+        """Rewrite the whole index from a board index."""
+        return self.rewrite(self.lines(index))
+
+    def find(self, query, limit):
+        """Return [score, post_no] of the posts best matching query."""
+        postings = {word: self.postings.get(word, ())
+                    for word in search.words(query)}
+        return search.rank(postings, len(self.threads), limit)
+
+
+class BoardLog(LineFile):
+    """Posts of a board's log, grouped by thread.
+
+    Lets single threads be read without replaying the log over the
+    whole index. The log is emptied (not replaced) when the index is
+    rewritten, so it is read from the start again whenever the index
+    file changes, see refresh().
+    """
+
+    def reset(self):
+        # Thread ID -> thread, for threads created since the snapshot.
+        self.threads = {}
+        # Thread ID -> replies to threads of the snapshot.
+        self.replies = collections.defaultdict(list)
+        # Number of the last post in the log.
+        self.last = 0
+        # [thread_id, post] of every post, in the order they were made.
+        self.posts = []
+
+    def parse(self, line):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            logging.warning("BoardLog.parse: bad record in %s", self.path)
+            return
+        kind, timestamp, post_no, target, text = record[:5]
+        post = [timestamp, post_no, text] + record[5:]
+        self.last = max(self.last, post_no)
+        self.posts.append([post_no if kind == "t" else target, post])
+        if kind == "t":
+            self.threads.setdefault(post_no, [post_no, target, post])
+        elif target in self.threads:
+            self.threads[target].append(post)
+        else:
+            self.replies[target].append(post)
+
+    def __init__(self, path):
+        # file_key() of the index file the log was read along with.
+        self.index_key = None
+        super().__init__(path)
+
+    def refresh(self, index_key=None):
+        """Catch up with the log of the index file with index_key."""
+        if index_key != self.index_key:
+            self.index_key = index_key
+            self.ino = None
+        return super().refresh()
+
+
+class IndexState():
+    """A board's index snapshot as parsed, plus the log replayed so far."""
+
+    def __init__(self, index):
+        self.index = index
+        # Thread ID -> thread, for replaying replies.
+        self.threads = {thread[0]: thread for thread in index}
+        # How far into the log we have replayed.
+        self.log_offset = 0
+
+
+class ThreadView():
+    """A single thread of a board, only read as far as it's looked at.
+
+    Threads of a compact index are read from a memory map of the index
+    file: the subject and any run of posts are found through the
+    board's offsets table (see dump_index()) and only they are parsed.
+    Posts made since the index was written follow from the log. Threads
+    that are parsed already, e.g. those of a cached index, are used as
+    they are, with no map.
+    """
+
+    def __init__(self, thread_id, posts, subject=None, table=None,
+                 index_map=None, row=None):
+        self.thread_id = thread_id
+        self._subject = subject
+        self.table = table
+        self.index_map = index_map
+        # The thread's row of the offsets table, None without a map.
+        self.row = row
+        # Number of posts read from the map, then the rest.
+        self.mapped = 0
+        self.posts = posts
+        if row is not None:
+            self.mapped = row[4]
+            # In case a crash left posts of the index in the log.
+            self.posts = [post for post in posts if post[1] > row[5]]
+
+    def __len__(self):
+        """Return the number of posts, OP included."""
+        return self.mapped + len(self.posts)
+
+    def parse(self, start, end, prefix, suffix):
+        """Parse bytes start to end of the index file."""
+        data = self.index_map[start:end]
+        metrics.count(read=len(data))
+        with metrics.timing("parse"):
+            return json.loads(prefix + data + suffix)
+
+    def postOffset(self, position):
+        """Return where the position-th mapped post starts in the file."""
+        base = (self.table[2] + 1) * THREAD_FIELDS
+        return self.table[base + 2 * (self.row[3] + position)]
+
+    def mappedEnd(self, position):
+        """Return where the post before the position-th one ends."""
+        if position < self.mapped:
+            return self.postOffset(position) - 1
+        return self.row[1] + self.row[2] - 1  # Leaves out the "]".
+
+    @property
+    def subject(self):
+        if self._subject is None:
+            self._subject = self.parse(
+                self.row[1], self.mappedEnd(0), b"", b"]")[1]
+        return self._subject
+
+    def getPosts(self, start, count):
+        """Return count posts from the start-th one (OP is 0)."""
+        start = max(start, 0)
+        stop = min(start + count, len(self))
+        posts = []
+        if start < min(stop, self.mapped):
+            end = min(stop, self.mapped)
+            posts = self.parse(self.postOffset(start), self.mappedEnd(end),
+                               b"[", b"]")
+        return posts + self.posts[max(start - self.mapped, 0):
+                                  max(stop - self.mapped, 0)]
+
+    def postNumber(self, position):
+        """Return the number of the position-th post."""
+        if position < self.mapped:
+            base = (self.table[2] + 1) * THREAD_FIELDS
+            return self.table[base + 2 * (self.row[3] + position) + 1]
+        return self.posts[position - self.mapped][1]
+
+    def position(self, post_no):
+        """Return the position of the first post numbered post_no or up.
+
+        Posts are in order of their numbers, mapped ones are looked up
+        in the offsets table without parsing any.
+        """
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self.postNumber(middle) < post_no:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def findPost(self, post_no):
+        """Return the position of post_no in the thread, or None."""
+        position = self.position(post_no)
+        if position < len(self) and self.postNumber(position) == post_no:
+            return position
+        return None
+
+    def getPostsSince(self, after):
+        """Return the posts numbered higher than after."""
+        position = self.position(after + 1)
+        return self.getPosts(position, len(self) - position)
+
+    def thread(self):
+        """Return the whole thread in the board index format."""
+        return [self.thread_id, self.subject] + self.getPosts(0, len(self))
+
+
+class JsonStorage():
+    """Boards kept as JSON files under rootdir.
+
+    rootdir/boardlist is a JSON dictionary, every board has a directory
+    rootdir/boards/<name> with its own lock file, the number of its
+    last post (see getPostnum()), an index snapshot,
+    a log of posts made since the snapshot was taken, a thread map (see
+    ThreadMap) to find threads in the index without searching, the
+    bump order of its threads (see BumpOrder), a search index (see
+    SearchIndex) and the offsets of threads and posts in the index file
+    (see dump_index()).
+    """
+
+    def __init__(self, config):
+        self.config = config
+        # (board name, file name) -> LineFile.
+        self.board_files = {}
+        # Parsed boardlist and postnums.
+        self.file_cache = cache.FileCache(2)
+        # Parsed board indexes (IndexState), one per board.
+        self.index_cache = cache.FileCache(config.cache_boards)
+        # Memory maps of compact board indexes, for reading single
+        # threads (see getThread()).
+        self.index_maps = cache.FileCache(config.cache_boards)
+
+    def boardPath(self, name):
+        return os.path.join(self.config.root, "boards", name)
+
+    def indexPath(self, name):
+        return os.path.join(self.boardPath(name), "index")
+
+    def logPath(self, name):
+        return os.path.join(self.boardPath(name), "log")
+
+    def offsetsPath(self, name):
+        return os.path.join(self.boardPath(name), "offsets")
+
+    def postnumPath(self, name):
+        return os.path.join(self.boardPath(name), "postnum")
+
+    def boardLock(self, name, shared=False):
+        """Lock the board's files, see lock().
+
+        Every board has a lock of its own, so posting to one board
+        doesn't hold up any other. When both are needed, the rootdir
+        lock is taken first.
+        """
+        return lock(os.path.join(self.boardPath(name), "lock"), shared)
+
+    def boardLog(self, name):
+        """Return the board's up to date BoardLog."""
+        board_log = self.boardFile(name, BoardLog, "log")
+        try:
+            index_key = cache.file_key(self.indexPath(name))
+        except FileNotFoundError:
+            index_key = None  # Board being created.
+        board_log.refresh(index_key)
+        return board_log
+
+    def boardFile(self, name, cls, filename):
+        """Return the LineFile object for one of the board's files."""
+        if (name, filename) not in self.board_files:
+            self.board_files[name, filename] = cls(
+                os.path.join(self.boardPath(name), filename))
+        return self.board_files[name, filename]
+
+    def forgetBoard(self, name):
+        """Drop in-memory state of a deleted or renamed board."""
+        for key in list(self.board_files):
+            if key[0] == name:
+                del self.board_files[key]
+        self.index_cache.forget(self.indexPath(name))
+        self.index_maps.forget(self.indexPath(name))
+        self.index_maps.forget(self.offsetsPath(name))
+
+    def cacheStats(self):
+        """Return hit/miss counters of the parsed file caches."""
+        return {"files": self.file_cache.stats(),
+                "indexes": self.index_cache.stats(),
+                "index maps": self.index_maps.stats()}
+
+    def loadData(self, path):
+        return load_data(path)
+
+    def threadMap(self, name):
+        """Return the board's up to date ThreadMap."""
+        thread_map = self.boardFile(name, ThreadMap, "threads")
+        if not thread_map.refresh():
+            # Board from before thread maps existed.
+            with self.boardLock(name):
+                thread_map.rebuild(self.getIndex(name))
+        return thread_map
+
+    def bumpOrder(self, name):
+        """Return the board's up to date BumpOrder."""
+        bump_order = self.boardFile(name, BumpOrder, "bumps")
+        if not bump_order.refresh():
+            # Board from before bump ordering existed.
+            with self.boardLock(name):
+                bump_order.rebuild(self.getIndex(name))
+        return bump_order
+
+    def searchIndex(self, name):
+        """Return the board's up to date SearchIndex."""
+        search_index = self.boardFile(name, SearchIndex, "search")
+        if not search_index.refresh():
+            with self.boardLock(name):
+                search_index.rebuild(self.getIndex(name))
+        return search_index
+
+    def migrate(self):
+        """Rewrite the boardlist, postnums and indexes in index_format.
+
+        Returns [path, old size, new size] of every file rewritten,
+        files already in the right format are left alone.
+        """
+        paths = [self.config.boardlist_path]
+        if os.path.exists(self.config.postnums_path):
+            paths.append(self.config.postnums_path)
+        names = {self.indexPath(name): name for name in self.getBoardlist()}
+        paths.extend(names)
+        migrated = []
+        with lock(self.config.lock_path):
+            for path in paths:
+                if path in names:
+                    with self.boardLock(names[path]):
+                        self.migrateFile(path, migrated, names[path])
+                else:
+                    self.migrateFile(path, migrated)
+        return migrated
+
+    def migrateFile(self, path, migrated, name=None):
+        """Rewrite a single file for migrate(), name is that of its board."""
+        if data_format(path) == self.config.index_format and (
+                name is None or self.config.index_format != "compact" or
+                self.offsetTable(name) is not None):
+            return
+        size = os.path.getsize(path)
+        values = load_data(path)
+        if name is None:
+            dump_data(path, values, self.config.index_format)
+        else:
+            # Offsets of the threads changed.
+            dump_offsets(self.offsetsPath(name), dump_index(
+                path, values, self.config.index_format))
+        migrated.append([path, size, os.path.getsize(path)])
+        logging.info("JsonStorage.migrate: migrated %s.", path)
+
+    def getBoardlist(self):
+        """Return the boardlist as a Python dictionary."""
+        return dict(self.file_cache.get(
+            self.config.boardlist_path, self.loadData))
+
+    def setBoardlist(self, values):
+        with lock(self.config.lock_path):
+            dump_data(self.config.boardlist_path, values,
+                      self.config.index_format)
+        return True
+
+    def getPostnums(self):
+        """Return {board name: number of its last post}."""
+        return {name: self.getPostnum(name) for name in self.getBoardlist()}
+
+    def setPostnums(self, values):
+        for name, post_no in values.items():
+            with self.boardLock(name):
+                self.savePostnum(name, post_no)
+        return True
+
+    def getPostnum(self, name):
+        """Return the number of the board's last post.
+
+        The postnum file is only written when the index is (see
+        setIndex()), posts made since only go to the log, so the post
+        number is the higher of the two. A number is thus taken exactly
+        when its post hits the log, there are no gaps and no number is
+        handed out twice even if a process dies halfway through
+        posting, and posting costs no extra write.
+        """
+        with self.boardLock(name, shared=True):
+            return max(self.savedPostnum(name), self.boardLog(name).last)
+
+    def savedPostnum(self, name):
+        """Return the number in the postnum file, see getPostnum()."""
+        try:
+            with open(self.postnumPath(name), 'r') as f:
+                return int(f.read())
+        except FileNotFoundError:
+            return self.legacyPostnum(name)
+
+    def legacyPostnum(self, name):
+        """Return the board's number from the old, global postnums file."""
+        try:
+            return dict(self.file_cache.get(
+                self.config.postnums_path, self.loadData)).get(name, 0)
+        except FileNotFoundError:
+            return 0
+
+    def savePostnum(self, name, post_no):
+        return atomic_write(self.postnumPath(name), "{}\n".format(post_no))
+
+    def createBoard(self, name, desc):
+        """Add the board to boardlist and create its files."""
+        with lock(self.config.lock_path):
+            boardlist = self.getBoardlist()
+            if name in boardlist:
+                return False
+            boardlist[name] = desc
+            self.setBoardlist(boardlist)
+            try:
+                os.makedirs(self.boardPath(name))
+            except OSError as e:
+                logging.error("JsonStorage.createBoard(): %s", e)
+            self.savePostnum(name, 0)
+            self.setIndex(name, [])
+        return True
+
+    def deleteBoard(self, name):
+        with lock(self.config.lock_path), self.boardLock(name):
+            shutil.rmtree(self.boardPath(name))
+            self.forgetBoard(name)
+            boardlist = self.getBoardlist()
+            del boardlist[name]
+            self.setBoardlist(boardlist)
+        return True
+
+    def renameBoard(self, name, new_name, desc):
+        with lock(self.config.lock_path):
+            boardlist = self.getBoardlist()
+            if name not in boardlist:
+                return False
+            with self.boardLock(name):
+                # The number goes along with the board's files.
+                self.savePostnum(name, self.getPostnum(name))
+                try:
+                    shutil.move(self.boardPath(name), self.boardPath(new_name))
+                except OSError as e:
+                    logging.error("JsonStorage.renameBoard(): %s", e)
+                    return False
+            self.forgetBoard(name)
+            del boardlist[name]
+            boardlist[new_name] = desc
+            self.setBoardlist(boardlist)
+        return True
+
+    def getIndex(self, name):
+        """Returns a list containing the board's index.
+
+        The index file is only a snapshot, posts made since the last
+        compaction live in the log and are replayed on top of it.
+        Parsed indexes are cached and only the part of the log written
+        since the last call is replayed, so the returned list is shared
+        and must not be modified.
+        """
+        path = self.indexPath(name)
+        with self.boardLock(name, shared=True):
+            state = self.index_cache.get(path, self.loadIndex)
+            if not self.replayLog(name, state):
+                # Log is shorter than what we replayed, start over.
+                self.index_cache.forget(path)
+                state = self.index_cache.get(path, self.loadIndex)
+                self.replayLog(name, state)
+        return state.index
+
+    def loadIndex(self, path):
+        return IndexState(self.loadData(path))
+
+    def mapFile(self, path):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""  # Can't be mapped.
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def mapOffsets(self, path):
+        return memoryview(self.mapFile(path)).cast('q')
+
+    def getGeneration(self, name):
+        """Return a string that changes whenever the board changes.
+
+        Every post grows the log and every index rewrite replaces the
+        index file, so their inode, size and mtime are enough.
+        """
+        index_key = cache.file_key(self.indexPath(name))
+        try:
+            log_size = os.stat(self.logPath(name)).st_size
+        except FileNotFoundError:
+            log_size = 0
+        return "{}.{}.{}.{}".format(*index_key, log_size)
+
+    def setIndex(self, name, values, reindex=True):
+        """Update the board's index with new values.
+
+        The whole board is written out, so the log is emptied as well.
+        reindex=False leaves the search index alone, for when the posts
+        stay the same.
+        """
+        with self.boardLock(name):
+            # Posts in the log are about to leave it, their numbers are
+            # saved first, see getPostnum().
+            self.savePostnum(name, self.getPostnum(name))
+            table = dump_index(
+                self.indexPath(name), values, self.config.index_format)
+            open(self.logPath(name), 'w').close()
+            dump_offsets(self.offsetsPath(name), table)
+            self.boardFile(name, ThreadMap, "threads").rebuild(values)
+            bump_order = self.boardFile(name, BumpOrder, "bumps")
+            bump_order.refresh()
+            bump_order.rebuild(values)
+            if reindex:
+                self.boardFile(name, SearchIndex, "search").rebuild(values)
+        return True
+
+    def appendLog(self, name, record):
+        """Append a single post record to the board's log.
+
+        Log is a file with one JSON list per line, either
+        ["t", timestamp, post_no, subject, text] for a new thread or
+        ["r", timestamp, post_no, thread_id, text] for a reply,
+        followed by the rendered post if there is one.
+        """
+        return append_line(self.logPath(name), json.dumps(record))
+
+    @metrics.timed("parse")
+    def replayLog(self, name, state):
+        """Apply new log records on top of an IndexState (in place).
+
+        Replaying is idempotent: records already present in the index
+        are skipped, so a crash between writing the snapshot and
+        truncating the log doesn't duplicate posts. Returns False if
+        the log was truncated behind our back.
+        """
+        try:
+            l = open(self.logPath(name), 'rb')
+        except FileNotFoundError:
+            return True
+        with l:
+            if os.fstat(l.fileno()).st_size < state.log_offset:
+                return False
+            l.seek(state.log_offset)
+            metrics.count(read=os.fstat(l.fileno()).st_size - state.log_offset)
+            for line in l:
+                if not line.endswith(b"\n"):
+                    break  # Torn write, the rest is ignored.
+                state.log_offset += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logging.warning(
+                        "JsonStorage.replayLog: bad record in /%s/ log", name)
+                    continue
+                kind, timestamp, post_no, target, text = record[:5]
+                post = [timestamp, post_no, text] + record[5:]
+                if kind == "t":
+                    if post_no not in state.threads:
+                        thread = [post_no, target, post]
+                        state.index.append(thread)
+                        state.threads[post_no] = thread
+                elif kind == "r":
+                    thread = state.threads.get(target)
+                    if thread is not None and thread[-1][1] < post_no:
+                        thread.append(post)
+        return True
+
+    def compact(self, name):
+        """Fold the log into the index file."""
+        with self.boardLock(name):
+            self.setIndex(name, self.getIndex(name), reindex=False)
+        logging.info("JsonStorage.compact: compacted /%s/.", name)
+        return True
+
+    def addPost(self, name, post_text, subject="", thread_id=-1, sage=False,
+                timestamp=None, rendered=None):
+        """Store a new thread or a reply, return its post number.
+
+        Replies bump the thread to the top of the board unless sage is
+        True. Returns False if the thread to reply to doesn't exist.
+        timestamp defaults to now, rendered is [version, date, styled
+        text] as made by Board.renderPost().
+        """
+        if timestamp is None:
+            timestamp = int(time.time())
+        with self.boardLock(name):
+            post_no = self.getPostnum(name) + 1
+
+            thread_map = self.threadMap(name)
+            if thread_id == -1:
+                record = ["t", timestamp, post_no, subject, post_text]
+            else:
+                if thread_map.get(thread_id) is None:
+                    return False
+                record = ["r", timestamp, post_no, thread_id, post_text]
+            if rendered is not None:
+                record.extend(rendered)
+
+            # Appending the record takes the number, see getPostnum().
+            self.appendLog(name, record)
+            search_index = self.boardFile(name, SearchIndex, "search")
+            if thread_id == -1:
+                thread_map.add(post_no)
+                self.bumpOrder(name).bump(post_no)
+                search_index.add(post_no, post_no, subject + "\n" + post_text)
+            else:
+                if not sage:
+                    self.bumpOrder(name).bump(thread_id)
+                search_index.add(post_no, thread_id, post_text)
+
+            if os.path.getsize(self.logPath(name)) > self.config.log_compact:
+                self.compact(name)
+        return post_no
+
+    def setRendered(self, name, posts):
+        """Replace the rendered form of posts.
+
+        posts is a list of [post_no, version, date, styled text].
+        """
+        rendered = {post[0]: post[1:] for post in posts}
+        with self.boardLock(name):
+            # The cached index is shared, so a new one is built.
+            index = [thread[:2] + [
+                post[:3] + rendered[post[1]] if post[1] in rendered else post
+                for post in thread[2:]] for thread in self.getIndex(name)]
+            self.setIndex(name, index, reindex=False)
+        return True
+
+    def removeThreads(self, name, threads):
+        """Take threads off the board, return IDs of the removed ones.
+
+        threads is a list of [thread_id, number of its last post], a
+        thread that got a post since is left alone.
+        """
+        last_posts = dict(threads)
+        with self.boardLock(name):
+            index = self.getIndex(name)
+            removed = set(thread[0] for thread in index
+                          if last_posts.get(thread[0]) == thread[-1][1])
+            if removed:
+                self.setIndex(name, [thread for thread in index
+                                     if thread[0] not in removed])
+        return sorted(removed)
+
+    def appendThreads(self, name, threads, postnum):
+        """Add threads after the board's own.
+
+        threads are in the board index format, in thread ID order and
+        numbered after the board's last post. They can be any iterable,
+        it's only read once. postnum is the board's new number of its
+        last post (see getPostnum()). Returns False, leaving the board
+        alone, if a post made meanwhile took one of their numbers.
+
+        A compact index is extended in place (see appendIndex()), so
+        neither the board nor the new threads are held in memory. Other
+        formats have the whole board parsed and written again.
+        """
+        threads = iter(threads)
+        with self.boardLock(name):
+            first = next(threads, None)
+            if first is not None and first[0] <= self.getPostnum(name):
+                return False
+            # Saved first, so a crash can't let the numbers be reused.
+            self.savePostnum(name, max(postnum, self.getPostnum(name)))
+            if first is None:
+                return True
+            threads = itertools.chain([first], threads)
+            if self.config.index_format == "compact":
+                if (self.offsetTable(name) is None or
+                        os.path.getsize(self.logPath(name))):
+                    # New threads go right after the board's.
+                    self.compact(name)
+                self.appendIndex(name, threads)
+                return True
+            threads = list(threads)
+            # Posts already on the board keep their search index.
+            self.setIndex(name, self.getIndex(name) + threads, reindex=False)
+            self.boardFile(name, SearchIndex, "search").extend(threads)
+        return True
+
+    def appendIndex(self, name, threads):
+        """Write threads after the board's own, see appendThreads().
+
+        The board's compact index file is copied as it is, a chunk at a
+        time, and the new threads are written after it a batch at a
+        time, as are their rows and posts of the offsets table. The
+        board must have an up to date table and an empty log.
+        """
+        index_path = self.indexPath(name)
+        table = self.offsetTable(name)
+        index_map = self.index_maps.get(index_path, self.mapFile)
+        assert index_map[-2:] == b"\n]", logging.critical(
+            "JsonStorage.appendIndex: /%s/ index is not compact.", name)
+        count = table[2]
+        base = (count + 1) * THREAD_FIELDS
+        posts = (len(table) - base) // 2
+        thread_map = self.threadMap(name)
+        bump_order = self.bumpOrder(name)
+        search_index = self.boardFile(name, SearchIndex, "search")
+        last = table[count * THREAD_FIELDS] if count else 0
+        with tempfile.TemporaryFile() as rows, \
+                tempfile.TemporaryFile() as pairs:
+            with atomic_file(index_path) as f:
+                # All but the closing "\n]".
+                offset = len(index_map) - 2
+                for start in range(0, offset, mmap.PAGESIZE * 256):
+                    f.write(index_map[start:min(start + mmap.PAGESIZE * 256,
+                                                offset)])
+                separator = b",\n" if count else b""
+                for batch in batches(threads, APPEND_BATCH):
+                    new_rows = array.array('q')
+                    new_pairs = array.array('q')
+                    for thread in batch:
+                        assert thread[0] > last, logging.critical(
+                            "JsonStorage.appendIndex: /%s/ thread %d is out "
+                            "of order.", name, thread[0])
+                        last = thread[0]
+                        line, starts = thread_line(thread)
+                        f.write(separator + line)
+                        offset += len(separator)
+                        new_rows.extend((thread[0], offset, len(line), posts,
+                                         len(starts), thread[-1][1]))
+                        for start, post in zip(starts, thread[2:]):
+                            new_pairs.extend((offset + start, post[1]))
+                        posts += len(starts)
+                        offset += len(line)
+                        separator = b",\n"
+                    count += len(batch)
+                    rows.write(new_rows.tobytes())
+                    pairs.write(new_pairs.tobytes())
+                    thread_map.extend(thread[0] for thread in batch)
+                    bump_order.bumpAll(thread[0] for thread in sorted(
+                        batch, key=lambda thread: thread[-1][1]))
+                    search_index.extend(batch)
+                f.write(b"\n]")
+                metrics.count(written=offset + 2)
+            with atomic_file(self.offsetsPath(name)) as f:
+                f.write(array.array('q', (-1, OFFSETS_VERSION, count,
+                                          0, 0, 0)).tobytes())
+                f.write(table[THREAD_FIELDS:base])
+                rows.seek(0)
+                shutil.copyfileobj(rows, f)
+                f.write(table[base:])
+                pairs.seek(0)
+                shutil.copyfileobj(pairs, f)
+        return True
+
+    def iterThreads(self, name):
+        """Yield the board's threads one at a time, in thread ID order.
+
+        Threads of a compact index are read one by one through its
+        offsets table, from the files as they were at the first thread,
+        so the board is never in memory as a whole. Other formats go
+        through the whole index.
+        """
+        with self.boardLock(name, shared=True):
+            board_log = self.boardLog(name)
+            logged, replies = board_log.threads, board_log.replies
+            table = self.offsetTable(name)
+            if table is not None:
+                index_map = self.index_maps.get(
+                    self.indexPath(name), self.mapFile)
+                for n in range(1, table[2] + 1):
+                    offset = table[n * THREAD_FIELDS + 1]
+                    head = "[{},".format(table[n * THREAD_FIELDS]).encode()
+                    if index_map[offset:offset + len(head)] != head:
+                        logging.warning("JsonStorage.iterThreads: /%s/ "
+                                        "offsets are out of date", name)
+                        table = None
+                        break
+            if table is None:
+                index = self.getIndex(name)
+        if table is None:
+            yield from sorted(index)
+            return
+        for n in range(1, table[2] + 1):
+            row = table[n * THREAD_FIELDS:(n + 1) * THREAD_FIELDS].tolist()
+            posts = logged.get(row[0], [])[2:] + replies.get(row[0], [])
+            yield ThreadView(row[0], posts, table=table, index_map=index_map,
+                             row=row).thread()
+        for thread_id in sorted(logged):
+            if find_thread(table, thread_id) is None:
+                yield logged[thread_id]
+
+    def offsetTable(self, name):
+        """Return the board's offsets table (see dump_index()), or None.
+
+        Indexes in other formats have none, nor do boards whose table is
+        from before posts had offsets of their own (until the next
+        compaction or migrate).
+        """
+        try:
+            table = self.index_maps.get(
+                self.offsetsPath(name), self.mapOffsets)
+        except FileNotFoundError:
+            return None
+        if (len(table) < THREAD_FIELDS or table[0] != -1 or
+                table[1] != OFFSETS_VERSION):
+            return None
+        return table
+
+    def threadView(self, name, thread_id):
+        """Return a ThreadView of a thread, None if there's no such thread.
+
+        Boards whose index is cached are read from the cache. Otherwise
+        threads of a compact index are read straight from a memory map
+        of the index file, through a memory map of the board's offsets
+        table, and their replies since the snapshot are taken from the
+        log, so this costs as much as what's read of the thread, not the
+        whole board. Mapped pages are shared with every other sshchan
+        process. Threads of other formats are looked up in the whole
+        index.
+        """
+        if not self.index_cache.has(self.indexPath(name)):
+            with self.boardLock(name, shared=True):
+                board_log = self.boardLog(name)
+                table = self.offsetTable(name)
+                row = None
+                if table is not None:
+                    row = find_thread(table, thread_id)
+                if row is not None:
+                    index_map = self.index_maps.get(
+                        self.indexPath(name), self.mapFile)
+                    head = "[{},".format(thread_id).encode()
+                    if index_map[row[1]:row[1] + len(head)] == head:
+                        # Replies since the snapshot, and in case a
+                        # crash left the log behind, the thread once more.
+                        logged = (board_log.threads.get(thread_id, [])[2:] +
+                                  board_log.replies.get(thread_id, []))
+                        return ThreadView(thread_id, logged, table=table,
+                                          index_map=index_map, row=row)
+                    logging.warning("JsonStorage.threadView: /%s/ offsets "
+                                    "are out of date", name)
+                elif thread_id in board_log.threads:
+                    thread = board_log.threads[thread_id]
+                    return ThreadView(thread_id, thread[2:], thread[1])
+            if self.threadMap(name).get(thread_id) is None:
+                return None
+
+        thread = self.findThread(name, self.getIndex(name), thread_id)
+        if thread is None:
+            return None
+        return ThreadView(thread_id, thread[2:], thread[1])
+
+    def getThread(self, name, thread_id):
+        """Return a single thread or None if there is no such thread.
+
+        See threadView() for how it's read.
+        """
+        view = self.threadView(name, thread_id)
+        if view is None:
+            return None
+        return view.thread()
+
+    def findThread(self, name, index, thread_id):
+        """Look thread_id up in index through the thread map."""
+        position = self.threadMap(name).get(thread_id)
+        if position is None:
+            return None
+        if position < len(index) and index[position][0] == thread_id:
+            return index[position]
+
+        # The map is out of sync with the index, fix it up.
+        logging.warning("JsonStorage.findThread: rebuilding /%s/ threads", name)
+        with self.boardLock(name):
+            self.threadMap(name).rebuild(index)
+        for thread in index:
+            if thread[0] == thread_id:
+                return thread
+        return None
+
+    def getThreadInfo(self, name, thread_id):
+        """Return [thread_id, subject, number of posts] or None."""
+        view = self.threadView(name, thread_id)
+        if view is None:
+            return None
+        return [thread_id, view.subject, len(view)]
+
+    def getPosts(self, name, thread_id, start, count):
+        """Return count posts of a thread, from the start-th one.
+
+        The OP is post 0. Returns an empty list if there's no thread.
+        Only those posts are parsed, see threadView().
+        """
+        view = self.threadView(name, thread_id)
+        if view is None:
+            return []
+        return view.getPosts(start, count)
+
+    def findPost(self, name, thread_id, post_no):
+        """Return the position of post_no in a thread, or None."""
+        view = self.threadView(name, thread_id)
+        if view is None:
+            return None
+        return view.findPost(post_no)
+
+    def search(self, name, query, limit):
+        """Return the limit posts best matching query, best first.
+
+        Every post is returned as [score, thread_id, subject, post].
+        """
+        results = []
+        search_index = self.searchIndex(name)
+        for score, post_no in search_index.find(query, limit):
+            thread_id = search_index.threads[post_no]
+            view = self.threadView(name, thread_id)
+            position = None if view is None else view.findPost(post_no)
+            if position is not None:
+                results.append([score, thread_id, view.subject,
+                                view.getPosts(position, 1)[0]])
+        return results
+
+    def getPostsSince(self, name, after):
+        """Return posts numbered higher than after, oldest first.
+
+        Every post is returned as [thread_id, subject, post]. Only the
+        threads having such posts are read: those with posts in the log
+        are found from its end, those of the index through the offsets
+        table, which is only needed if posts newer than after have been
+        folded into the index since. Boards without an offsets table are
+        looked through thread by thread.
+        """
+        with self.boardLock(name, shared=True):
+            table = self.offsetTable(name)
+            if table is None:
+                return self.scanPostsSince(name, after)
+            thread_ids = set()
+            for thread_id, post in reversed(self.boardLog(name).posts):
+                if post[1] <= after:
+                    break
+                thread_ids.add(thread_id)
+            if after < self.savedPostnum(name):
+                end = (table[2] + 1) * THREAD_FIELDS
+                thread_ids.update(thread_id for thread_id, last in zip(
+                    table[THREAD_FIELDS:end:THREAD_FIELDS].tolist(),
+                    table[THREAD_FIELDS + 5:end:THREAD_FIELDS].tolist())
+                    if last > after)
+            posts = []
+            for thread_id in thread_ids:
+                view = self.threadView(name, thread_id)
+                if view is not None:
+                    posts.extend([thread_id, view.subject, post]
+                                 for post in view.getPostsSince(after))
+        posts.sort(key=lambda post: post[2][1])
+        return posts
+
+    def scanPostsSince(self, name, after):
+        """getPostsSince() going through the whole index."""
+        posts = []
+        for thread in self.getIndex(name):
+            # Posts in a thread are in order, walk back from the newest.
+            for post in reversed(thread[2:]):
+                if post[1] <= after:
+                    break
+                posts.append([thread[0], thread[1], post])
+        posts.sort(key=lambda post: post[2][1])
+        return posts
+
+    def waitForPosts(self, name, after, timeout):
+        """Wait up to timeout seconds for posts newer than after."""
+        return poll_posts(self, name, after, timeout)
+
+    def getPreviews(self, name, start, count):
+        """Return previews of count threads in bump order.
+
+        A preview is [thread_id, subject, OP post, number of replies],
+        start counts from the most recently bumped thread.
+        """
+        if start < 0:
+            raise ValueError("getPreviews: negative start {}".format(start))
+        thread_ids = self.bumpOrder(name).page(start, count)
+        if len(thread_ids) == 0:
+            return []
+        previews = []
+        for thread_id in thread_ids:
+            # Only the subject and OP are read.
+            view = self.threadView(name, thread_id)
+            if view is not None:
+                previews.append([thread_id, view.subject,
+                                 view.getPosts(0, 1)[0], len(view) - 1])
+        return previews
+
+
+def make_post(timestamp, post_no, text, version=None, date=None,
+              styled=None):
+    """Return a post in the index format from its database row."""
+    if version is None:
+        return [timestamp, post_no, text]
+    return [timestamp, post_no, text, version, date, styled]
+
+
+class SqliteStorage():
+    """Boards kept in a single SQLite database.
+
+    The database runs in WAL mode, so any number of sessions can read
+    while one of them is posting. Posts are indexed on (board, post_no)
+    and (board, thread_id), threads on (board, bumped) where bumped is
+    the number of the last post that bumped the thread, which keeps
+    thread lookups, pages and posting fast no matter how big a board
+    gets. The words table is the boards' inverted index for search, see
+    search.py.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS boards (
+            name TEXT PRIMARY KEY,
+            desc TEXT NOT NULL,
+            postnum INTEGER NOT NULL DEFAULT 0,
+            generation INTEGER NOT NULL DEFAULT 0);
+        CREATE TABLE IF NOT EXISTS threads (
+            board TEXT NOT NULL,
+            thread_id INTEGER NOT NULL,
+            subject TEXT NOT NULL,
+            bumped INTEGER NOT NULL DEFAULT 0,
+            replies INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (board, thread_id));
+        CREATE TABLE IF NOT EXISTS posts (
+            board TEXT NOT NULL,
+            post_no INTEGER NOT NULL,
+            thread_id INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            version INTEGER,
+            date TEXT,
+            styled TEXT,
+            PRIMARY KEY (board, post_no));
+        CREATE TABLE IF NOT EXISTS words (
+            board TEXT NOT NULL,
+            word TEXT NOT NULL,
+            post_no INTEGER NOT NULL,
+            PRIMARY KEY (board, word, post_no)) WITHOUT ROWID;
+        """
+
+    INDEXES = """
+        CREATE INDEX IF NOT EXISTS posts_thread
+            ON posts (board, thread_id, post_no);
+        CREATE INDEX IF NOT EXISTS threads_bumped
+            ON threads (board, bumped, thread_id);
+        """
+
+    def __init__(self, config):
+        self.config = config
+        self._db = None
+
+    @property
+    def db(self):
+        """Database connection, opened on first use."""
+        if self._db is None:
+            # Imported here, sessions using other backends don't need it.
+            import sqlite3
+            # The daemon opens the database on one thread and uses it on
+            # another, but never from two threads at once.
+            self._db = sqlite3.connect(
+                self.config.database_path, timeout=30, isolation_level=None,
+                check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(SqliteStorage.SCHEMA)
+            self.upgrade()
+            self._db.executescript(SqliteStorage.INDEXES)
+        return self._db
+
+    def upgrade(self):
+        """Add columns missing in databases made by older versions."""
+        columns = [row[1] for row in
+                   self._db.execute("PRAGMA table_info(threads)")]
+        if "bumped" not in columns:
+            self._db.executescript("""
+                BEGIN;
+                ALTER TABLE threads ADD COLUMN bumped INTEGER NOT NULL
+                    DEFAULT 0;
+                ALTER TABLE threads ADD COLUMN replies INTEGER NOT NULL
+                    DEFAULT 0;
+                UPDATE threads SET
+                    bumped = (SELECT MAX(post_no) FROM posts WHERE
+                        posts.board = threads.board AND
+                        posts.thread_id = threads.thread_id),
+                    replies = (SELECT COUNT(*) - 1 FROM posts WHERE
+                        posts.board = threads.board AND
+                        posts.thread_id = threads.thread_id);
+                COMMIT;
+                """)
+            logging.info("SqliteStorage.upgrade: added bump order.")
+        columns = [row[1] for row in
+                   self._db.execute("PRAGMA table_info(boards)")]
+        if "generation" not in columns:
+            self._db.execute(
+                "ALTER TABLE boards ADD COLUMN generation INTEGER NOT NULL "
+                "DEFAULT 0")
+            logging.info("SqliteStorage.upgrade: added board generations.")
+        columns = [row[1] for row in
+                   self._db.execute("PRAGMA table_info(posts)")]
+        if "styled" not in columns:
+            self._db.executescript("""
+                BEGIN;
+                ALTER TABLE posts ADD COLUMN version INTEGER;
+                ALTER TABLE posts ADD COLUMN date TEXT;
+                ALTER TABLE posts ADD COLUMN styled TEXT;
+                COMMIT;
+                """)
+            logging.info("SqliteStorage.upgrade: added rendered posts.")
+        if (self._db.execute("SELECT 1 FROM words LIMIT 1").fetchone() is None
+                and self._db.execute(
+                    "SELECT 1 FROM posts LIMIT 1").fetchone() is not None):
+            with self.transaction() as db:
+                for name, in db.execute("SELECT name FROM boards").fetchall():
+                    self.indexWords(name, self.getIndex(name))
+            logging.info("SqliteStorage.upgrade: added search index.")
+
+    def indexWords(self, name, threads):
+        """Add the posts of threads to the search index."""
+        self._db.executemany(
+            "INSERT OR IGNORE INTO words (board, word, post_no) "
+            "VALUES (?, ?, ?)",
+            [(name, word, post[1]) for thread in threads
+             for post in thread[2:] for word in search.words(
+                 thread[1] + "\n" + post[2] if post[1] == thread[0]
+                 else post[2])])
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run a with block as one write transaction."""
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.db
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def getBoardlist(self):
+        return dict(self.db.execute(
+            "SELECT name, desc FROM boards ORDER BY rowid"))
+
+    def setBoardlist(self, values):
+        with self.transaction() as db:
+            for name in set(self.getBoardlist()) - set(values):
+                db.execute("DELETE FROM boards WHERE name = ?", (name,))
+            for name, desc in values.items():
+                db.execute(
+                    "INSERT INTO boards (name, desc) VALUES (?, ?) "
+                    "ON CONFLICT (name) DO UPDATE SET desc = excluded.desc",
+                    (name, desc))
+        return True
+
+    def getPostnums(self):
+        return dict(self.db.execute(
+            "SELECT name, postnum FROM boards ORDER BY rowid"))
+
+    def getPostnum(self, name):
+        """Return the number of the board's last post.
+
+        Posts are numbered by their board's row, in the transaction
+        that stores them, so numbers have no gaps.
+        """
+        row = self.db.execute(
+            "SELECT postnum FROM boards WHERE name = ?", (name,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def setPostnums(self, values):
+        with self.transaction() as db:
+            db.executemany(
+                "UPDATE boards SET postnum = ? WHERE name = ?",
+                [(num, name) for name, num in values.items()])
+        return True
+
+    def createBoard(self, name, desc):
+        with self.transaction() as db:
+            cur = db.execute(
+                "INSERT OR IGNORE INTO boards (name, desc) VALUES (?, ?)",
+                (name, desc))
+        return cur.rowcount == 1
+
+    def deleteBoard(self, name):
+        with self.transaction() as db:
+            for table in ("posts", "threads", "words"):
+                db.execute(
+                    "DELETE FROM {} WHERE board = ?".format(table), (name,))
+            db.execute("DELETE FROM boards WHERE name = ?", (name,))
+        return True
+
+    def renameBoard(self, name, new_name, desc):
+        with self.transaction() as db:
+            cur = db.execute(
+                "UPDATE boards SET name = ?, desc = ? WHERE name = ?",
+                (new_name, desc, name))
+            if cur.rowcount == 0:
+                return False
+            for table in ("posts", "threads", "words"):
+                db.execute(
+                    "UPDATE {} SET board = ? WHERE board = ?".format(table),
+                    (new_name, name))
+        return True
+
+    def getIndex(self, name):
+        index = []
+        threads = {}
+        for thread_id, subject in self.db.execute(
+                "SELECT thread_id, subject FROM threads WHERE board = ? "
+                "ORDER BY thread_id", (name,)):
+            threads[thread_id] = [thread_id, subject]
+            index.append(threads[thread_id])
+        for row in self.db.execute(
+                "SELECT thread_id, timestamp, post_no, text, version, date, "
+                "styled FROM posts WHERE board = ? ORDER BY post_no",
+                (name,)):
+            threads[row[0]].append(make_post(*row[1:]))
+        return index
+
+    def iterThreads(self, name):
+        """Yield the board's threads one at a time, in thread ID order.
+
+        Posts are read through a single cursor as the threads are
+        wanted, so the board is never in memory as a whole.
+        """
+        rows = self.db.execute(
+            "SELECT t.thread_id, t.subject, p.timestamp, p.post_no, p.text, "
+            "p.version, p.date, p.styled FROM threads t JOIN posts p "
+            "ON p.board = t.board AND p.thread_id = t.thread_id "
+            "WHERE t.board = ? ORDER BY p.thread_id, p.post_no", (name,))
+        for head, posts in itertools.groupby(rows, lambda row: row[:2]):
+            yield list(head) + [make_post(*row[2:]) for row in posts]
+
+    def setIndex(self, name, values):
+        with self.transaction() as db:
+            for table in ("posts", "threads", "words"):
+                db.execute(
+                    "DELETE FROM {} WHERE board = ?".format(table), (name,))
+            self.insertThreads(name, values)
+            db.execute(
+                "UPDATE boards SET generation = generation + 1 "
+                "WHERE name = ?", (name,))
+        return True
+
+    def insertThreads(self, name, threads):
+        """Insert threads in the board index format, and their words."""
+        self._db.executemany(
+            "INSERT INTO threads (board, thread_id, subject, bumped, replies) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(name, thread[0], thread[1], thread[-1][1], len(thread) - 3)
+             for thread in threads])
+        self._db.executemany(
+            "INSERT INTO posts (board, post_no, thread_id, "
+            "timestamp, text, version, date, styled) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [[name, post[1], thread[0], post[0], post[2]] +
+             (post[3:] or [None] * 3)
+             for thread in threads for post in thread[2:]])
+        self.indexWords(name, threads)
+
+    def appendThreads(self, name, threads, postnum):
+        threads = iter(threads)
+        try:
+            with self.transaction() as db:
+                first = next(threads, None)
+                if first is not None and first[0] <= self.getPostnum(name):
+                    return False
+                if first is not None:
+                    for batch in batches(itertools.chain([first], threads),
+                                         APPEND_BATCH):
+                        self.insertThreads(name, batch)
+                db.execute(
+                    "UPDATE boards SET postnum = MAX(postnum, ?), "
+                    "generation = generation + 1 WHERE name = ?",
+                    (postnum, name))
+        except self.db.IntegrityError as e:
+            # E.g. the same post number twice, nothing was written.
+            raise ValueError("appendThreads: /{}/: {}".format(name, e))
+        return True
+
+    def compact(self, name):
+        return True
+
+    def migrate(self):
+        # Nothing is kept in files.
+        return []
+
+    def cacheStats(self):
+        # SQLite has its own page cache, nothing is parsed here.
+        return {}
+
+    def getGeneration(self, name):
+        return str(self.db.execute(
+            "SELECT generation FROM boards WHERE name = ?",
+            (name,)).fetchone()[0])
+
+    def addPost(self, name, post_text, subject="", thread_id=-1, sage=False,
+                timestamp=None, rendered=None):
+        if timestamp is None:
+            timestamp = int(time.time())
+        if rendered is None:
+            rendered = [None] * 3
+        with self.transaction() as db:
+            post_no = db.execute(
+                "SELECT postnum FROM boards WHERE name = ?",
+                (name,)).fetchone()[0] + 1
+            if thread_id == -1:
+                thread_id = post_no
+                db.execute(
+                    "INSERT INTO threads (board, thread_id, subject, bumped) "
+                    "VALUES (?, ?, ?, ?)", (name, thread_id, subject, post_no))
+            elif db.execute(
+                    "UPDATE threads SET replies = replies + 1, "
+                    "bumped = CASE WHEN ? THEN bumped ELSE ? END "
+                    "WHERE board = ? AND thread_id = ?",
+                    (sage, post_no, name, thread_id)).rowcount == 0:
+                return False
+            db.execute(
+                "INSERT INTO posts (board, post_no, thread_id, timestamp, "
+                "text, version, date, styled) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [name, post_no, thread_id, timestamp, post_text] + rendered)
+            if thread_id == post_no:
+                post_text = subject + "\n" + post_text
+            db.executemany(
+                "INSERT OR IGNORE INTO words (board, word, post_no) "
+                "VALUES (?, ?, ?)",
+                [(name, word, post_no) for word in search.words(post_text)])
+            db.execute(
+                "UPDATE boards SET postnum = ?, generation = generation + 1 "
+                "WHERE name = ?", (post_no, name))
+        return post_no
+
+    def setRendered(self, name, posts):
+        with self.transaction() as db:
+            db.executemany(
+                "UPDATE posts SET version = ?, date = ?, styled = ? "
+                "WHERE board = ? AND post_no = ?",
+                [post[1:] + [name, post[0]] for post in posts])
+            db.execute(
+                "UPDATE boards SET generation = generation + 1 "
+                "WHERE name = ?", (name,))
+        return True
+
+    def removeThreads(self, name, threads):
+        removed = []
+        with self.transaction() as db:
+            for thread_id, last_post in threads:
+                row = db.execute(
+                    "SELECT MAX(post_no) FROM posts WHERE board = ? AND "
+                    "thread_id = ?", (name, thread_id)).fetchone()
+                if row[0] == last_post:
+                    removed.append(thread_id)
+            db.execute("CREATE TEMP TABLE IF NOT EXISTS removed "
+                       "(post_no INTEGER PRIMARY KEY)")
+            db.execute("DELETE FROM removed")
+            for thread_id in removed:
+                db.execute(
+                    "INSERT INTO removed SELECT post_no FROM posts "
+                    "WHERE board = ? AND thread_id = ?", (name, thread_id))
+                for table in ("posts", "threads"):
+                    db.execute(
+                        "DELETE FROM {} WHERE board = ? AND thread_id = ?"
+                        .format(table), (name, thread_id))
+            # One pass over the board's words for all removed posts.
+            db.execute(
+                "DELETE FROM words WHERE board = ? AND post_no IN "
+                "(SELECT post_no FROM removed)", (name,))
+            db.execute(
+                "UPDATE boards SET generation = generation + 1 "
+                "WHERE name = ?", (name,))
+        return removed
+
+    def getThread(self, name, thread_id):
+        row = self.db.execute(
+            "SELECT subject FROM threads WHERE board = ? AND thread_id = ?",
+            (name, thread_id)).fetchone()
+        if row is None:
+            return None
+        thread = [thread_id, row[0]]
+        thread.extend([make_post(*post) for post in self.db.execute(
+            "SELECT timestamp, post_no, text, version, date, styled "
+            "FROM posts WHERE board = ? AND thread_id = ? ORDER BY post_no",
+            (name, thread_id))])
+        return thread
+
+    def getThreadInfo(self, name, thread_id):
+        row = self.db.execute(
+            "SELECT thread_id, subject, replies + 1 FROM threads "
+            "WHERE board = ? AND thread_id = ?",
+            (name, thread_id)).fetchone()
+        return None if row is None else list(row)
+
+    def getPosts(self, name, thread_id, start, count):
+        return [make_post(*post) for post in self.db.execute(
+            "SELECT timestamp, post_no, text, version, date, styled "
+            "FROM posts WHERE board = ? AND thread_id = ? ORDER BY post_no "
+            "LIMIT ? OFFSET ?", (name, thread_id, count, start))]
+
+    def findPost(self, name, thread_id, post_no):
+        row = self.db.execute(
+            "SELECT 1 FROM posts WHERE board = ? AND post_no = ? AND "
+            "thread_id = ?", (name, post_no, thread_id)).fetchone()
+        if row is None:
+            return None
+        return self.db.execute(
+            "SELECT COUNT(*) FROM posts WHERE board = ? AND thread_id = ? "
+            "AND post_no < ?", (name, thread_id, post_no)).fetchone()[0]
+
+    def search(self, name, query, limit):
+        postings = {word: [row[0] for row in self.db.execute(
+                        "SELECT post_no FROM words WHERE board = ? AND "
+                        "word = ?", (name, word))]
+                    for word in search.words(query)}
+        total = self.db.execute(
+            "SELECT COUNT(*) FROM posts WHERE board = ?",
+            (name,)).fetchone()[0]
+        results = []
+        for score, post_no in search.rank(postings, total, limit):
+            row = self.db.execute(
+                "SELECT posts.thread_id, subject, timestamp, post_no, text, "
+                "version, date, styled FROM posts JOIN threads ON "
+                "threads.board = posts.board AND "
+                "threads.thread_id = posts.thread_id "
+                "WHERE posts.board = ? AND post_no = ?",
+                (name, post_no)).fetchone()
+            results.append([score, row[0], row[1], make_post(*row[2:])])
+        return results
+
+    def getPostsSince(self, name, after):
+        return [[row[0], row[1], make_post(*row[2:])] for row in
+                self.db.execute(
+                    "SELECT posts.thread_id, subject, timestamp, post_no, "
+                    "text, version, date, styled FROM posts JOIN threads ON "
+                    "threads.board = posts.board AND "
+                    "threads.thread_id = posts.thread_id "
+                    "WHERE posts.board = ? AND post_no > ? ORDER BY post_no",
+                    (name, after))]
+
+    def waitForPosts(self, name, after, timeout):
+        return poll_posts(self, name, after, timeout)
+
+    def getPreviews(self, name, start, count):
+        if start < 0:
+            raise ValueError("getPreviews: negative start {}".format(start))
+        # Pages are picked from the covering threads_bumped index alone,
+        # only the threads actually shown get joined with their OP post.
+        return [[row[0], row[1], make_post(*row[3:]), row[2]] for row in
+                self.db.execute(
+                    "SELECT threads.thread_id, subject, replies, "
+                    "timestamp, post_no, text, version, date, styled "
+                    "FROM (SELECT thread_id FROM threads "
+                    "WHERE board = ? ORDER BY bumped DESC LIMIT ? OFFSET ?) "
+                    "AS page JOIN threads ON threads.board = ? AND "
+                    "threads.thread_id = page.thread_id JOIN posts ON "
+                    "posts.board = ? AND posts.post_no = page.thread_id "
+                    "ORDER BY bumped DESC",
+                    (name, count, start, name, name))]
+
+
+class RemoteStorage():
+    """Storage served by the sshchan daemon (sshchand.py).
+
+    Every call is sent over the daemon's Unix socket as one line of
+    JSON, {"method": name, "args": [...]}, and answered with one line,
+    {"result": value} or {"error": message}. The daemon runs the call
+    on the storage backend set in its own config. A post refused by the
+    daemon's flood control also gets "refused": [reason, seconds to
+    wait], raised here as flood.Refused.
+    """
+
+    # Calls any session may make.
+    PUBLIC = ("getBoardlist", "getPostnums", "getPostnum", "getIndex",
+              "getThread",
+              "getThreadInfo", "getPosts", "findPost", "getPreviews",
+              "getGeneration", "getPostsSince", "waitForPosts", "addPost",
+              "search", "cacheStats")
+    # Calls reserved for the admin user.
+    ADMIN = ("setBoardlist", "setPostnums", "createBoard", "deleteBoard",
+             "renameBoard", "setIndex", "compact", "setRendered",
+             "removeThreads", "appendThreads", "migrate")
+
+    # Posts are checked by the daemon's flood control, see flood.py.
+    remote = True
+
+    def __init__(self, config, sock):
+        self.config = config
+        self.sock = sock
+        self.reader = sock.makefile('rb')
+
+    def reconnect(self):
+        """Start over with a new connection to the daemon."""
+        self.reader.close()
+        self.sock.close()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.config.daemon_socket)
+        self.reader = self.sock.makefile('rb')
+
+    def call(self, method, *args):
+        """Run method on the daemon and return its result."""
+        request = json.dumps({"method": method, "args": args})
+        try:
+            self.sock.sendall(request.encode() + b"\n")
+            reply = json.loads(self.reader.readline())
+        except BaseException:
+            # E.g. Ctrl-C while waiting in waitForPosts(): the reply
+            # would still arrive later and be taken for the next one.
+            self.reconnect()
+            raise
+        if "refused" in reply:
+            raise flood.Refused(*reply["refused"])
+        if "error" in reply:
+            raise RuntimeError("sshchand: " + reply["error"])
+        return reply["result"]
+
+    def iterThreads(self, name):
+        # The whole index is sent at once, there's no streaming.
+        return iter(self.call("getIndex", name))
+
+    def appendThreads(self, name, threads, postnum):
+        return self.call("appendThreads", name, list(threads), postnum)
+
+    def __getattr__(self, method):
+        if method not in RemoteStorage.PUBLIC + RemoteStorage.ADMIN:
+            raise AttributeError(method)
+        return lambda *args: self.call(method, *args)
+
+
+# Values of the "storage" config option.
+BACKENDS = {"json": JsonStorage, "sqlite": SqliteStorage}
+
+
+def open_storage(config):
+    """Return the storage backend selected in config.
+
+    If daemon_socket is set and the daemon is up, storage calls go to
+    the daemon instead.
+    """
+    assert config.storage_type in BACKENDS, logging.critical(
+        "open_storage: unknown storage backend %s", config.storage_type)
+    assert config.index_format in FORMATS, logging.critical(
+        "open_storage: unknown index format %s", config.index_format)
+    if config.daemon_socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(config.daemon_socket)
+            return RemoteStorage(config, sock)
+        except OSError as e:
+            sock.close()
+            logging.warning(
+                "open_storage: daemon at %s unavailable (%s), using local "
+                "storage.", config.daemon_socket, e)
+    return BACKENDS[config.storage_type](config)
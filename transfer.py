@@ -0,0 +1,271 @@
+"""
+Export and import of boards, for backups and moving boards between chans.
+
+An export is a text file with one JSON list per line, after a
+"sshchan-export <version>" header line:
+
+    ["board", name, description, number of its last post]
+    ["t", timestamp, post_no, subject, text]
+    ["r", timestamp, post_no, thread_id, text]
+    ...
+    ["end", boards, posts]
+
+A board line is followed by the board's posts, thread by thread, in the
+same records as the board log of the JSON storage backend (see
+JsonStorage.appendLog()). Only the text of posts is exported, not how
+it was rendered. The end line tells a complete export from one that was
+cut short. Files ending in .gz are read and written gzip compressed.
+
+Both directions go thread by thread, so no board is ever held in memory
+as a whole, however big. Exports read boards through iterThreads() of
+the storage backend. Imports read the file twice: first to check it and
+collect the post numbers of every board, which renumber() needs, then
+to hand the threads of each board to appendThreads() as they're read,
+which writes them in batches rather than post by post.
+
+Copyright (c) 2015
+makos <https://github.com/makos>, chibi <http://neetco.de/chibi>
+under GNU GPL v3, see LICENSE for details
+"""
+
+import array
+import bisect
+import gzip
+import json
+import logging
+import re
+
+from boards import Board
+
+# Version of the export format.
+EXPORT_VERSION = 1
+HEADER = "sshchan-export {}\n".format(EXPORT_VERSION)
+# References to other posts, as in chan_mark.Marker.
+QUOTE = re.compile(r">>([0-9]+)")
+# How many times load_board() renumbers a board's posts because others
+# were posted meanwhile before it gives up.
+LOAD_ATTEMPTS = 5
+
+
+def open_dump(path, mode):
+    """Open an export for writing ('w') or reading ('rb').
+
+    Exports are read as bytes, so where a board starts can be told
+    with tell() and gone back to with seek().
+    """
+    if path.endswith(".gz"):
+        if 'b' in mode:
+            return gzip.open(path, mode)
+        return gzip.open(path, mode + 't', compresslevel=6,
+                         encoding="utf-8")
+    if 'b' in mode:
+        return open(path, mode)
+    return open(path, mode, encoding="utf-8")
+
+
+def dump_line(f, record):
+    f.write(json.dumps(record, separators=(',', ':'), ensure_ascii=False)
+            + "\n")
+
+
+def export_boards(config, path, names):
+    """Write boards names to an export at path.
+
+    Returns [name, number of posts] of every board.
+    """
+    boardlist = config.getBoardlist()
+    exported = []
+    with open_dump(path, 'w') as f:
+        f.write(HEADER)
+        for name in names:
+            board = Board(name, config=config)
+            dump_line(f, ["board", name, boardlist[name],
+                          board.getPostnum()])
+            posts = 0
+            for thread in board.iterThreads():
+                op = thread[2]
+                dump_line(f, ["t", op[0], op[1], thread[1], op[2]])
+                for post in thread[3:]:
+                    dump_line(f, ["r", post[0], post[1], thread[0], post[2]])
+                posts += len(thread) - 2
+            exported.append([name, posts])
+            logging.info("export_boards: exported /%s/ to %s.", name, path)
+        dump_line(f, ["end", len(exported),
+                      sum(posts for _, posts in exported)])
+    return exported
+
+
+def renumber(thread, offset, numbers):
+    """Return thread with every post number offset by offset.
+
+    References to posts in numbers, a sorted array of the post numbers
+    of the thread's board, are changed in the text to match, others are
+    left alone.
+    """
+    def quote(match):
+        post_no = int(match.group(1))
+        position = bisect.bisect_left(numbers, post_no)
+        if position < len(numbers) and numbers[position] == post_no:
+            return ">>{}".format(post_no + offset)
+        return match.group(0)
+
+    return [thread[0] + offset, thread[1]] + [
+        [post[0], post[1] + offset, QUOTE.sub(quote, post[2])]
+        for post in thread[2:]]
+
+
+def read_threads(path, start):
+    """Yield the threads of the board whose line starts at start.
+
+    The export must have been checked with check_export() already.
+    """
+    with open_dump(path, 'rb') as f:
+        f.seek(start)
+        f.readline()  # The board line.
+        thread = None
+        for line in f:
+            record = json.loads(line)
+            if record[0] == "t":
+                if thread is not None:
+                    yield thread
+                thread = [record[2], record[3], [record[1], record[2],
+                                                 record[4]]]
+            elif record[0] == "r":
+                thread.append([record[1], record[2], record[4]])
+            else:
+                break
+        if thread is not None:
+            yield thread
+
+
+def check_export(path, names=None):
+    """Read through an export, return the boards to import and any error.
+
+    Returns a list of [name, description, postnum, post numbers, start]
+    of every complete board up to the first damage, post numbers being
+    a sorted array and start where the board's line is in the file
+    (see read_threads()), and a ValueError telling what's wrong with the
+    file, None if nothing. names is as in import_boards().
+    """
+    boards = []
+    # The board being read, None while skipping a board.
+    current = None
+    thread_id = 0
+
+    def finish():
+        if current is None:
+            return None
+        numbers = array.array('q', sorted(current[3]))
+        for n in range(1, len(numbers)):
+            if numbers[n] == numbers[n - 1]:
+                return ValueError("{}: post number {} used twice on /{}/"
+                                  .format(path, numbers[n], current[0]))
+        current[3] = numbers
+        boards.append(current)
+        return None
+
+    with open_dump(path, 'rb') as f:
+        line = f.readline()
+        if line != HEADER.encode():
+            raise ValueError("{} is not an sshchan export".format(path))
+        start = len(line)
+        for line_no, line in enumerate(f, 2):
+            try:
+                record = json.loads(line)
+                kind = record[0]
+            except (ValueError, IndexError):
+                return boards, ValueError("{}:{}: bad line".format(
+                    path, line_no))
+            if kind == "board":
+                error = finish()
+                if error is not None:
+                    return boards, error
+                name = record[1]
+                if names is not None:
+                    name = names.get(name)
+                current = None
+                if name is not None:
+                    current = [name, record[2], record[3],
+                               array.array('q'), start]
+                thread_id = 0
+            elif kind in ("t", "r"):
+                if current is not None:
+                    _, timestamp, post_no, target, text = record
+                    if kind == "t":
+                        if post_no <= thread_id:
+                            return boards, ValueError(
+                                "{}:{}: thread {} is out of order".format(
+                                    path, line_no, post_no))
+                        thread_id = post_no
+                    elif target != thread_id:
+                        return boards, ValueError(
+                            "{}:{}: reply to thread {} away from it".format(
+                                path, line_no, target))
+                    current[3].append(post_no)
+            elif kind == "end":
+                return boards, finish()
+            start += len(line)
+    return boards, ValueError("{} ends early, the last board was not "
+                              "imported".format(path))
+
+
+def load_board(config, name, desc, postnum, numbers, read):
+    """Add the threads read() yields to board name, return the offset.
+
+    numbers is the sorted array of the threads' post numbers. The board
+    is created if it doesn't exist. Posts keep their numbers if they
+    come after the board's last post, otherwise they're all renumbered
+    to follow it, keeping their order and the gaps between them. The
+    offset their numbers were moved by is returned.
+
+    Raises ValueError if the storage backend refuses the posts, or if
+    the board gets new posts every time they're renumbered.
+    """
+    board = Board(name, desc, config)
+    if numbers:
+        postnum = max(postnum, numbers[-1])
+    for _ in range(LOAD_ATTEMPTS):
+        offset = 0
+        if numbers:
+            # The first thread's OP has the smallest number.
+            offset = max(0, board.getPostnum() + 1 - numbers[0])
+        threads = read()
+        if offset:
+            threads = (renumber(thread, offset, numbers)
+                       for thread in threads)
+        try:
+            appended = board.appendThreads(threads, postnum + offset)
+        except RuntimeError as e:
+            # The daemon's errors, see RemoteStorage.call().
+            raise ValueError("/{}/: {}".format(name, e))
+        if appended:
+            return offset
+        # Somebody posted on the board meanwhile, numbers are taken.
+        logging.info("load_board: /%s/ got new posts, renumbering again.",
+                     name)
+    raise ValueError("/{}/ kept getting new posts, it was not imported, "
+                     "try again later".format(name))
+
+
+def import_boards(config, path, names=None):
+    """Add boards from an export at path to the chan.
+
+    names maps boards of the export to the board to add them to, None
+    imports every board under its own name. Returns [name, number of
+    posts, offset their numbers were moved by] of every board imported.
+    The file is checked before anything is imported (see
+    check_export()). Raises ValueError if it isn't a complete export, a
+    post number comes up twice on a board, or a board can't be added
+    (see load_board()). Boards before the damage, or before the board
+    that couldn't be added, are imported nevertheless.
+    """
+    boards, error = check_export(path, names)
+    imported = []
+    for name, desc, postnum, numbers, start in boards:
+        offset = load_board(config, name, desc, postnum, numbers,
+                            lambda: read_threads(path, start))
+        imported.append([name, len(numbers), offset])
+        logging.info("import_boards: imported /%s/ from %s.", name, path)
+    if error is not None:
+        raise error
+    return imported